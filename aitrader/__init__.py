@@ -11,6 +11,7 @@ from .history import HistoryStore
 from .llm import LLMError, LLMRouter, PersonaVote
 from .market import MarketSnapshot, fetch_market_snapshot
 from .personas import PERSONAS, Persona
+from .series import CandleSeries
 from .trader import Trader
 
 __all__ = [
@@ -23,6 +24,7 @@ __all__ = [
     "PersonaVote",
     "MarketSnapshot",
     "fetch_market_snapshot",
+    "CandleSeries",
     "PERSONAS",
     "Persona",
     "Trader",
@@ -7,6 +7,7 @@
     python -m aitrader --collect    # 市況データの収集のみ(LLM・売買なし)
     python -m aitrader --report     # 仮想P&L(協議会・ペルソナ別)を表示して終了
     python -m aitrader --dashboard  # ダッシュボードHTMLを生成して終了
+    python -m aitrader --backfill 14  # 直近14日分の1分足を一括取得して履歴DBへ(最大31日)
 """
 
 import argparse
@@ -14,6 +15,7 @@ import logging
 import os
 from pathlib import Path
 
+from .backfill import backfill
 from .bot import run_collect, run_loop, run_once, update_dashboard
 from .config import Config
 from .council import Council
@@ -56,8 +58,26 @@ def main():
     parser.add_argument("--dashboard", action="store_true",
                         help="ダッシュボードHTMLを生成して終了する"
                              "(出力先: AITRADER_DASHBOARD_PATH、未設定なら aitrader_dashboard.html)")
+    parser.add_argument("--backfill", type=float, metavar="DAYS",
+                        help="直近DAYS日分(最大31日)の約定から1分足を組み立てて履歴DBへ投入する")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="--backfill の並列ダウンロード数(既定4)")
     args = parser.parse_args()
 
+    if args.backfill is not None:
+        if args.backfill <= 0:
+            parser.error("--backfill には0より大きい日数を指定してください")
+        if args.workers < 1:
+            parser.error("--workers には1以上を指定してください")
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        )
+        result = backfill(Config(), args.backfill, workers=args.workers)
+        print(f"バックフィル完了: 約定 {result['executions']}件 → "
+              f"1分足 {result['minutes']}本 ({result['elapsed_sec']:.0f}秒)")
+        return
+
     if args.dashboard:
         path = write_dashboard(Config())
         print(f"ダッシュボードを書き出しました: {path}")
@@ -89,7 +109,7 @@ def main():
         config.validate_for_trading()
         council = Council(config)
         trader = Trader(config)
-        store = HistoryStore(config.history_path)
+        store = HistoryStore.from_config(config)
         paper = PaperBook.from_config(config)
         try:
             run_once(config, council, trader, store=store, paper=paper)
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""実口座の差分同期(プライベートAPI → 履歴DB)。
+
+実際の注文・約定・残高・手数料はプライベートAPIを都度叩かないと
+見えなかった。AccountSync はそれらを履歴DBのローカルテーブルへ
+IDカーソルで差分取り込みし、残高チェック(Trader.check_risk)・
+ダッシュボード・仮想台帳との突き合わせがローカルを読むようにする:
+
+  account_orders              getchildorders(ACTIVEのものは次回も取り直す)
+  account_executions          プライベート getexecutions(手数料つき)
+  account_balance_history     getbalancehistory(通貨ごと)
+  account_collateral_history  getcollateralhistory(証拠金取引の口座のみ)
+  account_balances            getbalance の最新値と同期時刻
+  account_cursor              各ストリームの取り込み済み最新ID
+  account_synced              全ストリームを最後に同期した時刻
+
+初回同期は直近 INITIAL_ITEMS 件までしか遡らない(全履歴の取り込みは
+しない)。以降は前回の最新IDより新しい分だけを取得する。全ストリームの
+同期はプライベートAPIを6回以上呼ぶため、sync(max_age=...) は前回から
+max_age 秒以内なら何もしない。発注後など残高だけが古くなったときは
+refresh_balances() で getbalance を1回だけ呼んで読み直す。
+"""
+
+import logging
+import sqlite3
+import time
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+
+class AccountSync:
+    # 初回同期で各ストリームを遡る件数の上限
+    INITIAL_ITEMS = 500
+    PAGE_SIZE = 500
+
+    def __init__(self, api, conn, product_code: str, currencies=("JPY",)):
+        self.api = api
+        self.conn = conn
+        self.product_code = product_code
+        self.currencies = tuple(dict.fromkeys(currencies))  # 重複除去・順序維持
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS account_cursor (
+                stream TEXT PRIMARY KEY,      -- "executions:BTC_JPY" など
+                last_id INTEGER NOT NULL      -- 取り込み済みの最新ID
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS account_orders (
+                id INTEGER PRIMARY KEY,
+                product_code TEXT NOT NULL,
+                child_order_id TEXT NOT NULL,
+                acceptance_id TEXT NOT NULL,
+                parent_order_id TEXT,
+                side TEXT NOT NULL,
+                order_type TEXT NOT NULL,
+                price REAL NOT NULL,
+                average_price REAL NOT NULL,
+                size REAL NOT NULL,
+                state TEXT NOT NULL,         -- ACTIVE / COMPLETED / CANCELED ...
+                executed_size REAL NOT NULL,
+                commission REAL NOT NULL,
+                order_date TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS account_executions (
+                id INTEGER PRIMARY KEY,
+                product_code TEXT NOT NULL,
+                side TEXT NOT NULL,
+                price REAL NOT NULL,
+                size REAL NOT NULL,
+                commission REAL NOT NULL,
+                exec_date TEXT NOT NULL,
+                child_order_id TEXT NOT NULL,
+                acceptance_id TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS account_balance_history (
+                id INTEGER NOT NULL,
+                currency_code TEXT NOT NULL,
+                event_date TEXT NOT NULL,
+                product_code TEXT,
+                trade_type TEXT NOT NULL,    -- BUY / SELL / DEPOSIT / FEE ...
+                price REAL NOT NULL,
+                amount REAL NOT NULL,
+                quantity REAL NOT NULL,
+                commission REAL NOT NULL,
+                balance REAL NOT NULL,
+                order_id TEXT,
+                PRIMARY KEY (currency_code, id)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS account_collateral_history (
+                id INTEGER PRIMARY KEY,
+                currency_code TEXT NOT NULL,
+                change REAL NOT NULL,
+                amount REAL NOT NULL,
+                reason_code TEXT NOT NULL,
+                date TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS account_balances (
+                currency_code TEXT PRIMARY KEY,
+                amount REAL NOT NULL,
+                available REAL NOT NULL,
+                synced_at REAL NOT NULL      -- 取得時刻(epoch秒。0=要再取得)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS account_synced (
+                product_code TEXT PRIMARY KEY,
+                synced_at REAL NOT NULL      -- 全ストリームの同期時刻(epoch秒)
+            )
+        """)
+        self.conn.commit()
+
+    @classmethod
+    def from_config(cls, config, api, conn) -> "AccountSync":
+        return cls(api, conn, config.product_code,
+                   currencies=("JPY", config.base_currency))
+
+    # --- カーソル ---
+
+    def _cursor(self, stream: str):
+        row = self.conn.execute(
+            "SELECT last_id FROM account_cursor WHERE stream = ?", (stream,)).fetchone()
+        return row[0] if row else None
+
+    def _set_cursor(self, stream: str, last_id: int):
+        self.conn.execute("""
+            INSERT INTO account_cursor (stream, last_id) VALUES (?, ?)
+            ON CONFLICT (stream) DO UPDATE SET last_id = excluded.last_id
+        """, (stream, last_id))
+
+    def _walk(self, stream: str, fetch, after_id=None, **params) -> list:
+        """カーソル(または after_id)より新しい行を新しい順に全て取得する。
+
+        カーソル未設定(初回)は直近 INITIAL_ITEMS 件で打ち切る。
+        """
+        cursor = self._cursor(stream)
+        after = cursor if after_id is None else after_id
+        items = self.api.paginate(fetch, page_size=self.PAGE_SIZE,
+                                  after_id=after, **params)
+        if cursor is None:
+            items = islice(items, self.INITIAL_ITEMS)
+        rows = list(items)
+        if rows:
+            self._set_cursor(stream, max(max(r["id"] for r in rows), cursor or 0))
+        return rows
+
+    # --- 同期 ---
+
+    def last_synced(self):
+        """全ストリームを最後に同期した時刻(epoch秒)。未同期なら None。"""
+        row = self.conn.execute(
+            "SELECT synced_at FROM account_synced WHERE product_code = ?",
+            (self.product_code,)).fetchone()
+        return row[0] if row else None
+
+    def sync(self, max_age: float = None):
+        """全ストリームを差分同期し、ストリームごとの取り込み件数を返す。
+
+        max_age を指定すると、前回の同期から max_age 秒以内なら API を
+        呼ばずに None を返す。
+        """
+        last = self.last_synced()
+        if max_age is not None and last is not None and time.time() - last < max_age:
+            return None
+        counts = {
+            "orders": self._sync_orders(),
+            "executions": self._sync_executions(),
+            "balance_history": sum(self._sync_balance_history(c)
+                                   for c in self.currencies),
+            "collateral_history": self._sync_collateral_history(),
+            "balances": self._sync_balances(),
+        }
+        self.conn.execute("""
+            INSERT OR REPLACE INTO account_synced (product_code, synced_at)
+            VALUES (?, ?)
+        """, (self.product_code, time.time()))
+        self.conn.commit()
+        return counts
+
+    def _sync_orders(self) -> int:
+        # ACTIVE のまま取り込んだ注文は状態が変わるので、最古の ACTIVE から取り直す
+        stream = f"orders:{self.product_code}"
+        row = self.conn.execute("""
+            SELECT MIN(id) FROM account_orders
+            WHERE product_code = ? AND state = 'ACTIVE'
+        """, (self.product_code,)).fetchone()
+        after_id = None
+        if row[0] is not None:
+            cursor = self._cursor(stream)
+            after_id = min(row[0] - 1, cursor) if cursor is not None else row[0] - 1
+        rows = self._walk(stream, self.api.getchildorders, after_id=after_id,
+                          product_code=self.product_code)
+        self.conn.executemany("""
+            INSERT OR REPLACE INTO account_orders
+                (id, product_code, child_order_id, acceptance_id, parent_order_id,
+                 side, order_type, price, average_price, size, state,
+                 executed_size, commission, order_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(r["id"], self.product_code, r.get("child_order_id", ""),
+               r.get("child_order_acceptance_id", ""), r.get("parent_order_id"),
+               r["side"], r.get("child_order_type", ""),
+               float(r.get("price") or 0.0), float(r.get("average_price") or 0.0),
+               float(r["size"]), r["child_order_state"],
+               float(r.get("executed_size") or 0.0),
+               float(r.get("total_commission") or 0.0),
+               r.get("child_order_date", "")) for r in rows])
+        return len(rows)
+
+    def _sync_executions(self) -> int:
+        rows = self._walk(f"executions:{self.product_code}", self.api.getexecutions,
+                          product_code=self.product_code)
+        self.conn.executemany("""
+            INSERT OR REPLACE INTO account_executions
+                (id, product_code, side, price, size, commission, exec_date,
+                 child_order_id, acceptance_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(r["id"], self.product_code, r["side"], float(r["price"]),
+               float(r["size"]), float(r.get("commission") or 0.0), r["exec_date"],
+               r.get("child_order_id", ""), r.get("child_order_acceptance_id", ""))
+              for r in rows])
+        return len(rows)
+
+    def _sync_balance_history(self, currency: str) -> int:
+        rows = self._walk(f"balance:{currency}", self.api.getbalancehistory,
+                          currency_code=currency)
+        self.conn.executemany("""
+            INSERT OR REPLACE INTO account_balance_history
+                (id, currency_code, event_date, product_code, trade_type, price,
+                 amount, quantity, commission, balance, order_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(r["id"], currency, r.get("event_date", ""), r.get("product_code"),
+               r.get("trade_type", ""), float(r.get("price") or 0.0),
+               float(r.get("amount") or 0.0), float(r.get("quantity") or 0.0),
+               float(r.get("commission") or 0.0), float(r.get("balance") or 0.0),
+               r.get("order_id")) for r in rows])
+        return len(rows)
+
+    def _sync_collateral_history(self) -> int:
+        rows = self._walk("collateral", self.api.getcollateralhistory)
+        self.conn.executemany("""
+            INSERT OR REPLACE INTO account_collateral_history
+                (id, currency_code, change, amount, reason_code, date)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(r["id"], r.get("currency_code", "JPY"), float(r.get("change") or 0.0),
+               float(r.get("amount") or 0.0), r.get("reason_code", ""),
+               r.get("date", "")) for r in rows])
+        return len(rows)
+
+    def _sync_balances(self) -> int:
+        now = time.time()
+        rows = [(b["currency_code"], float(b.get("amount") or 0.0),
+                 float(b.get("available") or 0.0), now)
+                for b in self.api.getbalance() or []]
+        self.conn.executemany("""
+            INSERT OR REPLACE INTO account_balances
+                (currency_code, amount, available, synced_at)
+            VALUES (?, ?, ?, ?)
+        """, rows)
+        return len(rows)
+
+    # --- ローカル参照 ---
+
+    def balances(self, max_age: float = None):
+        """{通貨: 利用可能残高}。max_age 秒より古い(または未同期)なら None。"""
+        rows = self.conn.execute(
+            "SELECT currency_code, available, synced_at FROM account_balances"
+        ).fetchall()
+        if not rows:
+            return None
+        if max_age is not None and time.time() - min(r[2] for r in rows) > max_age:
+            return None
+        return {code: available for code, available, _synced in rows}
+
+    def refresh_balances(self) -> dict:
+        """getbalance を1回だけ呼んで残高のローカル値を更新し、それを返す。"""
+        self._sync_balances()
+        self.conn.commit()
+        return self.balances() or {}
+
+    def invalidate(self):
+        """発注直後など、残高のローカル値を使わせたくないときに呼ぶ。"""
+        self.conn.execute("UPDATE account_balances SET synced_at = 0")
+        self.conn.commit()
+
+
+def reconcile(conn, product_code: str, base_currency: str) -> dict:
+    """同期済みの実口座と協議会の仮想台帳を突き合わせる(ダッシュボード・ログ用)。
+
+    実残高には協議会以外の保有分も含まれるため、差分は「ずれの目安」。
+    同期前(テーブル未作成・残高なし)は None を返す。
+    """
+    from .paper import COUNCIL_ACTOR
+
+    try:
+        row = conn.execute(
+            "SELECT amount, synced_at FROM account_balances WHERE currency_code = ?",
+            (base_currency,)).fetchone()
+        if row is None:
+            return None
+        fills, bought, sold, fees = conn.execute("""
+            SELECT COUNT(*),
+                   COALESCE(SUM(CASE WHEN side = 'BUY' THEN size END), 0),
+                   COALESCE(SUM(CASE WHEN side = 'SELL' THEN size END), 0),
+                   COALESCE(SUM(commission), 0)
+            FROM account_executions WHERE product_code = ?
+        """, (product_code,)).fetchone()
+        paper = conn.execute("""
+            SELECT position FROM paper_ledger WHERE actor = ?
+            ORDER BY ts DESC LIMIT 1
+        """, (COUNCIL_ACTOR,)).fetchone()
+    except sqlite3.OperationalError:  # 同期前でテーブル未作成
+        return None
+    real_position, synced_at = row
+    paper_position = paper[0] if paper else 0.0
+    return {"real_position": real_position, "paper_position": paper_position,
+            "diff": real_position - paper_position, "fills": fills,
+            "bought": bought, "sold": sold, "fees": fees, "synced_at": synced_at}
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""過去の約定から1分足を一括で組み立てて履歴DBへ流し込む(--backfill DAYS)。
+
+bitFlyerは約定履歴を直近31日分まで提供する。蓄積を待たずに中期データ
+(72時間の1時間足・14日の長期チャート)を初日から揃えるため:
+
+  1. 最新約定から DAYS 日前の位置(約定ID)を二分探索で求める
+     (count=1 の before 問い合わせを30回前後。約定IDは全銘柄共通の
+     連番なので時刻から直接は計算できない)
+  2. [開始ID, 終了ID] をID幅で等分し、各区間を並列にページングする
+     (送信ペースはクライアントのレート制限が全スレッド共通で守る)
+  3. 各区間は約定を保持せずその場で分単位に集計し、区間の境目で
+     分かれた分は約定IDの前後関係で厳密に結合する
+  4. 1分足を upsert_candles で一括投入する(既存の分は出来高の大きい方=
+     取りこぼしの少ない方を採用するので、蓄積済みデータと重なっても安全)
+
+終了IDは差分取り込みのカーソル(未記録なら最新約定)。カーソル未記録なら
+終了IDをカーソルとして記録し、以後の --collect はその続きから取り込む。
+ティックストアは追記専用のため、過去分の約定は保存しない(1分足のみ)。
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bitflyerapi import bitFlyerAPI, records
+
+from .history import HistoryStore
+from .series import Candle
+
+logger = logging.getLogger(__name__)
+
+MAX_DAYS = 31  # bitFlyerが提供する約定履歴の範囲
+
+# 開始位置の二分探索は、見つけた約定がこの時間内に収まれば打ち切る
+_SEARCH_TOLERANCE_MS = 60 * 1000
+
+
+def _exec_before(api, product_code: str, before_id: int):
+    """before_id 未満で最新の約定(records.Execution)。31日より前なら None。"""
+    rows = api.executions(product_code=product_code, count=1, before=before_id)
+    return records.Execution.from_dict(rows[0]) if rows else None
+
+
+def find_start_id(api, product_code: str, since_ms: int, newest_id: int,
+                  max_probes: int = 64) -> tuple:
+    """since_ms より前の最後の約定IDを二分探索で求める。
+
+    このIDを after に渡せば since_ms 以降の約定だけが返る(境目の
+    1分程度は前にずれてよい)。31日より前まで遡った場合は0。
+    戻り値: (約定ID, 使った問い合わせ回数)
+    """
+    lo, lo_ex = 1, None          # lo より前の最新約定は since より古い(または無い)
+    hi = newest_id + 1           # hi より前の最新約定は since 以降
+    probes = 0
+    while hi - lo > 1 and probes < max_probes:
+        if lo_ex is not None and since_ms - lo_ex.exec_ms <= _SEARCH_TOLERANCE_MS:
+            break
+        mid = (lo + hi) // 2
+        ex = _exec_before(api, product_code, mid)
+        probes += 1
+        if ex is None or ex.exec_ms < since_ms:
+            lo, lo_ex = mid, ex
+        else:
+            hi = ex.id + 1  # mid と ex.id の間には約定が無い
+    return (lo_ex.id if lo_ex is not None else 0), probes
+
+
+def _split(after_id: int, end_id: int, parts: int) -> list:
+    """(after_id, end_id] をID幅で等分した [(after, end), ...] (新しい区間から)。"""
+    parts = max(1, min(parts, end_id - after_id))
+    step = (end_id - after_id) / parts
+    bounds = [after_id + round(step * i) for i in range(parts)] + [end_id]
+    return [(bounds[i], bounds[i + 1]) for i in reversed(range(parts))]
+
+
+class _MinuteBuckets:
+    """約定を到着順によらず1分足に集計する(open/close は約定IDの前後で決める)。"""
+
+    def __init__(self):
+        # minute -> [open, high, low, close, volume, buy, sell, first_id, last_id]
+        self.buckets = {}
+
+    def add(self, ex):
+        minute = ex.exec_ms // 60000
+        b = self.buckets.get(minute)
+        price = ex.price
+        if b is None:
+            b = self.buckets[minute] = [price, price, price, price, 0.0, 0.0, 0.0,
+                                        ex.id, ex.id]
+        else:
+            if ex.id < b[7]:
+                b[0], b[7] = price, ex.id
+            if ex.id > b[8]:
+                b[3], b[8] = price, ex.id
+            if price > b[1]:
+                b[1] = price
+            if price < b[2]:
+                b[2] = price
+        b[4] += ex.size
+        if ex.side == "BUY":
+            b[5] += ex.size
+        elif ex.side == "SELL":
+            b[6] += ex.size
+
+    def merge(self, other: "_MinuteBuckets"):
+        for minute, o in other.buckets.items():
+            b = self.buckets.get(minute)
+            if b is None:
+                self.buckets[minute] = list(o)
+                continue
+            if o[7] < b[7]:
+                b[0], b[7] = o[0], o[7]
+            if o[8] > b[8]:
+                b[3], b[8] = o[3], o[8]
+            b[1] = max(b[1], o[1])
+            b[2] = min(b[2], o[2])
+            b[4] += o[4]
+            b[5] += o[5]
+            b[6] += o[6]
+
+    def candles(self) -> list:
+        return [Candle(time=records.minute_label(minute * 60000) + ":00Z",
+                       open=b[0], high=b[1], low=b[2], close=b[3], volume=b[4],
+                       buy_volume=b[5], sell_volume=b[6])
+                for minute, b in sorted(self.buckets.items())]
+
+
+def backfill(config, days: float, workers: int = 4, api: bitFlyerAPI = None,
+             store: HistoryStore = None, page_size: int = 500) -> dict:
+    """直近 days 日分(最大31日)の1分足を履歴DBへ一括投入し、集計を返す。
+
+    戻り値: {"executions", "pages", "probes", "minutes", "start_id", "end_id",
+             "elapsed_sec"}
+    """
+    if api is None:
+        with bitFlyerAPI(key="", secret="", pool_maxsize=max(10, workers),
+                         **config.bitflyer_options()) as own_api:
+            return backfill(config, days, workers=workers, api=own_api,
+                            store=store, page_size=page_size)
+    if store is None:
+        own_store = HistoryStore.from_config(config)
+        try:
+            return backfill(config, days, workers=workers, api=api,
+                            store=own_store, page_size=page_size)
+        finally:
+            own_store.close()
+
+    started = time.monotonic()
+    product_code = config.product_code
+    days = min(float(days), MAX_DAYS)
+    cursor = store.last_exec_id(product_code)
+    newest = api.executions(product_code=product_code, count=1)
+    if not newest:
+        return {"executions": 0, "pages": 1, "probes": 0, "minutes": 0,
+                "start_id": 0, "end_id": 0, "elapsed_sec": 0.0}
+    newest = records.Execution.from_dict(newest[0])
+    end_id = cursor if cursor is not None else newest.id
+    since_ms = newest.exec_ms - int(days * 86400000)
+    start_id, probes = find_start_id(api, product_code, since_ms, end_id)
+    logger.info("バックフィル: %s 直近%.1f日 (約定ID %d〜%d、開始位置の探索 %d回)",
+                product_code, days, start_id, end_id, probes)
+
+    lock = threading.Lock()
+    totals = {"executions": 0, "pages": 0}
+
+    def fetch(**params):
+        with lock:
+            totals["pages"] += 1
+        return api.executions(**params)
+
+    def download(bounds):
+        after, end = bounds
+        buckets = _MinuteBuckets()
+        count = 0
+        for row in api.paginate(fetch, page_size=page_size, after_id=after,
+                                before_id=end + 1, product_code=product_code):
+            buckets.add(records.Execution.from_dict(row))
+            count += 1
+        with lock:
+            totals["executions"] += count
+        logger.info("バックフィル: 約定ID %d〜%d の %d件を集計", after + 1, end, count)
+        return buckets
+
+    merged = _MinuteBuckets()
+    ranges = _split(start_id, end_id, workers * 2)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for buckets in pool.map(download, ranges):
+            merged.merge(buckets)
+
+    candles = merged.candles()
+    if candles:
+        store.upsert_candles(product_code, candles,
+                             last_exec_id=end_id if cursor is None else None)
+    elapsed = time.monotonic() - started
+    logger.info("バックフィル完了: 約定 %d件・%dページ → 1分足 %d本 (%.1f秒)",
+                totals["executions"], totals["pages"], len(candles), elapsed)
+    return {"executions": totals["executions"], "pages": totals["pages"] + probes + 1,
+            "probes": probes, "minutes": len(candles), "start_id": start_id,
+            "end_id": end_id, "elapsed_sec": elapsed}
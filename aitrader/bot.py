@@ -4,13 +4,18 @@
 import logging
 import time
 
+from bitflyerapi import bitFlyerAPI
+from bitflyerapi.metrics import MetricsCollector
+
 from . import guard
+from .account import AccountSync, reconcile
 from .config import Config
 from .council import Council
 from .dashboard import write_dashboard
 from .history import HistoryStore
 from .market import fetch_market_snapshot
 from .paper import PaperBook
+from .protect import ProtectiveOrders
 from .trader import Trader
 
 logger = logging.getLogger(__name__)
@@ -27,14 +32,129 @@ def update_dashboard(config: Config):
         logger.exception("ダッシュボード生成に失敗(処理は継続します)")
 
 
+def flush_api_metrics(metrics: MetricsCollector, store: HistoryStore):
+    """bitFlyer APIの計測(エンドポイント別の回数・遅延・再試行)をログに出し、
+    履歴DBの api_metrics テーブルへ書き出す(失敗しても売買処理には影響させない)。"""
+    if not metrics.stats():
+        return
+    logger.info("API計測: %s", metrics.summary())
+    try:
+        metrics.dump_sqlite(store.conn)
+    except Exception:
+        logger.exception("API計測の書き出しに失敗(処理は継続します)")
+
+
+def sync_account(config: Config, trader: Trader, paper: PaperBook,
+                 history: bool = True):
+    """残高チェックをローカル参照にし、history なら実口座を履歴DBへ差分同期する。
+
+    履歴の同期(プライベートAPI 6回以上)は --collect だけで行い、前回から
+    account_max_age_sec 秒以内なら省く。売買サイクルは残高をローカルから
+    読み、古ければ getbalance を1回だけ呼ぶ(Trader.get_balances)。
+    APIキーが無い・無効化されている場合は何もしない(失敗しても売買処理には
+    影響させない。その場合は従来どおりプライベートAPIに問い合わせる)。
+    """
+    if paper is None or trader.api is None or not config.account_sync:
+        return
+    if trader.account is None:
+        trader.account = AccountSync.from_config(config, trader.api, paper.conn)
+    if not history:
+        return
+    try:
+        counts = trader.account.sync(max_age=config.account_max_age_sec)
+    except Exception:
+        logger.exception("実口座の同期に失敗(処理は継続します)")
+        return
+    if counts is None:
+        logger.debug("実口座同期: 前回から%d秒以内のため省略", config.account_max_age_sec)
+        return
+    logger.info("実口座同期: 注文 %d / 約定 %d / 残高履歴 %d / 証拠金履歴 %d 件",
+                counts["orders"], counts["executions"], counts["balance_history"],
+                counts["collateral_history"])
+    state = reconcile(paper.conn, config.product_code, config.base_currency)
+    if state is not None and abs(state["diff"]) > 1e-8:
+        logger.info("実口座と仮想台帳の差: 実残高 %.6f / 台帳 %.6f %s (差 %+.6f)",
+                    state["real_position"], state["paper_position"],
+                    config.base_currency, state["diff"])
+
+
+def protective_orders(config: Config, trader: Trader, paper: PaperBook):
+    """保護注文の管理オブジェクト。無効(または台帳なし)なら None。"""
+    if paper is None:
+        return None
+    protection = ProtectiveOrders(config, trader, paper.conn)
+    return protection if protection.enabled else None
+
+
+def sync_protection(protection: ProtectiveOrders, paper: PaperBook, snapshot):
+    """保護注文の約定を台帳に反映する(失敗しても売買処理には影響させない)。"""
+    if protection is None:
+        return
+    try:
+        protection.sync(paper, snapshot)
+    except Exception:
+        logger.exception("保護注文の状態確認に失敗(処理は継続します)")
+
+
+def refresh_protection(protection: ProtectiveOrders, paper: PaperBook, snapshot):
+    """保護注文を台帳のポジションに合わせて置き直す(失敗しても処理は継続)。"""
+    if protection is None:
+        return
+    try:
+        protection.refresh(paper.council_state(), paper, snapshot)
+    except Exception:
+        logger.exception("保護注文の更新に失敗(処理は継続します)")
+
+
+def execute_stop_loss(config: Config, trader: Trader, paper: PaperBook,
+                      protection: ProtectiveOrders, snapshot, reason: str) -> dict:
+    """ガードのルール損切り: 保護注文を取り消して成行SELLし、台帳をクローズする。
+
+    台帳は成行SELLが通ったとき(ドライランでは常に)だけクローズする。
+    発注できなかった場合は台帳にポジションを残し、次回のガードで再試行させる。
+    """
+    if protection is not None:
+        try:
+            protection.cancel(paper, snapshot)  # 拘束中の残高を解放してから成行SELL
+        except Exception:
+            logger.exception("保護注文の取消に失敗(損切りSELLは続行します)")
+    # 取消の確認で保護注文の約定が見つかれば、台帳はここで既にクローズされている
+    size = paper.council_state()["position"]
+    if size <= 0:
+        return {"executed": False, "reason": "売却数量なし", "order": None}
+    try:
+        result = trader.close_position(size)
+    except Exception as e:
+        logger.exception("損切りSELLに失敗(台帳はクローズしません)")
+        return {"executed": False, "reason": f"損切り発注失敗: {e}", "order": None}
+    logger.warning("損切り執行: %s", result["reason"])
+    if result["executed"] or config.dry_run:
+        paper.record_guard_exit(snapshot, reason)
+    return result
+
+
 def run_once(config: Config, council: Council, trader: Trader,
-             store: HistoryStore = None, paper: PaperBook = None) -> dict:
+             store: HistoryStore = None, paper: PaperBook = None,
+             api: bitFlyerAPI = None) -> dict:
     """1サイクル実行して結果を返す。"""
-    snapshot = fetch_market_snapshot(config.product_code, store=store)
+    if api is None:
+        with bitFlyerAPI(key="", secret="", **config.bitflyer_options()) as own_api:
+            return run_once(config, council, trader, store=store, paper=paper,
+                            api=own_api)
+
+    snapshot = fetch_market_snapshot(config.product_code, store=store, api=api,
+                                     horizon_min=config.exec_horizon_min,
+                                     max_pages=config.exec_max_pages,
+                                     ingest_max_pages=config.ingest_max_pages)
     logger.info("現在値: %.0f JPY (RSI=%.1f, 15分騰落 %+.2f%%, 履歴 %d時間分)",
                 snapshot.ltp, snapshot.rsi_14, snapshot.change_pct_15m,
                 snapshot.history_hours)
 
+    sync_account(config, trader, paper, history=False)
+    # 前回から保護注文が約定していれば、協議の前に台帳をクローズしておく
+    protection = protective_orders(config, trader, paper)
+    sync_protection(protection, paper, snapshot)
+
     position = None
     if paper is not None:
         try:
@@ -48,8 +168,14 @@ def run_once(config: Config, council: Council, trader: Trader,
     if paper is not None:
         paper.record_cycle(snapshot, decision)
 
+    if protection is not None and decision.decision == "SELL":
+        try:
+            protection.cancel(paper, snapshot)  # 保護注文が売却可能残高を拘束しているため
+        except Exception:
+            logger.exception("保護注文の取消に失敗(SELLは残高不足になる可能性があります)")
     result = trader.execute(decision.decision)
     logger.info("執行結果: %s", result["reason"])
+    refresh_protection(protection, paper, snapshot)
 
     update_dashboard(config)
     return {"snapshot": snapshot, "decision": decision, "result": result}
@@ -61,14 +187,27 @@ def run_collect(config: Config):
     - 1分足を蓄積し、ダッシュボードを更新する(従来の --collect)
     - ガード判定(guard.py): ルール損切り / 急変時の臨時協議会
     """
-    store = HistoryStore(config.history_path)
+    store = HistoryStore.from_config(config)
     paper = PaperBook.from_config(config)
+    metrics = MetricsCollector()
+    public_api = bitFlyerAPI(key="", secret="", observers=[metrics],
+                             **config.bitflyer_options())
     try:
         snapshot = fetch_market_snapshot(config.product_code, store=store,
-                                         include_macro=False)
-        logger.info("収集完了: 現在値 %.0f JPY / 1分足%d本 / 履歴 %d時間分",
+                                         include_macro=False, api=public_api,
+                                         horizon_min=config.exec_horizon_min,
+                                         max_pages=config.exec_max_pages,
+                                         ingest_max_pages=config.ingest_max_pages)
+        logger.info("収集完了: 現在値 %.0f JPY / 1分足%d本 / 履歴 %d時間分 "
+                    "(約定 %d件・%dページ・%.0f分)",
                     snapshot.ltp, len(snapshot.candles_1m),
-                    snapshot.history_hours)
+                    snapshot.history_hours, snapshot.exec_count,
+                    snapshot.exec_pages, snapshot.exec_coverage_min)
+
+        trader = Trader(config)
+        sync_account(config, trader, paper)
+        protection = protective_orders(config, trader, paper)
+        sync_protection(protection, paper, snapshot)
 
         try:
             action, reason = guard.evaluate(
@@ -79,17 +218,19 @@ def run_collect(config: Config):
 
         if action == guard.ACTION_STOP_LOSS:
             logger.warning("ガード発動: %s", reason)
-            size = paper.record_guard_exit(snapshot, reason)
-            result = Trader(config).close_position(size)
-            logger.warning("損切り執行: %s", result["reason"])
+            execute_stop_loss(config, trader, paper, protection, snapshot, reason)
         elif action == guard.ACTION_EMERGENCY:
             logger.warning("ガード発動: %s → 臨時協議会を開催します", reason)
-            run_once(config, Council(config), Trader(config),
-                     store=store, paper=paper)
+            run_once(config, Council(config), trader,
+                     store=store, paper=paper, api=public_api)
             return  # run_once がダッシュボードまで更新済み
         elif reason:
             logger.info("ガード: %s", reason)
+        # 失効・取消された保護注文はここで置き直す
+        refresh_protection(protection, paper, snapshot)
     finally:
+        public_api.close()
+        flush_api_metrics(metrics, store)
         store.close()
         paper.close()
 
@@ -106,8 +247,14 @@ def run_loop(config: Config = None):
 
     council = Council(config)
     trader = Trader(config)
-    store = HistoryStore(config.history_path)
+    store = HistoryStore.from_config(config)
     paper = PaperBook.from_config(config)
+    # 公開API用クライアントはループ全体で1つ(接続プールをサイクル間で再利用)
+    metrics = MetricsCollector()
+    public_api = bitFlyerAPI(key="", secret="", observers=[metrics],
+                             **config.bitflyer_options())
+    if trader.api is not None:
+        trader.api.add_observer(metrics)
 
     mode = "ドライラン(実注文なし)" if config.dry_run else "実売買"
     logger.info("AI協議会トレーダー起動 [%s] 銘柄=%s 間隔=%d秒 注文サイズ=%.4f %s 履歴DB=%s",
@@ -117,13 +264,16 @@ def run_loop(config: Config = None):
     try:
         while True:
             try:
-                run_once(config, council, trader, store=store, paper=paper)
+                run_once(config, council, trader, store=store, paper=paper,
+                         api=public_api)
             except KeyboardInterrupt:
                 logger.info("停止します")
                 break
             except Exception:
                 logger.exception("サイクル実行中にエラー。次の周期で再試行します。")
+            flush_api_metrics(metrics, store)
             time.sleep(config.interval_sec)
     finally:
+        public_api.close()
         store.close()
         paper.close()
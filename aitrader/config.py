@@ -27,6 +27,50 @@ class Config:
     bitflyer_key: str = field(default_factory=lambda: os.environ.get("BITFLYER_API_KEY", ""))
     bitflyer_secret: str = field(default_factory=lambda: os.environ.get("BITFLYER_API_SECRET", ""))
     product_code: str = field(default_factory=lambda: os.environ.get("AITRADER_PRODUCT_CODE", "BTC_JPY"))
+    # クライアント側のレート制限(公開/プライベートで別バケツ)。上限に達すると
+    # エラーにせず待って送る。rate_limit_path にSQLiteファイルを指定すると
+    # cronで並走する銘柄別インスタンス同士でも同じ予算を共有する(空ならプロセス内のみ)
+    rate_limit: bool = field(default_factory=lambda: _env_bool("AITRADER_RATE_LIMIT", True))
+    rate_limit_path: str = field(default_factory=lambda: os.environ.get("AITRADER_RATE_LIMIT_PATH", ""))
+    # 一時的な5xx・429・通信エラーはGETに限り指数バックオフで再試行する
+    # (注文は二重発注を避けるため再試行しない)。1回のAPI呼び出しにかける
+    # 時間の上限(秒, 再試行込み)。0なら上限なし
+    http_retries: int = field(default_factory=lambda: int(os.environ.get("AITRADER_HTTP_RETRIES", "3")))
+    http_deadline_sec: float = field(default_factory=lambda: float(os.environ.get(
+        "AITRADER_HTTP_DEADLINE_SEC", "30")))
+
+    # 変化の遅いエンドポイント(板状態・銘柄一覧・手数料率など)の応答キャッシュ。
+    # http_cache_path にSQLiteファイルを指定すると並走インスタンス間で共有する
+    http_cache: bool = field(default_factory=lambda: _env_bool("AITRADER_HTTP_CACHE", False))
+    http_cache_path: str = field(default_factory=lambda: os.environ.get("AITRADER_HTTP_CACHE_PATH", ""))
+
+    # HTTPの記録・再生(カセット)。cassette_path を指定すると mode=record で
+    # bitFlyer・マクロ取得の全リクエスト/レスポンスを gzip JSONL に追記し、
+    # mode=replay でネットワークに出ずにそのカセットから応答する
+    # (オフラインでの再現実行・ベンチマーク用)
+    cassette_path: str = field(default_factory=lambda: os.environ.get("AITRADER_CASSETTE", ""))
+    cassette_mode: str = field(default_factory=lambda: os.environ.get("AITRADER_CASSETTE_MODE", "replay"))
+    # bitFlyer APIの接続先。負荷試験ではローカルのモック
+    # (python -m bitflyerapi.mockserver)を指す。空なら本番
+    bitflyer_url: str = field(default_factory=lambda: os.environ.get("AITRADER_BITFLYER_URL", ""))
+
+    def bitflyer_options(self) -> dict:
+        """bitFlyerAPI に渡す接続オプション(キー以外)。"""
+        options = {"rate_limit": self.rate_limit,
+                   "rate_limit_path": self.rate_limit_path or None,
+                   "max_retries": self.http_retries,
+                   "deadline": self.http_deadline_sec or None}
+        if self.http_cache or self.http_cache_path:
+            options["cache"] = True
+            options["cache_path"] = self.http_cache_path or None
+        if self.bitflyer_url:
+            options["top"] = self.bitflyer_url.rstrip("/")
+        if self.cassette_path:
+            from bitflyerapi.transport import cassette
+            options["transport"] = cassette(self.cassette_path, self.cassette_mode)
+            if self.cassette_mode == "replay":
+                options["rate_limit"] = False  # 再生はネットワークに出ない
+        return options
 
     # LLM(プロバイダ × 軽量/重量ティア)
     # ペルソナごとに provider/tier が割り当てられ、障害時は他プロバイダの
@@ -72,8 +116,26 @@ class Config:
     interval_sec: int = field(default_factory=lambda: int(os.environ.get("AITRADER_INTERVAL_SEC", "3600")))
     trade_cooldown_sec: int = field(default_factory=lambda: int(os.environ.get("AITRADER_COOLDOWN_SEC", "1800")))
 
+    # 約定履歴の取得窓。1ページ500約定では活発な相場で数分しか遡れないため、
+    # 直近 exec_horizon_min 分を覆うまで最大 exec_max_pages ページ遡る
+    exec_horizon_min: int = field(default_factory=lambda: int(os.environ.get(
+        "AITRADER_EXEC_HORIZON_MIN", "65")))
+    exec_max_pages: int = field(default_factory=lambda: int(os.environ.get(
+        "AITRADER_EXEC_MAX_PAGES", "20")))
+    # 履歴DBへの差分取り込み(前回の最新約定IDより新しい約定だけを取得)で
+    # 遡るページ上限。毎時の --collect で1時間分を取り切れる量にしておく
+    ingest_max_pages: int = field(default_factory=lambda: int(os.environ.get(
+        "AITRADER_INGEST_MAX_PAGES", "100")))
+
     # 履歴蓄積(1分足をSQLiteに貯めて中期指標を育てる)
     history_path: str = field(default_factory=lambda: os.environ.get("AITRADER_HISTORY_PATH", "aitrader_history.db"))
+    # 約定そのもの(ティック)も履歴DBに列指向で保存する。任意の時間足・
+    # テイカーフロー・価格帯別出来高を後から組み直せる
+    keep_ticks: bool = field(default_factory=lambda: _env_bool("AITRADER_KEEP_TICKS", True))
+    # ティックを残す日数(最新の約定から。古い分は取り込みのたびに削除し、
+    # 履歴DBが際限なく大きくならないようにする。0で無期限)
+    tick_retention_days: float = field(default_factory=lambda: float(
+        os.environ.get("AITRADER_TICK_RETENTION_DAYS", "7")))
 
     # ダッシュボード(静的HTML)の出力先。空なら生成しない。
     # public_html 配下を指定するとブラウザから稼働状況を確認できる
@@ -109,6 +171,22 @@ class Config:
     emergency_cooldown_sec: int = field(default_factory=lambda: int(
         os.environ.get("AITRADER_EMERGENCY_COOLDOWN_SEC", "10800")))
 
+    # 取引所側の保護注文(protect.py)。有効にすると協議会がポジションを持つ間、
+    # 平均取得単価 × (1 - stop_loss_pct) に逆指値SELL(STOP)を置いておき、
+    # 毎時ガードを待たずに取引所のマッチング速度で損切りさせる。
+    # take_profit_pct > 0 なら利確指値と組にしたOCOにする。実売買時のみ有効
+    protective_stop: bool = field(default_factory=lambda: _env_bool("AITRADER_PROTECTIVE_STOP", False))
+    take_profit_pct: float = field(default_factory=lambda: float(
+        os.environ.get("AITRADER_TAKE_PROFIT_PCT", "0")))
+
+    # 実口座の差分同期(account.py)。APIキーがあれば --collect で注文・約定・
+    # 残高履歴を履歴DBに取り込み(前回から account_max_age_sec 秒以内なら省略)、
+    # 残高チェックは account_max_age_sec 秒以内のローカル値を使う
+    # (古ければ getbalance を1回だけ呼んで読み直す)
+    account_sync: bool = field(default_factory=lambda: _env_bool("AITRADER_ACCOUNT_SYNC", True))
+    account_max_age_sec: int = field(default_factory=lambda: int(
+        os.environ.get("AITRADER_ACCOUNT_MAX_AGE_SEC", "600")))
+
     def validate_for_trading(self):
         """実売買(dry_run=False)に必要な設定が揃っているか確認する。"""
         if self.dry_run:
@@ -17,6 +17,7 @@ import tempfile
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+from .account import reconcile
 from .config import Config
 from .paper import COUNCIL_ACTOR, PaperBook, ensure_log_columns
 from .personas import PERSONAS
@@ -452,6 +453,37 @@ def _pnl_table(summary: dict, base_currency: str = "BTC") -> str:
     return "\n".join(parts)
 
 
+def _account_table(conn, config: Config) -> str:
+    """同期済みの実口座(残高・直近の約定・台帳との差)。未同期なら空。"""
+    state = reconcile(conn, config.product_code, config.base_currency)
+    if state is None:
+        return ""
+    base = _esc(config.base_currency)
+    synced = datetime.fromtimestamp(state["synced_at"], timezone.utc).isoformat() \
+        if state["synced_at"] else ""
+    parts = ["<h2>実口座(同期済み)</h2>",
+             f"<p class='meta'>実残高 {state['real_position']:.6f} {base} ／ "
+             f"協議会台帳 {state['paper_position']:.6f} {base} ／ "
+             f"差 {state['diff']:+.6f} {base} ／ 約定 {state['fills']}件・"
+             f"手数料 {state['fees']:.8f} {base}"
+             + (f" ／ 同期: {_jst(synced, '%m/%d %H:%M')} JST" if synced else "")
+             + "</p>"]
+    rows = _query(conn, """
+        SELECT exec_date, side, price, size, commission FROM account_executions
+        WHERE product_code = ? ORDER BY id DESC LIMIT 10
+    """, (config.product_code,))
+    if rows:
+        parts.append("<div class='scroll'><table><tr><th>約定時刻</th><th>売買</th>"
+                     "<th>価格</th><th>数量</th><th>手数料</th></tr>")
+        for exec_date, side, price, size, commission in rows:
+            parts.append(f"<tr><td>{_jst(exec_date)}</td><td>{_vote_chip(side)}</td>"
+                         f"<td class='num'>{_fmt_price(price)}</td>"
+                         f"<td class='num'>{size:.6f}</td>"
+                         f"<td class='num'>{commission:.8f}</td></tr>")
+        parts.append("</table></div>")
+    return "\n".join(parts)
+
+
 def _llm_cost_card(conn, config: Config, now: datetime):
     """(ラベル, 値, サブ文言) を返す。コスト記録がなければ None。"""
     rows = _query(conn, """
@@ -595,6 +627,7 @@ def generate_html(conn, config: Config, now: datetime = None) -> str:
 {_action_cycle_details(conn, config.usdjpy_rate)}
 <h2>仮想P&L(ペーパートレード)</h2>
 {_pnl_table(summary, config.base_currency)}
+{_account_table(conn, config)}
 <footer>aitrader dashboard{f' ／ deploy: {_esc(version)}' if version else ''}</footer>
 </body>
 </html>
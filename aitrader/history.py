@@ -3,26 +3,94 @@
 
 bitFlyer公開APIはローソク足を提供しないため、サイクルごとに取得した
 1分足を蓄積し、数日運用することで自前の中期データ(1時間足)を育てる。
+約定そのもの(ティック)も追記専用の列指向ブロブとして保存し、
+任意の時間足やテイカーフローを後から組み直せるようにする。
 """
 
 import sqlite3
-from dataclasses import dataclass
+import zlib
+from array import array
 
+from bitflyerapi import records
 
-@dataclass
-class HourCandle:
-    time: str   # "YYYY-MM-DDTHH" (UTC)
-    open: float
-    high: float
-    low: float
-    close: float
-    volume: float
-    minutes: int  # そのhourに含まれる1分足の本数(データ充足度)
+# HourCandle は従来どおり history からも import できるようにしておく
+from .series import CandleSeries, HourCandle
+
+
+# ティック塊のバイナリ形式: 件数(4byte) + 列ごとの配列
+#   id・時刻(ms)は差分の int64、価格・数量は float64、売買方向は1byte(B/S/-)。
+# 差分列はほぼ小さな値(上位バイトが0)になるため、zlib で大きく縮む。
+def _encode_ticks(ids, ms, prices, sizes, sides) -> bytes:
+    n = len(ids)
+    id_delta = array("q", [ids[0]] + [ids[i] - ids[i - 1] for i in range(1, n)])
+    ms_delta = array("q", [ms[0]] + [ms[i] - ms[i - 1] for i in range(1, n)])
+    raw = (n.to_bytes(4, "little") + id_delta.tobytes() + ms_delta.tobytes()
+           + array("d", prices).tobytes() + array("d", sizes).tobytes() + sides)
+    return zlib.compress(raw)
+
+
+def _decode_ticks(blob: bytes) -> tuple:
+    raw = zlib.decompress(blob)
+    n = int.from_bytes(raw[:4], "little")
+    cols = []
+    offset = 4
+    for typecode in ("q", "q", "d", "d"):
+        col = array(typecode)
+        col.frombytes(raw[offset:offset + 8 * n])
+        cols.append(col)
+        offset += 8 * n
+    ids, ms, prices, sizes = cols
+    for i in range(1, n):  # 差分を累積して元に戻す
+        ids[i] += ids[i - 1]
+        ms[i] += ms[i - 1]
+    return ids, ms, prices, sizes, raw[offset:offset + n]
+
+
+def _hours_from_rows(rows) -> CandleSeries:
+    """新しい順の1分足の行 (minute, open, high, low, close, volume) を
+    1時間足の系列に集約する(古い順)。"""
+    buckets = {}
+    for minute, o, h, l, c, v in rows:
+        hour = minute[:13]  # "YYYY-MM-DDTHH"
+        b = buckets.get(hour)
+        if b is None:
+            # DESC走査なので最初に見た分がそのhourの「最後(close)」
+            buckets[hour] = [o, h, l, c, v, 1]
+        else:
+            b[0] = o  # 走査が進むほど古い分 → openを上書き
+            if h > b[1]:
+                b[1] = h
+            if l < b[2]:
+                b[2] = l
+            b[4] += v
+            b[5] += 1
+    hours = sorted(buckets)
+    cols = [[buckets[hour][i] for hour in hours] for i in range(6)]
+    return CandleSeries.from_columns(
+        "1h", [records.epoch_ms(hour + ":00:00") // 1000 for hour in hours],
+        *cols[:5], minutes=cols[5])
+
+
+def ensure_candle_columns(conn):
+    """candles_1m に後付け列を追加する(既存DBへのマイグレーション)。"""
+    for column in ("buy_volume REAL NOT NULL DEFAULT 0",
+                   "sell_volume REAL NOT NULL DEFAULT 0"):
+        try:
+            conn.execute(f"ALTER TABLE candles_1m ADD COLUMN {column}")
+        except sqlite3.OperationalError:
+            pass  # 追加済み
 
 
 class HistoryStore:
-    def __init__(self, path: str = "aitrader_history.db"):
+    # 1塊あたりの最大ティック数(範囲検索で展開する単位)
+    TICK_CHUNK = 5000
+
+    def __init__(self, path: str = "aitrader_history.db", keep_ticks: bool = True,
+                 tick_retention_days: float = 7.0):
         self.conn = sqlite3.connect(path)
+        self.keep_ticks = keep_ticks
+        # ティックを残す日数(最新の約定時刻から。0以下なら削除しない)
+        self.tick_retention_days = tick_retention_days
         self.conn.execute("""
             CREATE TABLE IF NOT EXISTS candles_1m (
                 product_code TEXT NOT NULL,
@@ -35,37 +103,137 @@ class HistoryStore:
                 PRIMARY KEY (product_code, minute)
             )
         """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_cursor (
+                product_code TEXT PRIMARY KEY,
+                last_exec_id INTEGER NOT NULL  -- 取り込み済みの最新約定ID
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS ticks (
+                product_code TEXT NOT NULL,
+                first_id INTEGER NOT NULL,
+                last_id INTEGER NOT NULL,
+                first_ms INTEGER NOT NULL,  -- 塊内の最初の約定時刻(エポックms)
+                last_ms INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                data BLOB NOT NULL,         -- 列指向の差分エンコード(_encode_ticks)
+                PRIMARY KEY (product_code, first_id)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS indicator_state (
+                product_code TEXT NOT NULL,
+                timeframe TEXT NOT NULL,     -- "1m" / "1h"
+                last_time TEXT NOT NULL,     -- 最後に投入した確定足の時刻
+                state TEXT NOT NULL,         -- streaming.IndicatorSet の JSON
+                PRIMARY KEY (product_code, timeframe)
+            )
+        """)
+        ensure_candle_columns(self.conn)
         self.conn.commit()
 
+    @classmethod
+    def from_config(cls, config) -> "HistoryStore":
+        return cls(path=config.history_path, keep_ticks=config.keep_ticks,
+                   tick_retention_days=config.tick_retention_days)
+
     def close(self):
         self.conn.close()
 
-    def upsert_candles(self, product_code: str, candles: list):
+    def _rows(self, product_code: str, candles) -> list:
+        if isinstance(candles, CandleSeries):  # 行オブジェクトを作らず列から
+            return [(product_code, candles.label(i)[:16], *values)
+                    for i, values in enumerate(zip(
+                        candles.open, candles.high, candles.low, candles.close,
+                        candles.volume, candles.buy_volume, candles.sell_volume))]
+        return [
+            (product_code, c.time[:16], c.open, c.high, c.low, c.close, c.volume,
+             getattr(c, "buy_volume", 0.0), getattr(c, "sell_volume", 0.0))
+            for c in candles
+        ]
+
+    def upsert_candles(self, product_code: str, candles: list,
+                       last_exec_id: int = None):
         """1分足を蓄積する。
 
         同じ分を再取得した場合は出来高が大きい方(=約定の取りこぼしが
         少ない方)を採用する。500約定の窓で端の分が欠けていても、
         次のサイクルの完全なデータで上書きされる。
+        last_exec_id を渡すと、以後の差分取り込み(merge_candles)の起点として
+        同じトランザクションで記録する。
         """
-        rows = [
-            (product_code, c.time[:16], c.open, c.high, c.low, c.close, c.volume)
-            for c in candles
-        ]
         self.conn.executemany("""
-            INSERT INTO candles_1m (product_code, minute, open, high, low, close, volume)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO candles_1m (product_code, minute, open, high, low, close,
+                                    volume, buy_volume, sell_volume)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT (product_code, minute) DO UPDATE SET
                 open = excluded.open,
                 high = excluded.high,
                 low = excluded.low,
                 close = excluded.close,
-                volume = excluded.volume
+                volume = excluded.volume,
+                buy_volume = excluded.buy_volume,
+                sell_volume = excluded.sell_volume
             WHERE excluded.volume >= candles_1m.volume
-        """, rows)
+        """, self._rows(product_code, candles))
+        if last_exec_id is not None:
+            self._set_last_exec_id(product_code, last_exec_id)
+        self.conn.commit()
+
+    def merge_candles(self, product_code: str, candles: list, last_exec_id: int):
+        """カーソル以降の新しい約定だけから作った1分足を厳密にマージする。
+
+        取り込み済みの分に続きの約定が来た場合、open は既存のまま、
+        close は新しい側、high/low は極値、出来高は加算する(推測なし)。
+        カーソル更新も同じトランザクションで行うので、途中で落ちても
+        同じ約定を二重に加算しない。
+        """
+        self.conn.executemany("""
+            INSERT INTO candles_1m (product_code, minute, open, high, low, close,
+                                    volume, buy_volume, sell_volume)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (product_code, minute) DO UPDATE SET
+                high = max(candles_1m.high, excluded.high),
+                low = min(candles_1m.low, excluded.low),
+                close = excluded.close,
+                volume = candles_1m.volume + excluded.volume,
+                buy_volume = candles_1m.buy_volume + excluded.buy_volume,
+                sell_volume = candles_1m.sell_volume + excluded.sell_volume
+        """, self._rows(product_code, candles))
+        self._set_last_exec_id(product_code, last_exec_id)
         self.conn.commit()
 
-    def hourly_candles(self, product_code: str, hours: int = 72) -> list:
-        """蓄積済み1分足から直近N時間分の1時間足を組み立てる(古い順)。"""
+    def last_exec_id(self, product_code: str):
+        """取り込み済みの最新約定ID。未記録ならNone。"""
+        row = self.conn.execute(
+            "SELECT last_exec_id FROM ingest_cursor WHERE product_code = ?",
+            (product_code,)).fetchone()
+        return row[0] if row else None
+
+    def _set_last_exec_id(self, product_code: str, last_exec_id: int):
+        self.conn.execute("""
+            INSERT INTO ingest_cursor (product_code, last_exec_id) VALUES (?, ?)
+            ON CONFLICT (product_code) DO UPDATE SET
+                last_exec_id = max(ingest_cursor.last_exec_id, excluded.last_exec_id)
+        """, (product_code, last_exec_id))
+
+    def minute_candles(self, product_code: str, minutes: int = 65) -> list:
+        """直近N本の1分足を古い順で返す。
+
+        行は (minute, open, high, low, close, volume, buy_volume, sell_volume)。
+        """
+        cur = self.conn.execute("""
+            SELECT minute, open, high, low, close, volume, buy_volume, sell_volume
+            FROM candles_1m
+            WHERE product_code = ?
+            ORDER BY minute DESC
+            LIMIT ?
+        """, (product_code, minutes))
+        return cur.fetchall()[::-1]
+
+    def hourly_candles(self, product_code: str, hours: int = 72) -> CandleSeries:
+        """蓄積済み1分足から直近N時間分の1時間足を組み立てる(古い順の系列)。"""
         cur = self.conn.execute("""
             SELECT minute, open, high, low, close, volume
             FROM candles_1m
@@ -73,26 +241,55 @@ class HistoryStore:
             ORDER BY minute DESC
             LIMIT ?
         """, (product_code, hours * 60))
+        return _hours_from_rows(cur.fetchall())[-hours:]
+
+    def hourly_candles_after(self, product_code: str, after: str = None,
+                             limit: int = 744) -> CandleSeries:
+        """time が after("YYYY-MM-DDTHH")より新しい1時間足のうち直近 limit 本。"""
+        cur = self.conn.execute("""
+            SELECT minute, open, high, low, close, volume
+            FROM candles_1m
+            WHERE product_code = ? AND minute > ?
+            ORDER BY minute DESC
+            LIMIT ?
+        """, (product_code, after + ":59" if after else "", limit * 60))
         rows = cur.fetchall()
+        hours = _hours_from_rows(rows)
+        if len(rows) == limit * 60:
+            hours = hours[1:]  # LIMIT で途中から切れた最古のhourは除く
+        return hours[-limit:]
 
-        buckets = {}
-        for minute, o, h, l, c, v in rows:
-            hour = minute[:13]  # "YYYY-MM-DDTHH"
-            b = buckets.get(hour)
-            if b is None:
-                # DESC走査なので最初に見た分がそのhourの「最後(close)」
-                buckets[hour] = {"open": o, "high": h, "low": l,
-                                 "close": c, "volume": v, "minutes": 1}
-            else:
-                b["open"] = o  # 走査が進むほど古い分 → openを上書き
-                b["high"] = max(b["high"], h)
-                b["low"] = min(b["low"], l)
-                b["volume"] += v
-                b["minutes"] += 1
-
-        candles = [HourCandle(time=hour, **vals)
-                   for hour, vals in sorted(buckets.items())]
-        return candles[-hours:]
+    def minute_candles_after(self, product_code: str, after: str = None,
+                             limit: int = 1440) -> list:
+        """minute が after より新しい1分足のうち直近 limit 本(古い順)。
+
+        行の形式は minute_candles と同じ。after が None なら全期間から。
+        """
+        cur = self.conn.execute("""
+            SELECT minute, open, high, low, close, volume, buy_volume, sell_volume
+            FROM candles_1m
+            WHERE product_code = ? AND minute > ?
+            ORDER BY minute DESC
+            LIMIT ?
+        """, (product_code, after or "", limit))
+        return cur.fetchall()[::-1]
+
+    def load_indicator_state(self, product_code: str, timeframe: str):
+        """保存したストリーミング指標の状態(JSON文字列)。無ければ None。"""
+        row = self.conn.execute("""
+            SELECT state FROM indicator_state
+            WHERE product_code = ? AND timeframe = ?
+        """, (product_code, timeframe)).fetchone()
+        return row[0] if row else None
+
+    def save_indicator_state(self, product_code: str, timeframe: str,
+                             last_time: str, state: str):
+        self.conn.execute("""
+            INSERT OR REPLACE INTO indicator_state
+                (product_code, timeframe, last_time, state)
+            VALUES (?, ?, ?, ?)
+        """, (product_code, timeframe, last_time, state))
+        self.conn.commit()
 
     def coverage_hours(self, product_code: str) -> int:
         """蓄積されているデータのおおよその時間数(hour数)。"""
@@ -101,3 +298,91 @@ class HistoryStore:
             FROM candles_1m WHERE product_code = ?
         """, (product_code,))
         return int(cur.fetchone()[0])
+
+    # --- ティック(約定そのもの)の追記専用ストア ---
+
+    def last_tick_id(self, product_code: str) -> int:
+        row = self.conn.execute(
+            "SELECT MAX(last_id) FROM ticks WHERE product_code = ?",
+            (product_code,)).fetchone()
+        return row[0] or 0
+
+    def append_ticks(self, product_code: str, executions: list) -> int:
+        """約定(APIの新しい順のままでよい。dictでも Execution でも可)を追記し、
+        追記した件数を返す。
+
+        追記専用なので、保存済みの最大IDより新しい約定だけを書く。
+        追記のたびに tick_retention_days より古い塊を削除する(prune_ticks)。
+        """
+        last_id = self.last_tick_id(product_code)
+        rows = sorted((ex for ex in records.executions(executions)
+                       if ex.id > last_id), key=lambda ex: ex.id)
+        for start in range(0, len(rows), self.TICK_CHUNK):
+            chunk = rows[start:start + self.TICK_CHUNK]
+            ids = [ex.id for ex in chunk]
+            ms = [ex.exec_ms for ex in chunk]
+            sides = bytes(ord((ex.side or "-")[0]) for ex in chunk)
+            blob = _encode_ticks(ids, ms, [ex.price for ex in chunk],
+                                 [ex.size for ex in chunk], sides)
+            self.conn.execute("""
+                INSERT INTO ticks (product_code, first_id, last_id, first_ms,
+                                   last_ms, count, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (product_code, ids[0], ids[-1], min(ms), max(ms), len(chunk), blob))
+        if rows:
+            self.prune_ticks(product_code, commit=False)
+        self.conn.commit()
+        return len(rows)
+
+    def prune_ticks(self, product_code: str, commit: bool = True) -> int:
+        """最新の約定から tick_retention_days より古いティックを塊単位で削除し、
+        削除した塊の数を返す(境目をまたぐ塊は残す)。"""
+        if not self.tick_retention_days or self.tick_retention_days <= 0:
+            return 0
+        row = self.conn.execute(
+            "SELECT MAX(last_ms) FROM ticks WHERE product_code = ?",
+            (product_code,)).fetchone()
+        if row[0] is None:
+            return 0
+        cutoff = row[0] - int(self.tick_retention_days * 86400000)
+        cur = self.conn.execute(
+            "DELETE FROM ticks WHERE product_code = ? AND last_ms < ?",
+            (product_code, cutoff))
+        if commit:
+            self.conn.commit()
+        return cur.rowcount
+
+    def ticks(self, product_code: str, start_ms: int = None,
+              end_ms: int = None) -> dict:
+        """[start_ms, end_ms) の約定を列ごとの配列で返す(ID昇順)。
+
+        戻り値: {"id": array('q'), "ms": array('q'), "price": array('d'),
+                 "size": array('d'), "side": bytes (b"B"/b"S"/b"-")}
+        """
+        lo = start_ms if start_ms is not None else -2 ** 63
+        hi = end_ms if end_ms is not None else 2 ** 63 - 1
+        out = {"id": array("q"), "ms": array("q"), "price": array("d"),
+               "size": array("d"), "side": bytearray()}
+        cur = self.conn.execute("""
+            SELECT first_ms, last_ms, data FROM ticks
+            WHERE product_code = ? AND last_ms >= ? AND first_ms < ?
+            ORDER BY first_id
+        """, (product_code, lo, hi))
+        for first_ms, last_ms, blob in cur:
+            ids, ms, prices, sizes, sides = _decode_ticks(blob)
+            if lo <= first_ms and last_ms < hi:  # 塊まるごと範囲内
+                out["id"].extend(ids)
+                out["ms"].extend(ms)
+                out["price"].extend(prices)
+                out["size"].extend(sizes)
+                out["side"] += sides
+                continue
+            for i in range(len(ids)):
+                if lo <= ms[i] < hi:
+                    out["id"].append(ids[i])
+                    out["ms"].append(ms[i])
+                    out["price"].append(prices[i])
+                    out["size"].append(sizes[i])
+                    out["side"].append(sides[i])
+        out["side"] = bytes(out["side"])
+        return out
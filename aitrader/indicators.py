@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""NumPy版のテクニカル指標(任意依存: pip install numpy)。
+
+market.py の指標関数(_sma / _ema_series / _rsi / _atr / _adx / _macd /
+_bollinger / _vwap)はサイクルごとの72本程度を前提にした素朴な実装で、
+_adx は窓の合計をループ内で毎回取り直す(O(本数×窓))。バックテストや
+複数時間足のビューで数週間分の1分足を扱うときはこちらを使う。
+
+  - 入力は連続した float 配列(list も可。from_candles で足から列を作れる)
+  - *_series は足と同じ長さの全系列を返す(値が定まらない位置は NaN)
+  - 接尾辞なしの関数は最新値を返し、データ不足時の既定値も含めて
+    market.py の同名関数と同じ結果になる(浮動小数の丸め誤差の範囲で)
+
+窓の合計は sliding_window_view で窓ごとに足し合わせる(累積和の差は
+価格の桁が大きいと桁落ちするため使わない)。EMAは漸化式なので逐次計算する。
+"""
+
+import math
+
+from .series import CandleSeries
+
+try:
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:  # numpy は任意依存
+    np = None
+
+HAVE_NUMPY = np is not None
+
+
+def _require():
+    if np is None:
+        raise ImportError("aitrader.indicators には numpy が必要です(pip install numpy)")
+
+
+def _array(values):
+    _require()
+    return np.ascontiguousarray(values, dtype=np.float64)
+
+
+def from_candles(candles) -> dict:
+    """CandleSeries(列をコピーせずに共有)または Candle / HourCandle の
+    リスト(古い順)から列ごとの配列を作る。
+
+    戻り値: {"open", "high", "low", "close", "volume"} → float64配列
+    """
+    _require()
+    names = ("open", "high", "low", "close", "volume")
+    if isinstance(candles, CandleSeries):
+        return {name: np.asarray(candles.column(name), dtype=np.float64)
+                for name in names}
+    return {name: np.fromiter((getattr(c, name) for c in candles),
+                              dtype=np.float64, count=len(candles))
+            for name in names}
+
+
+def _trailing(values, n: int, reduce):
+    """各位置で直近 n 個(先頭付近は取れるだけ)を reduce した配列。"""
+    values = _array(values)
+    if len(values) == 0:
+        return values.copy()
+    padded = np.concatenate((np.zeros(n - 1), values))
+    return reduce(sliding_window_view(padded, n))
+
+
+def _trailing_mean(values, n: int):
+    values = _array(values)
+    counts = np.minimum(np.arange(1, len(values) + 1), n)
+    return _trailing(values, n, lambda w: w.sum(axis=1)) / counts
+
+
+# --- 系列 ---
+
+def sma_series(closes, n: int):
+    """各位置までの直近 n 本の単純平均(先頭付近は取れた本数で平均)。"""
+    return _trailing_mean(closes, n)
+
+
+def ema_series(values, n: int):
+    """先頭値を種にしたEMA(market._ema_series と同じ漸化式)。"""
+    values = _array(values)
+    out = np.empty_like(values)
+    if len(values) == 0:
+        return out
+    k = 2.0 / (n + 1)
+    prev = values[0]
+    out[0] = prev
+    for i, v in enumerate(values[1:].tolist(), 1):
+        prev = v * k + prev * (1 - k)
+        out[i] = prev
+    return out
+
+
+def rsi_series(closes, n: int = 14):
+    """直近 n 本の値幅の合計から求めるRSI(先頭 n 本は NaN)。"""
+    closes = _array(closes)
+    out = np.full(len(closes), np.nan)
+    if len(closes) < n + 1:
+        return out
+    diff = np.diff(closes)
+    windows = sliding_window_view(diff, n)
+    gains = np.where(windows >= 0, windows, 0.0).sum(axis=1)
+    losses = np.where(windows < 0, -windows, 0.0).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100.0 - 100.0 / (1.0 + gains / losses)
+    out[n:] = np.where(losses == 0, 100.0, rsi)
+    return out
+
+
+def true_range(high, low, close):
+    """2本目以降のTrue Range(長さは本数-1。market._true_ranges と同じ並び)。"""
+    high, low, close = _array(high), _array(low), _array(close)
+    prev_close = close[:-1]
+    return np.maximum.reduce((high[1:] - low[1:],
+                              np.abs(high[1:] - prev_close),
+                              np.abs(low[1:] - prev_close)))
+
+
+def atr_series(high, low, close, n: int = 14):
+    """各位置までの直近 n 本のTrueRangeの単純平均(先頭は NaN)。"""
+    trs = true_range(high, low, close)
+    out = np.full(len(trs) + 1, np.nan)
+    out[1:] = _trailing_mean(trs, n)
+    return out
+
+
+def _dx(high, low, close, n: int):
+    """DX系列(TrueRange の添字 n-1 以降に対応)。"""
+    high, low = _array(high), _array(low)
+    up = high[1:] - high[:-1]
+    down = low[:-1] - low[1:]
+    plus_dm = np.where((up > down) & (up > 0), up, 0.0)
+    minus_dm = np.where((down > up) & (down > 0), down, 0.0)
+    trs = true_range(high, low, close)
+    tr_sum = sliding_window_view(trs, n).sum(axis=1)
+    tr_sum = np.where(tr_sum == 0, 1e-9, tr_sum)
+    pdi = 100.0 * sliding_window_view(plus_dm, n).sum(axis=1) / tr_sum
+    mdi = 100.0 * sliding_window_view(minus_dm, n).sum(axis=1) / tr_sum
+    total = pdi + mdi
+    return 100.0 * np.abs(pdi - mdi) / np.where(total == 0, 1e-9, total)
+
+
+def adx_series(high, low, close, n: int = 14):
+    """各位置までの足で求めた簡易ADX(market._adx と同じ定義。先頭 n 本は NaN)。"""
+    high = _array(high)
+    out = np.full(len(high), np.nan)
+    if len(high) < n + 1:
+        return out
+    out[n:] = _trailing_mean(_dx(high, low, close, n), n)
+    return out
+
+
+def macd_series(closes, fast: int = 12, slow: int = 26, signal: int = 9) -> tuple:
+    """(MACD線, シグナル線, ヒストグラム) の全系列。"""
+    macd_line = ema_series(closes, fast) - ema_series(closes, slow)
+    signal_line = ema_series(macd_line, signal)
+    return macd_line, signal_line, macd_line - signal_line
+
+
+def bollinger_series(closes, n: int = 20) -> tuple:
+    """(中心線, +2σ, -2σ) の全系列(σは母標準偏差。先頭 n-1 本は NaN)。"""
+    closes = _array(closes)
+    mid, upper, lower = (np.full(len(closes), np.nan) for _ in range(3))
+    if len(closes) < n:
+        return mid, upper, lower
+    windows = sliding_window_view(closes, n)
+    means = windows.sum(axis=1) / n
+    sd = np.sqrt(((windows - means[:, None]) ** 2).sum(axis=1) / n)
+    mid[n - 1:] = means
+    upper[n - 1:] = means + 2 * sd
+    lower[n - 1:] = means - 2 * sd
+    return mid, upper, lower
+
+
+def vwap_series(closes, volumes, n: int):
+    """各位置までの直近 n 本の出来高加重平均価格(出来高0の窓は0)。"""
+    closes, volumes = _array(closes), _array(volumes)
+    total_v = _trailing(volumes, n, lambda w: w.sum(axis=1))
+    total_pv = _trailing(closes * volumes, n, lambda w: w.sum(axis=1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total_v > 0, total_pv / total_v, 0.0)
+
+
+# --- 最新値(market.py の同名関数と同じ既定値) ---
+
+def _last(series, default: float) -> float:
+    if len(series) == 0:
+        return default
+    value = float(series[-1])
+    return default if math.isnan(value) else value
+
+
+def sma(closes, n: int) -> float:
+    return _last(sma_series(closes, n), 0.0)
+
+
+def ema(closes, n: int) -> float:
+    return _last(ema_series(closes, n), 0.0)
+
+
+def rsi(closes, n: int = 14) -> float:
+    return _last(rsi_series(closes, n), 50.0)
+
+
+def atr(high, low, close, n: int = 14) -> float:
+    return _last(atr_series(high, low, close, n), 0.0)
+
+
+def adx(high, low, close, n: int = 14) -> float:
+    return _last(adx_series(high, low, close, n), 0.0)
+
+
+def macd(closes, fast: int = 12, slow: int = 26, signal: int = 9) -> tuple:
+    if len(closes) < slow + signal:
+        return (0.0, 0.0, 0.0)
+    return tuple(float(s[-1]) for s in macd_series(closes, fast, slow, signal))
+
+
+def bollinger(closes, n: int = 20) -> tuple:
+    return tuple(_last(s, 0.0) for s in bollinger_series(closes, n))
+
+
+def vwap(closes, volumes) -> float:
+    closes, volumes = _array(closes), _array(volumes)
+    total_v = volumes.sum()
+    if total_v <= 0:
+        return 0.0
+    return float((closes * volumes).sum() / total_v)
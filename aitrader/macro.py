@@ -15,10 +15,13 @@ cookie なしアクセスへの 429 で、どちらも無認証では恒常的
 """
 
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import date, timedelta
 
 import requests
 
+from bitflyerapi.transport import with_query
+
 logger = logging.getLogger(__name__)
 
 _TIMEOUT = 6
@@ -29,22 +32,28 @@ _HEADERS = {
 }
 
 
-def _get(url: str, params: dict = None, headers: dict = _HEADERS) -> requests.Response:
-    r = requests.get(url, params=params, timeout=_TIMEOUT, headers=headers)
+def _get(url: str, params: dict = None, headers: dict = _HEADERS,
+         transport=None) -> requests.Response:
+    """transport(bitflyerapi.transport)を渡すとそれ経由で取得する(記録・再生用)。"""
+    if transport is None:
+        r = requests.get(url, params=params, timeout=_TIMEOUT, headers=headers)
+    else:
+        r = transport.send("GET", with_query(url, params), headers=headers,
+                           timeout=_TIMEOUT)
     r.raise_for_status()
     return r
 
 
-def _coingecko_global(out: dict):
+def _coingecko_global(out: dict, transport=None):
     """BTCドミナンスと暗号資産市場全体の24時間増減。"""
-    r = _get("https://api.coingecko.com/api/v3/global")
+    r = _get("https://api.coingecko.com/api/v3/global", transport=transport)
     data = r.json()["data"]
     out["btc_dominance"] = float(data["market_cap_percentage"]["btc"])
     out["crypto_mcap_change_24h"] = float(
         data.get("market_cap_change_percentage_24h_usd", 0.0))
 
 
-def _fetch_nasdaq(out: dict):
+def _fetch_nasdaq(out: dict, transport=None):
     """FREDの公開CSVからNASDAQ総合の直近2営業日の終値を取る。
 
     行形式は "YYYY-MM-DD,26206.890"。休場日は値が "." になるので読み飛ばす。
@@ -54,7 +63,8 @@ def _fetch_nasdaq(out: dict):
     """
     start = (date.today() - timedelta(days=14)).isoformat()
     r = _get("https://fred.stlouisfed.org/graph/fredgraph.csv",
-             params={"id": "NASDAQCOM", "cosd": start}, headers=None)
+             params={"id": "NASDAQCOM", "cosd": start}, headers=None,
+             transport=transport)
     closes = []
     for line in r.text.strip().splitlines()[1:]:
         _, _, value = line.partition(",")
@@ -67,11 +77,11 @@ def _fetch_nasdaq(out: dict):
         out["nasdaq_change_pct"] = (closes[-1] - closes[-2]) / closes[-2] * 100.0
 
 
-def _fetch_usdjpy(out: dict):
+def _fetch_usdjpy(out: dict, transport=None):
     """frankfurter(ECB参照レート)の時系列から直近2営業日のドル円を取る。"""
     start = (date.today() - timedelta(days=14)).isoformat()
     r = _get(f"https://api.frankfurter.dev/v1/{start}..",
-             params={"base": "USD", "symbols": "JPY"})
+             params={"base": "USD", "symbols": "JPY"}, transport=transport)
     rates = r.json()["rates"]
     values = [float(rates[day]["JPY"]) for day in sorted(rates)]
     if not values:
@@ -81,21 +91,44 @@ def _fetch_usdjpy(out: dict):
         out["usdjpy_change_pct"] = (values[-1] - values[-2]) / values[-2] * 100.0
 
 
-def fetch_macro() -> dict:
+def _fetch_into(fetch, transport) -> dict:
+    part = {}
+    fetch(part, transport=transport)
+    return part
+
+
+def fetch_macro(transport=None, timeout: float = 15.0) -> dict:
     """取得できたものだけを含む辞書を返す。
 
     キー: btc_dominance, crypto_mcap_change_24h,
           usdjpy, usdjpy_change_pct, nasdaq, nasdaq_change_pct
+    transport を渡すとHTTPをそれ経由にする(カセットへの記録・オフライン再生)。
+    3つのソースは互いに独立なので並列に取得し、timeout 秒までに
+    返らなかったソースは失敗扱いにする(待たずに先へ進む)。
     """
-    out = {}
+    sources = (("dominance", _coingecko_global),
+               ("usdjpy", _fetch_usdjpy),
+               ("nasdaq", _fetch_nasdaq))
+    results = {}
     failed = []
-    for name, fetch in (("dominance", _coingecko_global),
-                        ("usdjpy", _fetch_usdjpy),
-                        ("nasdaq", _fetch_nasdaq)):
-        try:
-            fetch(out)
-        except Exception:
-            failed.append(name)
+    pool = ThreadPoolExecutor(max_workers=len(sources),
+                              thread_name_prefix="aitrader-macro")
+    try:
+        # ソースごとに別の辞書へ書かせ、時間切れのソースが後から out を
+        # 書き換えないようにする
+        futures = {name: pool.submit(_fetch_into, fetch, transport)
+                   for name, fetch in sources}
+        done, _ = wait(futures.values(), timeout=timeout)
+        for name, future in futures.items():
+            if future in done and future.exception() is None:
+                results[name] = future.result()
+            else:
+                failed.append(name)
+    finally:
+        pool.shutdown(wait=False)
+    out = {}
+    for name, _fetch in sources:  # キーの並びを従来(逐次取得)と揃える
+        out.update(results.get(name, {}))
     if failed:
         # 障害の切り分けができるよう、失敗ソースをINFOで残す(スタックは出さない)
         logger.info("マクロデータ取得失敗: %s (サイクルは継続)", ", ".join(failed))
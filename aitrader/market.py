@@ -5,12 +5,32 @@
 中期(1時間足・最大72時間)はHistoryStoreに蓄積した1分足から組み立てる。
 """
 
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as LegTimeout
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from itertools import islice
 
-from bitflyerapi import bitFlyerAPI
+from bitflyerapi import bitFlyerAPI, records
+from bitflyerapi.orderbook import OrderBook
 
 from .history import HistoryStore
+from .series import Candle, CandleSeries, column
+from .streaming import update_indicators
+
+logger = logging.getLogger(__name__)
+
+# fetch_market_snapshot が並列に投げる取得(レッグ)ごとの待ち時間の上限(秒)。
+# 全レッグ同時に開始するので、スナップショットの遅延は最も遅いレッグで決まる。
+# 約定の取り込みはページ数に比例して長くなる正当な処理なので上限を設けず、
+# 呼び出し元のスレッドで実行する(履歴DBの接続はスレッドをまたげない)。
+LEG_TIMEOUTS = {
+    "ticker": 15.0,
+    "boardstate": 10.0,
+    "board": 15.0,
+    "macro": 20.0,
+}
 
 
 def _px(v: float) -> str:
@@ -18,16 +38,6 @@ def _px(v: float) -> str:
     return f"{v:.0f}" if abs(v) >= 1000 else f"{v:.3f}"
 
 
-@dataclass
-class Candle:
-    time: str   # ISO8601(分単位)
-    open: float
-    high: float
-    low: float
-    close: float
-    volume: float
-
-
 @dataclass
 class MarketSnapshot:
     product_code: str
@@ -41,7 +51,7 @@ class MarketSnapshot:
     health: str
 
     # 短期(1分足)
-    candles_1m: list            # 直近のローソク足(古い順)
+    candles_1m: CandleSeries    # 直近のローソク足(古い順)
     sma_short: float            # 短期SMA(10本)
     sma_long: float             # 長期SMA(30本)
     rsi_14: float
@@ -49,7 +59,7 @@ class MarketSnapshot:
     change_pct_60m: float       # 直近60分の騰落率(%)
 
     # 中期(1時間足、履歴蓄積から)
-    candles_1h: list = None     # list[HourCandle](古い順)
+    candles_1h: CandleSeries = None  # 1時間足の系列(古い順)
     sma_8h: float = 0.0
     sma_24h: float = 0.0
     rsi_14h: float = 50.0
@@ -59,12 +69,25 @@ class MarketSnapshot:
     # 板・約定フロー(板読みビュー用)
     bid_depth: float = 0.0      # 中値-0.5%以内の買い板数量
     ask_depth: float = 0.0      # 中値+0.5%以内の売り板数量
+    weighted_mid: float = 0.0   # ±0.5%の板で加重した中値(薄い側に寄る)
     taker_buy_15m: float = 0.0  # 直近15分のテイカー買い数量
     taker_sell_15m: float = 0.0  # 直近15分のテイカー売り数量
 
+    # 約定履歴の取得実績(窓が足りているかの確認用)
+    exec_count: int = 0          # 取得した約定数
+    exec_pages: int = 0          # 使ったAPIページ数
+    exec_coverage_min: float = 0.0  # 短期1分足の窓が覆う時間幅(分)
+
     # 外部マクロ(マクロビュー用。取得失敗したキーは入らない)
     macro: dict = None
 
+    # 取得レッグごとの所要時間(ミリ秒)。時間切れのレッグは待った時間
+    leg_ms: dict = None
+
+    # 確定足で差分更新したストリーミング指標 {"1m": {...}, "1h": {...}}
+    # (streaming.IndicatorSet.values()。履歴DBがあるときのみ)
+    indicators: dict = None
+
     def to_prompt_text(self) -> str:
         """ペルソナに渡す相場サマリーのテキスト表現。"""
         recent = self.candles_1m[-30:]
@@ -116,29 +139,89 @@ class MarketSnapshot:
         return text
 
 
-def _build_candles_1m(executions: list) -> list:
-    """約定履歴(新しい順で返る)から1分足を組み立てる。古い順で返す。"""
-    buckets = {}
+# aggregate_executions が既定で集計するテイカーフローの窓(分)
+TAKER_WINDOWS = (5, 15, 60)
+
+
+@dataclass
+class ExecutionAggregate:
+    candles: CandleSeries   # 1分足(古い順。trades 列に約定数)
+    taker: dict             # {窓(分): (テイカー買い数量, 売り数量, 約定数)}
+    count: int              # 集計した約定数
+
+
+def aggregate_executions(executions, windows=TAKER_WINDOWS) -> ExecutionAggregate:
+    """約定履歴(新しい順)を1回の走査で1分足・テイカーフロー・約定数に集計する。
+
+    exec_date はエポック秒に一度だけ変換し(records.Execution)、分は整数で
+    バケツ分けする。新しい順に走査するので、同じ分の中で最初に見た約定が
+    close、最後に見た約定が open になる。テイカーの窓は最新約定の時刻から
+    N分(秒単位で比較)。executions は APIのdictでも records.Execution でもよい。
+    """
+    executions = records.executions(executions)
+    taker = {w: [0.0, 0.0, 0] for w in windows}
+    if not executions:
+        return ExecutionAggregate(CandleSeries("1m"), {w: tuple(t) for w, t in taker.items()}, 0)
+    newest = executions[0].exec_ms // 1000
+    cutoffs = [(newest - w * 60, taker[w]) for w in windows]
+
+    index = {}  # 分(エポック分) → 列の位置
+    minutes, opens, highs, lows, closes = [], [], [], [], []
+    volumes, buys, sells, trades = [], [], [], []
+    current, i = None, -1
     for ex in executions:
-        # exec_date例: "2024-01-01T12:34:56.789"
-        minute = ex["exec_date"][:16]  # "YYYY-MM-DDTHH:MM"
-        price = float(ex["price"])
-        size = float(ex["size"])
-        b = buckets.get(minute)
-        if b is None:
-            # 新しい順に走査するので、最初に見た約定がそのバケットの「最後(close)」
-            buckets[minute] = {"open": price, "high": price, "low": price,
-                               "close": price, "volume": size}
-        else:
-            b["open"] = price  # 走査が進むほど古い約定 → openを上書き
-            b["high"] = max(b["high"], price)
-            b["low"] = min(b["low"], price)
-            b["volume"] += size
-    candles = [
-        Candle(time=minute + ":00Z", **vals)
-        for minute, vals in sorted(buckets.items())
-    ]
-    return candles
+        sec = ex.exec_ms // 1000
+        minute = sec // 60
+        price, size, side = ex.price, ex.size, ex.side
+        if minute != current:
+            current = minute
+            i = index.get(minute)
+            if i is None:
+                i = index[minute] = len(minutes)
+                minutes.append(minute)
+                opens.append(price)
+                highs.append(price)
+                lows.append(price)
+                closes.append(price)
+                volumes.append(0.0)
+                buys.append(0.0)
+                sells.append(0.0)
+                trades.append(0)
+        opens[i] = price  # 走査が進むほど古い約定 → openを上書き
+        if price > highs[i]:
+            highs[i] = price
+        elif price < lows[i]:
+            lows[i] = price
+        volumes[i] += size
+        trades[i] += 1
+        if side == "BUY":
+            buys[i] += size
+        elif side == "SELL":
+            sells[i] += size
+        for cutoff, acc in cutoffs:
+            if sec >= cutoff:
+                if side == "BUY":
+                    acc[0] += size
+                elif side == "SELL":
+                    acc[1] += size
+                acc[2] += 1
+
+    order = sorted(range(len(minutes)), key=minutes.__getitem__)  # 新しい順 → 古い順
+    candles = CandleSeries.from_columns(
+        "1m", [minutes[k] * 60 for k in order],
+        *([col[k] for k in order]
+          for col in (opens, highs, lows, closes, volumes, buys, sells)),
+        trades=[trades[k] for k in order])
+    return ExecutionAggregate(candles, {w: tuple(t) for w, t in taker.items()},
+                              len(executions))
+
+
+def _build_candles_1m(executions: list) -> CandleSeries:
+    """約定履歴(新しい順で返る)から1分足を組み立てる。古い順の系列で返す。
+
+    executions は APIのdictでも records.Execution でもよい。
+    """
+    return aggregate_executions(executions, windows=()).candles
 
 
 def _sma(closes: list, n: int) -> float:
@@ -163,15 +246,15 @@ def _ema(closes: list, n: int) -> float:
     return series[-1] if series else 0.0
 
 
-def _true_ranges(candles: list) -> list:
-    return [max(cur.high - cur.low,
-                abs(cur.high - prev.close),
-                abs(cur.low - prev.close))
-            for prev, cur in zip(candles[:-1], candles[1:])]
+def _true_ranges(candles) -> list:
+    highs, lows, closes = (column(candles, name) for name in ("high", "low", "close"))
+    return [max(h - l, abs(h - prev_close), abs(l - prev_close))
+            for h, l, prev_close in zip(highs[1:], lows[1:], closes[:-1])]
 
 
-def _atr(candles: list, n: int = 14) -> float:
-    """Average True Range。candlesは high/low/close を持つオブジェクト(古い順)。"""
+def _atr(candles, n: int = 14) -> float:
+    """Average True Range。candles は CandleSeries または high/low/close を
+    持つ足のリスト(古い順)。"""
     trs = _true_ranges(candles)
     if not trs:
         return 0.0
@@ -179,13 +262,15 @@ def _atr(candles: list, n: int = 14) -> float:
     return sum(window) / len(window)
 
 
-def _adx(candles: list, n: int = 14) -> float:
+def _adx(candles, n: int = 14) -> float:
     """簡易ADX(トレンドの強さ 0〜100)。25以上でトレンドが強いとされる。"""
     if len(candles) < n + 1:
         return 0.0
+    highs, lows = column(candles, "high"), column(candles, "low")
     plus_dm, minus_dm = [], []
-    for prev, cur in zip(candles[:-1], candles[1:]):
-        up, down = cur.high - prev.high, prev.low - cur.low
+    for prev_high, high, prev_low, low in zip(highs[:-1], highs[1:],
+                                              lows[:-1], lows[1:]):
+        up, down = high - prev_high, prev_low - low
         plus_dm.append(up if up > down and up > 0 else 0.0)
         minus_dm.append(down if down > up and down > 0 else 0.0)
     trs = _true_ranges(candles)
@@ -219,12 +304,13 @@ def _bollinger(closes: list, n: int = 20) -> tuple:
     return (mid, mid + 2 * sd, mid - 2 * sd)
 
 
-def _vwap(candles: list) -> float:
+def _vwap(candles) -> float:
     """出来高加重平均価格(終値近似)。"""
-    total_v = sum(c.volume for c in candles)
+    closes, volumes = column(candles, "close"), column(candles, "volume")
+    total_v = sum(volumes)
     if total_v <= 0:
         return 0.0
-    return sum(c.close * c.volume for c in candles) / total_v
+    return sum(c * v for c, v in zip(closes, volumes)) / total_v
 
 
 def _rsi(closes: list, n: int = 14) -> float:
@@ -257,73 +343,285 @@ def _taker_flow(executions: list, minutes: int = 15) -> tuple:
     if not executions:
         return 0.0, 0.0
     try:
-        ref = datetime.fromisoformat(executions[0]["exec_date"][:19])
+        buy, sell, _trades = aggregate_executions(executions, windows=(minutes,)).taker[minutes]
     except (ValueError, KeyError):
         return 0.0, 0.0
-    cutoff = ref - timedelta(minutes=minutes)
-    buy = sell = 0.0
-    for ex in executions:
-        try:
-            t = datetime.fromisoformat(ex["exec_date"][:19])
-        except (ValueError, KeyError):
-            continue
-        if t < cutoff:
-            break  # 新しい順なのでここから先はすべて窓の外
-        size = float(ex.get("size", 0.0))
-        side = ex.get("side")
-        if side == "BUY":
-            buy += size
-        elif side == "SELL":
-            sell += size
     return buy, sell
 
 
-def _board_depth(api, product_code: str, ltp: float, band_pct: float = 0.5) -> tuple:
-    """中値±band_pct%以内の板数量(買い, 売り)。取得失敗は(0, 0)。"""
+def _board_depth(api, product_code: str, ltp: float, band_pct: float = 0.5,
+                 book: OrderBook = None) -> tuple:
+    """中値±band_pct%以内の板数量と板加重中値(買い, 売り, 加重中値)。
+
+    book にRealtime APIで維持しているローカル板(ready済み)を渡すと
+    RESTの /v1/board 全量取得を省く。取得失敗は(0, 0, 0)。
+    """
     try:
-        board = api.board(product_code=product_code)
-        mid = float(board.get("mid_price") or ltp)
-        band = mid * band_pct / 100.0
-        bid = sum(float(b["size"]) for b in board.get("bids", [])
-                  if float(b["price"]) >= mid - band)
-        ask = sum(float(a["size"]) for a in board.get("asks", [])
-                  if float(a["price"]) <= mid + band)
-        return bid, ask
+        if book is None or not book.ready:
+            book = OrderBook.from_board(api.board(product_code=product_code))
+        mid = book.mid() or ltp
+        bid, ask = book.depth(band_pct, mid)
+        return bid, ask, book.depth_weighted_mid(band_pct, mid)
     except Exception:
-        return 0.0, 0.0
+        return 0.0, 0.0, 0.0
 
 
-def fetch_market_snapshot(product_code: str = "BTC_JPY",
-                          store: HistoryStore = None,
-                          include_macro: bool = True) -> MarketSnapshot:
-    """相場スナップショットを構築する(認証不要)。
+def _fetch_executions(api, product_code: str, horizon_min: int = 65,
+                      max_pages: int = 20, page_size: int = 500) -> tuple:
+    """直近horizon_min分をカバーするまで約定履歴を遡って取得する。
 
-    store を渡すと、取得した1分足を蓄積し、蓄積済みデータから
-    中期(1時間足)の指標も計算して含める。
+    1ページ(500約定)では活発な相場だと数分しか遡れず、60分騰落率や
+    長期SMAが黙って短い窓で計算されてしまうため、最新約定の時刻から
+    horizon_min分前に届くか、max_pagesページを使い切るまでページングする。
+    before のカーソルは前ページの最古IDで決まるため、ページは逐次取得になる
+    (約定IDは全銘柄共通の連番で時刻からIDを推定できず、先読み並列化は不可)。
+
+    戻り値: (約定リスト(records.Execution, 新しい順), 使ったページ数,
+             カバーできた分数)
+    """
+    pages = 0
+
+    def fetch(**params):
+        nonlocal pages
+        pages += 1
+        return api.executions(**params)
+
+    first = fetch(product_code=product_code, count=page_size)
+    if not first:
+        return [], pages, 0.0
+    newest = datetime.fromisoformat(first[0]["exec_date"][:19])
+    since = (newest - timedelta(minutes=horizon_min)).isoformat()
+
+    rows = list(first)
+    if len(first) >= page_size and first[-1]["exec_date"] >= since and max_pages > 1:
+        rest = api.paginate(fetch, page_size=page_size,
+                            before_id=first[-1]["id"],
+                            stop=lambda ex: ex["exec_date"] < since,
+                            product_code=product_code)
+        rows.extend(islice(rest, (max_pages - 1) * page_size))
+
+    executions = records.executions(rows)
+    coverage = (executions[0].exec_ms // 1000
+                - executions[-1].exec_ms // 1000) / 60.0
+    if coverage < horizon_min and pages >= max_pages:
+        logger.warning("約定履歴が%d分に届かず(%.0f分・%dページで打ち切り)",
+                       horizon_min, coverage, pages)
+    return executions, pages, coverage
+
+
+def _fetch_new_executions(api, product_code: str, after_id: int,
+                          max_pages: int = 100, page_size: int = 500) -> tuple:
+    """after_id より新しい約定だけを取得する。
+
+    戻り値: (約定リスト(records.Execution, 新しい順), 使ったページ数,
+             カーソルまで遡れたか)
     """
-    api = bitFlyerAPI(key="", secret="")
+    pages = 0
+
+    def fetch(**params):
+        nonlocal pages
+        pages += 1
+        return api.executions(**params)
+
+    limit = max_pages * page_size
+    executions = records.executions(islice(api.paginate(
+        fetch, page_size=page_size, after_id=after_id,
+        product_code=product_code), limit))
+    return executions, pages, len(executions) < limit
 
-    ticker = api.ticker(product_code=product_code)
-    executions = api.executions(product_code=product_code, count=500)
+
+def _ingest_executions(api, store: HistoryStore, product_code: str,
+                       horizon_min: int, max_pages: int,
+                       ingest_max_pages: int) -> tuple:
+    """約定を履歴DBへ取り込む。戻り値: (取得した約定数, 使ったページ数)
+
+    初回(カーソル未記録)は直近 horizon_min 分を取得して蓄積し、以後は
+    記録済みの最新約定IDより新しい約定だけを取得して1分足に厳密マージする。
+    毎時の --collect でも前回からの約定をすべて取り込むので、
+    1分足に取りこぼし(穴)ができない。
+    """
+    cursor = store.last_exec_id(product_code)
+    if cursor is None:
+        executions, pages, _ = _fetch_executions(
+            api, product_code, horizon_min=horizon_min, max_pages=max_pages)
+        if executions:
+            store.upsert_candles(product_code, _build_candles_1m(executions),
+                                 last_exec_id=executions[0].id)
+            if store.keep_ticks:
+                store.append_ticks(product_code, executions)
+        return len(executions), pages
+
+    executions, pages, complete = _fetch_new_executions(
+        api, product_code, after_id=cursor, max_pages=ingest_max_pages)
+    if not complete:
+        logger.warning("前回の取り込み位置(約定ID %d)まで遡れず"
+                       "(%dページで打ち切り)。1分足に欠けが出ます", cursor, pages)
+    if executions:
+        store.merge_candles(product_code, _build_candles_1m(executions),
+                            last_exec_id=executions[0].id)
+        if store.keep_ticks:
+            store.append_ticks(product_code, executions)
+    return len(executions), pages
+
+
+def _stored_candles(store: HistoryStore, product_code: str, minutes: int) -> CandleSeries:
+    return CandleSeries.from_minute_rows(store.minute_candles(product_code, minutes))
+
+
+def _candle_taker_flow(candles, minutes: int = 15) -> tuple:
+    """1分足のテイカー数量から直近N分(最新足を含む)の(買い, 売り)を集計する。"""
+    if not candles:
+        return 0.0, 0.0
+    candles = CandleSeries.from_candles(candles)
+    times = candles.times
+    cutoff = times[-1] - (minutes - 1) * 60
+    start = len(times)
+    while start > 0 and times[start - 1] >= cutoff:  # 古い順なので後ろから
+        start -= 1
+    return sum(candles.buy_volume[start:]), sum(candles.sell_volume[start:])
+
+
+def _span_minutes(candles) -> float:
+    if len(candles) < 2:
+        return 0.0
+    times = CandleSeries.from_candles(candles).times
+    return (times[-1] - times[0]) / 60.0
+
+
+def _timed(timings: dict, name: str, fn, *args, **kwargs):
+    """fn を実行し、所要時間(ミリ秒)を timings[name] に記録する。"""
+    start = time.perf_counter()
     try:
-        boardstate = api.getboardstate(product_code=product_code)
-    except Exception:
-        boardstate = {"state": "UNKNOWN", "health": "UNKNOWN"}
+        return fn(*args, **kwargs)
+    finally:
+        timings.setdefault(name, (time.perf_counter() - start) * 1000.0)
+
 
-    candles = _build_candles_1m(executions)
-    closes = [c.close for c in candles]
+def _fetch_board(api, product_code: str) -> OrderBook:
+    return OrderBook.from_board(api.board(product_code=product_code))
 
-    ltp = float(ticker["ltp"])
-    best_bid = float(ticker["best_bid"])
-    best_ask = float(ticker["best_ask"])
 
-    bid_depth, ask_depth = _board_depth(api, product_code, ltp)
-    taker_buy, taker_sell = _taker_flow(executions)
+_REQUIRED = object()
 
-    macro = None
-    if include_macro:
-        from .macro import fetch_macro
-        macro = fetch_macro()
+
+def _leg_result(legs: dict, name: str, started: float, timings: dict,
+                default=_REQUIRED):
+    """レッグの結果を LEG_TIMEOUTS[name](全レッグ共通の開始時刻から)まで待つ。
+
+    default を渡したレッグは失敗・時間切れでも default を返す(ベストエフォート)。
+    渡さなければ例外をそのまま上げ、時間切れは TimeoutError にする。
+    """
+    remaining = LEG_TIMEOUTS[name] - (time.perf_counter() - started)
+    try:
+        return legs[name].result(timeout=max(0.0, remaining))
+    except LegTimeout:
+        waited = (time.perf_counter() - started) * 1000.0
+        timings.setdefault(name, waited)
+        if default is _REQUIRED:
+            raise TimeoutError(f"{name} が{LEG_TIMEOUTS[name]:g}秒以内に返りませんでした")
+        logger.warning("%s の取得が%g秒で時間切れ(スナップショットは継続)",
+                       name, LEG_TIMEOUTS[name])
+        return default
+    except Exception:
+        if default is _REQUIRED:
+            raise
+        return default
+
+
+def fetch_market_snapshot(product_code: str = "BTC_JPY",
+                          store: HistoryStore = None,
+                          include_macro: bool = True,
+                          api: bitFlyerAPI = None,
+                          book: OrderBook = None,
+                          horizon_min: int = 65,
+                          max_pages: int = 20,
+                          ingest_max_pages: int = 100) -> MarketSnapshot:
+    """相場スナップショットを構築する(認証不要)。
+
+    store を渡すと、前回取り込んだ約定IDより新しい約定だけを取得して
+    1分足を蓄積し(初回のみ直近 horizon_min 分)、短期の1分足・テイカー
+    フローも蓄積済みデータから読む。蓄積済みデータから中期(1時間足)の
+    指標も計算して含める。カーソル以降の取得は最大 ingest_max_pages ページ。
+    api を渡すとその接続プールを再利用する(ループ実行でサイクルをまたいで
+    TLSハンドシェイクを省く)。省略時はこの呼び出し内だけで使い回して閉じる。
+    book を渡すと板の厚みはそのローカル板(Realtime APIで常時更新)から読む。
+    約定履歴は直近 horizon_min 分を覆うまで最大 max_pages ページ遡る。
+
+    ティッカー・板状態・板・マクロは約定の取り込みと並列に取得し、
+    レッグごとに LEG_TIMEOUTS の時間まで待つ。板状態・板・マクロは
+    失敗・時間切れでも既定値(UNKNOWN・厚み0・空)で続行し、ティッカーと
+    約定の失敗は例外になる。各レッグの所要時間は leg_ms に入る。
+    """
+    if api is None:
+        with bitFlyerAPI(key="", secret="") as own_api:
+            return fetch_market_snapshot(product_code, store=store,
+                                         include_macro=include_macro,
+                                         api=own_api, book=book,
+                                         horizon_min=horizon_min,
+                                         max_pages=max_pages,
+                                         ingest_max_pages=ingest_max_pages)
+
+    # 互いに独立な取得を同時に投げる(約定の取り込みはこのスレッドで)
+    timings = {}
+    pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="aitrader-snapshot")
+    started = time.perf_counter()
+    try:
+        legs = {
+            "ticker": pool.submit(_timed, timings, "ticker", api.ticker,
+                                  product_code=product_code),
+            "boardstate": pool.submit(_timed, timings, "boardstate",
+                                      api.getboardstate, product_code=product_code),
+        }
+        if book is None or not book.ready:
+            legs["board"] = pool.submit(_timed, timings, "board", _fetch_board,
+                                        api, product_code)
+        if include_macro:
+            from .macro import fetch_macro
+            legs["macro"] = pool.submit(
+                _timed, timings, "macro", fetch_macro,
+                transport=getattr(api, "transport", None),
+                timeout=LEG_TIMEOUTS["macro"])
+
+        exec_started = time.perf_counter()
+        if store is not None:
+            exec_count, exec_pages = _ingest_executions(
+                api, store, product_code, horizon_min, max_pages, ingest_max_pages)
+            candles = _stored_candles(store, product_code, horizon_min)
+            exec_coverage = _span_minutes(candles)
+            taker_buy, taker_sell = _candle_taker_flow(candles)
+        else:
+            executions, exec_pages, exec_coverage = _fetch_executions(
+                api, product_code, horizon_min=horizon_min, max_pages=max_pages)
+            aggregate = aggregate_executions(executions, windows=(15,))
+            exec_count = aggregate.count
+            candles = aggregate.candles
+            taker_buy, taker_sell, _trades = aggregate.taker[15]
+        timings["executions"] = (time.perf_counter() - exec_started) * 1000.0
+
+        # ティッカーは必須(失敗・時間切れはこれまで通り例外として上げる)
+        ticker = records.Ticker.from_dict(
+            _leg_result(legs, "ticker", started, timings))
+        boardstate = _leg_result(legs, "boardstate", started, timings,
+                                 default={"state": "UNKNOWN", "health": "UNKNOWN"})
+        if "board" in legs:
+            book = _leg_result(legs, "board", started, timings, default=None)
+        macro = None
+        if include_macro:
+            macro = _leg_result(legs, "macro", started, timings, default={})
+    finally:
+        pool.shutdown(wait=False)  # 時間切れのレッグは待たない
+
+    closes = candles.close
+
+    ltp = ticker.ltp
+    best_bid = ticker.best_bid
+    best_ask = ticker.best_ask
+
+    if book is None:  # 板の取得に失敗
+        bid_depth, ask_depth, weighted_mid = 0.0, 0.0, 0.0
+    else:
+        bid_depth, ask_depth, weighted_mid = _board_depth(api, product_code, ltp,
+                                                          book=book)
 
     snapshot = MarketSnapshot(
         product_code=product_code,
@@ -332,7 +630,7 @@ def fetch_market_snapshot(product_code: str = "BTC_JPY",
         best_bid=best_bid,
         best_ask=best_ask,
         spread=best_ask - best_bid,
-        volume_24h=float(ticker.get("volume_by_product", 0.0)),
+        volume_24h=ticker.volume_by_product,
         board_state=str(boardstate.get("state", "UNKNOWN")),
         health=str(boardstate.get("health", "UNKNOWN")),
         candles_1m=candles,
@@ -343,20 +641,27 @@ def fetch_market_snapshot(product_code: str = "BTC_JPY",
         change_pct_60m=_change_pct(closes, 60),
         bid_depth=bid_depth,
         ask_depth=ask_depth,
+        weighted_mid=weighted_mid,
         taker_buy_15m=taker_buy,
         taker_sell_15m=taker_sell,
+        exec_count=exec_count,
+        exec_pages=exec_pages,
+        exec_coverage_min=exec_coverage,
         macro=macro,
+        leg_ms=dict(timings),
     )
 
     if store is not None:
-        store.upsert_candles(product_code, candles)
         hourly = store.hourly_candles(product_code, hours=72)
-        hourly_closes = [c.close for c in hourly]
+        hourly_closes = hourly.close
         snapshot.candles_1h = hourly
         snapshot.sma_8h = _sma(hourly_closes, 8)
         snapshot.sma_24h = _sma(hourly_closes, 24)
         snapshot.rsi_14h = _rsi(hourly_closes, 14)
         snapshot.change_pct_24h = _change_pct(hourly_closes, 24)
         snapshot.history_hours = store.coverage_hours(product_code)
+        snapshot.indicators = {
+            timeframe: update_indicators(store, product_code, timeframe)
+            for timeframe in ("1m", "1h")}
 
     return snapshot
@@ -160,34 +160,49 @@ class PaperBook:
         """, (snapshot.timestamp, actor, vote, executed, price, size,
               snapshot.ltp, position, avg_cost, realized))
 
-    def record_guard_exit(self, snapshot, reason: str) -> float:
-        """ガード(ルール損切り)の全量SELLを協議会台帳に記録し、売却量を返す。
+    def record_guard_exit(self, snapshot, reason: str, price: float = None,
+                          source: str = "guard", size: float = None,
+                          ts: str = None) -> float:
+        """損切り・保護注文による売却を協議会台帳に記録し、売却量を返す。
 
-        実注文とペーパー台帳の整合を保つため、実売買の有無にかかわらず
-        協議会のポジションをここでクローズする。council_log にも理由を
-        残し、ダッシュボードの売買詳細に表示されるようにする。
+        台帳は実際に売れた分だけを減らす。呼び出し側は売却が成立してから
+        呼ぶこと(ガードの成行SELLは発注が通った後=ドライランでは常に、
+        保護注文は取引所で約定を確認した後)。council_log にも理由を残し、
+        ダッシュボードの売買詳細に表示されるようにする。
+
+        price: 約定価格(省略時はbid)。size: 売却量(省略時は全量。
+        ポジションを超える分は切り詰める)。source: "guard" / "protect"。
+        ts: 記録する時刻(省略時は snapshot.timestamp。同じサイクルで
+        record_cycle が同じ時刻に書く場合は、それより前の時刻を渡す)。
         """
         position, avg_cost, realized = self._last_state(COUNCIL_ACTOR)
         if position <= 0:
             return 0.0
-        price = snapshot.best_bid
-        realized += (price - avg_cost) * position
+        size = position if size is None else min(size, position)
+        if size <= 0:
+            return 0.0
+        price = snapshot.best_bid if price is None else price
+        ts = snapshot.timestamp if ts is None else ts
+        realized += (price - avg_cost) * size
+        position -= size
+        if position <= 1e-12:
+            position, avg_cost = 0.0, 0.0
         self.conn.execute("""
             INSERT OR REPLACE INTO paper_ledger
                 (ts, actor, vote, executed, price, size, ltp,
                  position, avg_cost, realized_pnl)
-            VALUES (?, ?, 'SELL', 1, ?, ?, ?, 0.0, 0.0, ?)
-        """, (snapshot.timestamp, COUNCIL_ACTOR, price, position,
-              snapshot.ltp, realized))
+            VALUES (?, ?, 'SELL', 1, ?, ?, ?, ?, ?, ?)
+        """, (ts, COUNCIL_ACTOR, price, size, snapshot.ltp, position, avg_cost,
+              realized))
         self.conn.execute("""
             INSERT OR REPLACE INTO council_log
                 (ts, actor, decision, confidence, weight, score,
                  served_by, reasoning, tokens_in, tokens_out, cost_usd,
                  expected_pct)
-            VALUES (?, ?, 'SELL', 0.0, 0.0, 0.0, 'guard', ?, 0, 0, NULL, NULL)
-        """, (snapshot.timestamp, COUNCIL_ACTOR, reason))
+            VALUES (?, ?, 'SELL', 0.0, 0.0, 0.0, ?, ?, 0, 0, NULL, NULL)
+        """, (ts, COUNCIL_ACTOR, source, reason))
         self.conn.commit()
-        return position
+        return size
 
     # --- 集計 ---
 
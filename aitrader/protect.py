@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""取引所側の保護注文(逆指値ストップ / OCO)。
+
+毎時ガード(guard.py)のルール損切りは --collect が走るまで発動しないため、
+急落から成行SELLまで最大1時間遅れる。保護注文を有効にすると、協議会が
+ポジションを持つ間は bitFlyer に親注文(sendparentorder)を置いておき、
+損切りを取引所のマッチング速度で執行させる:
+
+  - take_profit_pct = 0 → SIMPLE の STOP SELL(平均取得 × (1 - stop_loss_pct))
+  - take_profit_pct > 0 → OCO(利確の指値SELL + 上記のSTOP SELL)
+
+協議会のエントリーは成行の子注文なので IFD / IFDOCO は使わず、約定後に
+現在ポジション全量を覆う保護注文を置き直す。数量・価格は協議会の仮想台帳
+(PaperBook)の position / avg_cost から決め、実残高で切り詰める。
+ポジションが変わったら cancelparentorder で取り消して置き直し、
+ポジションが無くなれば取り消す。置いた注文は履歴DBの protective_orders
+テーブルに保存し、約定を検知したら台帳をクローズして整合を保つ。
+
+ドライランでは実注文を出さない(ログのみ)。
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# 置き直し判定の許容誤差(数量・価格がこの範囲なら既存の注文を維持する)
+_SIZE_EPS = 1e-8
+_PRICE_EPS = 1e-6
+
+
+def _round_price(price: float) -> float:
+    """取引所の呼値に丸める(1000円以上は1円単位、未満は小数3桁)。"""
+    return float(round(price)) if price >= 1000 else round(price, 3)
+
+
+class ProtectiveOrders:
+    def __init__(self, config, trader, conn):
+        self.config = config
+        self.trader = trader
+        self.conn = conn
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS protective_orders (
+                product_code TEXT PRIMARY KEY,
+                acceptance_id TEXT NOT NULL,  -- parent_order_acceptance_id
+                order_method TEXT NOT NULL,   -- SIMPLE / OCO
+                size REAL NOT NULL,
+                stop_price REAL NOT NULL,     -- STOPのトリガー価格
+                take_price REAL,              -- OCOの利確指値(SIMPLEはNULL)
+                placed_at REAL NOT NULL       -- 発注時刻(epoch秒)
+            )
+        """)
+        self.conn.commit()
+
+    @property
+    def enabled(self) -> bool:
+        """AITRADER_PROTECTIVE_STOP が有効で、発注できる(またはドライラン)か。"""
+        return bool(self.config.protective_stop
+                    and (self.config.dry_run or self.trader.api is not None))
+
+    # --- 状態 ---
+
+    def current(self):
+        """置いてある保護注文(dict)。無ければ None。"""
+        row = self.conn.execute("""
+            SELECT acceptance_id, order_method, size, stop_price, take_price,
+                   placed_at
+            FROM protective_orders WHERE product_code = ?
+        """, (self.config.product_code,)).fetchone()
+        if row is None:
+            return None
+        keys = ("acceptance_id", "order_method", "size", "stop_price",
+                "take_price", "placed_at")
+        return dict(zip(keys, row))
+
+    def _save(self, acceptance_id, order_method, size, stop_price, take_price):
+        self.conn.execute("""
+            INSERT OR REPLACE INTO protective_orders
+                (product_code, acceptance_id, order_method, size, stop_price,
+                 take_price, placed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (self.config.product_code, acceptance_id, order_method, size,
+              stop_price, take_price, time.time()))
+        self.conn.commit()
+
+    def _clear(self):
+        self.conn.execute("DELETE FROM protective_orders WHERE product_code = ?",
+                          (self.config.product_code,))
+        self.conn.commit()
+
+    # --- 発注・取消 ---
+
+    def target(self, position_state: dict) -> tuple:
+        """台帳のポジションから (数量, ストップ価格, 利確価格|None) を求める。"""
+        position = (position_state or {}).get("position", 0.0)
+        avg_cost = (position_state or {}).get("avg_cost", 0.0)
+        if position <= 0 or avg_cost <= 0:
+            return 0.0, 0.0, None
+        stop = _round_price(avg_cost * (1.0 - self.config.stop_loss_pct / 100.0))
+        take = None
+        if self.config.take_profit_pct > 0:
+            take = _round_price(avg_cost * (1.0 + self.config.take_profit_pct / 100.0))
+        return round(position, 8), stop, take
+
+    def refresh(self, position_state: dict, paper=None, snapshot=None) -> str:
+        """保護注文を台帳のポジションに合わせる(置く/置き直す/取り消す)。
+
+        paper / snapshot は取消が拒否されたときの約定確認に使う(cancel 参照)。
+        何をしたかを返す(ログ・テスト用)。
+        """
+        size, stop, take = self.target(position_state)
+        if size <= 0:
+            return "取消" if self.cancel(paper, snapshot) else ""
+
+        current = self.current()
+        if current is not None \
+                and abs(current["size"] - size) < _SIZE_EPS \
+                and abs(current["stop_price"] - stop) < _PRICE_EPS \
+                and (current["take_price"] or 0.0) == (take or 0.0):
+            return ""
+
+        if self.config.dry_run:
+            logger.info("[DRY RUN] 保護注文 %s SELL %.6f %s (ストップ %.0f%s) "
+                        "— 実注文は送信していません",
+                        self.config.product_code, size, self.config.base_currency,
+                        stop, f" / 利確 {take:.0f}" if take else "")
+            return ""
+
+        # 置き直し: 旧注文が残ると売却可能残高を拘束するため先に取り消す
+        if current is not None:
+            if not self.cancel(paper, snapshot):
+                return ""  # 取消できていない(約定済みなら台帳は sync でクローズ済み)
+            if self.trader.account is not None:
+                # 同期済みの残高は旧注文が拘束していた時点の値なので読み直させる
+                self.trader.account.invalidate()
+        available = self.trader.get_balances()[self.config.base_currency]
+        size = round(min(size, available), 8)
+        if size <= 0:
+            logger.warning("保護注文を置けません: %s残高なし", self.config.base_currency)
+            return ""
+
+        stop_leg = {"product_code": self.config.product_code,
+                    "condition_type": "STOP", "side": "SELL",
+                    "size": size, "trigger_price": stop}
+        if take:
+            method = "OCO"
+            legs = [{"product_code": self.config.product_code,
+                     "condition_type": "LIMIT", "side": "SELL",
+                     "size": size, "price": take}, stop_leg]
+        else:
+            method, legs = "SIMPLE", [stop_leg]
+        result = self.trader.api.sendparentorder(
+            order_method=method, time_in_force="GTC", parameters=legs)
+        if not (isinstance(result, dict) and "parent_order_acceptance_id" in result):
+            logger.error("保護注文の発注失敗: %s", result)
+            return ""
+        acceptance_id = result["parent_order_acceptance_id"]
+        self._save(acceptance_id, method, size, stop, take)
+        logger.info("保護注文: %s SELL %.6f %s ストップ %.0f%s (受付ID: %s)",
+                    self.config.product_code, size, self.config.base_currency,
+                    stop, f" / 利確 {take:.0f}" if take else "", acceptance_id)
+        return "発注"
+
+    def cancel(self, paper=None, snapshot=None) -> bool:
+        """置いてある保護注文を取り消す。取り消せたら True。
+
+        取引所が取消を受け付けるのは空の応答のときだけ。エラー応答
+        (すでに約定していた、など)なら記録は消さずに sync で状態を確かめ、
+        約定していれば台帳をクローズする(paper / snapshot が必要。
+        無ければ記録を残し、次の sync に任せる)。その場合は False。
+        """
+        current = self.current()
+        if current is None:
+            return False
+        if not self.config.dry_run and self.trader.api is not None:
+            result = self.trader.api.cancelparentorder(
+                product_code=self.config.product_code,
+                parent_order_acceptance_id=current["acceptance_id"])
+            if result:
+                logger.warning("保護注文の取消が拒否されました: %s (%s)",
+                               current["acceptance_id"], result)
+                if paper is not None and snapshot is not None:
+                    self.sync(paper, snapshot)
+                return False
+            logger.info("保護注文を取消: %s", current["acceptance_id"])
+        self._clear()
+        return True
+
+    # --- 約定検知 ---
+
+    def sync(self, paper, snapshot):
+        """保護注文の状態を取引所に問い合わせ、約定していれば台帳をクローズする。
+
+        約定: 協議会の台帳に約定価格・約定量でSELLを記録し、その内容を返す。
+        取消・失効: 記録だけ消す(次の refresh で置き直される)。
+        受付中・未反映: 何もしない。戻り値は約定時の dict、それ以外は None。
+        """
+        current = self.current()
+        if current is None or self.trader.api is None:
+            return None
+        rows = self.trader.api.getparentorders(
+            product_code=self.config.product_code, count=100)
+        order = next((r for r in rows or []
+                      if r.get("parent_order_acceptance_id") == current["acceptance_id"]),
+                     None)
+        if order is None:
+            return None
+        state = order.get("parent_order_state")
+        if state == "COMPLETED":
+            price = float(order.get("average_price") or snapshot.best_bid)
+            # 実残高で切り詰めた注文は台帳のポジションより小さい。約定量だけ減らす
+            executed = float(order.get("executed_size") or current["size"])
+            take = current["take_price"]
+            kind = "利確指値" if take and price >= take else "保護ストップ"
+            reason = (f"{kind}約定: {price:,.0f} で {executed:.6f} "
+                      f"{self.config.base_currency} を売却(取引所側で執行)")
+            # このサイクルの協議結果(record_cycle)が snapshot の時刻で台帳を
+            # 上書きしないよう、約定はその1秒前の時刻で記録する
+            ts = (datetime.fromisoformat(snapshot.timestamp)
+                  - timedelta(seconds=1)).isoformat(timespec="seconds")
+            size = paper.record_guard_exit(snapshot, reason, price=price,
+                                           source="protect", size=executed, ts=ts)
+            self._clear()
+            logger.warning("%s", reason)
+            return {"price": price, "size": size, "reason": reason}
+        if state in ("CANCELED", "EXPIRED", "REJECTED"):
+            logger.warning("保護注文が %s になりました(次回置き直します): %s",
+                           state, current["acceptance_id"])
+            self._clear()
+        return None
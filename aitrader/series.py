@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""列指向のローソク足系列(CandleSeries)と、1本ずつの足の型。
+
+1本ごとの @dataclass のリストは1本あたり数百バイトになり、指標計算の
+たびに [c.close for c in candles] のような一時リストを作り直していた。
+CandleSeries は各列を array('d')(時刻は array('q') のエポック秒)で並べて
+持ち(1本あたり約70バイト)、列は memoryview で返すので、スライスも
+列の取り出しもコピーしない。
+
+従来のリストとの互換のため、添字・反復では Candle / HourCandle を
+その場で作って返す(ビューのテキスト生成など少数本の用途向け)。
+"""
+
+import time
+from array import array
+from dataclasses import dataclass
+
+from bitflyerapi import records
+
+
+@dataclass
+class Candle:
+    time: str   # ISO8601(分単位)
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    buy_volume: float = 0.0   # テイカー買いの約定数量
+    sell_volume: float = 0.0  # テイカー売りの約定数量
+
+
+@dataclass
+class HourCandle:
+    time: str   # "YYYY-MM-DDTHH" (UTC)
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    minutes: int  # そのhourに含まれる1分足の本数(データ充足度)
+
+
+# 時間足ごとの時刻ラベルの書式(Candle.time / HourCandle.time と同じ形)
+_LABELS = {"1m": "%Y-%m-%dT%H:%M:00Z", "1h": "%Y-%m-%dT%H"}
+
+_FLOAT_COLUMNS = ("open", "high", "low", "close", "volume",
+                  "buy_volume", "sell_volume")
+
+
+def _label_epoch(label: str) -> int:
+    """"YYYY-MM-DDTHH:MM..." または "YYYY-MM-DDTHH" のエポック秒。"""
+    if len(label) < 16:
+        label += ":00"
+    return records.epoch_ms(label[:16] + ":00") // 1000
+
+
+class CandleSeries:
+    """古い順のローソク足を列ごとに持つ系列。
+
+    timeframe: "1m"(行は Candle)または "1h"(行は HourCandle)。
+    列: time(エポック秒), open, high, low, close, volume, buy_volume,
+        sell_volume, minutes(1時間足に含まれる1分足の本数。1分足は1)、
+        trades(約定数。約定から直接組み立てた足のみ、蓄積データからは0)。
+    """
+
+    def __init__(self, timeframe: str = "1m", columns: dict = None):
+        if timeframe not in _LABELS:
+            raise ValueError(f"未対応の時間足: {timeframe}")
+        self.timeframe = timeframe
+        if columns is None:
+            columns = {"time": array("q"), "minutes": array("q"), "trades": array("q")}
+            columns.update((name, array("d")) for name in _FLOAT_COLUMNS)
+        # memoryview にしておくとスライスがコピーにならない
+        self._cols = {name: memoryview(col) for name, col in columns.items()}
+
+    # --- 作成 ---
+
+    @classmethod
+    def from_candles(cls, candles, timeframe: str = None) -> "CandleSeries":
+        """Candle / HourCandle のリスト(古い順)から作る。CandleSeries はそのまま返す。"""
+        if isinstance(candles, CandleSeries):
+            return candles
+        candles = list(candles)
+        if timeframe is None:
+            timeframe = "1h" if candles and isinstance(candles[0], HourCandle) else "1m"
+        columns = {"time": array("q", (_label_epoch(c.time) for c in candles)),
+                   "minutes": array("q", (getattr(c, "minutes", 1) for c in candles)),
+                   "trades": array("q", [0]) * len(candles)}
+        for name in _FLOAT_COLUMNS:
+            columns[name] = array("d", (getattr(c, name, 0.0) for c in candles))
+        return cls(timeframe, columns)
+
+    @classmethod
+    def from_minute_rows(cls, rows) -> "CandleSeries":
+        """HistoryStore.minute_candles の行
+        (minute, open, high, low, close, volume, buy_volume, sell_volume) から作る。"""
+        rows = list(rows)
+        columns = {"time": array("q", (_label_epoch(r[0]) for r in rows)),
+                   "minutes": array("q", [1]) * len(rows),
+                   "trades": array("q", [0]) * len(rows)}
+        for i, name in enumerate(_FLOAT_COLUMNS, 1):
+            columns[name] = array("d", (r[i] for r in rows))
+        return cls("1m", columns)
+
+    @classmethod
+    def from_columns(cls, timeframe: str, time, open, high, low, close, volume,
+                     buy_volume=None, sell_volume=None, minutes=None,
+                     trades=None) -> "CandleSeries":
+        """列(エポック秒と各値の配列・リスト)から作る。省略した列は0(minutesは1)。"""
+        n = len(time)
+        columns = {"time": array("q", time),
+                   "minutes": array("q", minutes if minutes is not None else [1] * n),
+                   "trades": array("q", trades if trades is not None else [0] * n)}
+        values = {"open": open, "high": high, "low": low, "close": close,
+                  "volume": volume, "buy_volume": buy_volume,
+                  "sell_volume": sell_volume}
+        for name in _FLOAT_COLUMNS:
+            col = values[name]
+            columns[name] = array("d", col) if col is not None else array("d", [0.0]) * n
+        return cls(timeframe, columns)
+
+    # --- 列 ---
+
+    def column(self, name: str) -> memoryview:
+        return self._cols[name]
+
+    @property
+    def times(self) -> memoryview:
+        """各足の開始時刻(エポック秒)。"""
+        return self._cols["time"]
+
+    open = property(lambda self: self._cols["open"])
+    high = property(lambda self: self._cols["high"])
+    low = property(lambda self: self._cols["low"])
+    close = property(lambda self: self._cols["close"])
+    volume = property(lambda self: self._cols["volume"])
+    buy_volume = property(lambda self: self._cols["buy_volume"])
+    sell_volume = property(lambda self: self._cols["sell_volume"])
+    minutes = property(lambda self: self._cols["minutes"])
+    trades = property(lambda self: self._cols["trades"])
+
+    def label(self, i: int) -> str:
+        """i 本目の時刻ラベル(Candle.time / HourCandle.time と同じ形)。"""
+        return time.strftime(_LABELS[self.timeframe], time.gmtime(self._cols["time"][i]))
+
+    # --- シーケンスとしての振る舞い ---
+
+    def __len__(self) -> int:
+        return len(self._cols["time"])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            sliced = CandleSeries.__new__(CandleSeries)
+            sliced.timeframe = self.timeframe
+            sliced._cols = {name: col[index] for name, col in self._cols.items()}
+            return sliced
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("CandleSeries index out of range")
+        c = self._cols
+        if self.timeframe == "1h":
+            return HourCandle(time=self.label(index), open=c["open"][index],
+                              high=c["high"][index], low=c["low"][index],
+                              close=c["close"][index], volume=c["volume"][index],
+                              minutes=c["minutes"][index])
+        return Candle(time=self.label(index), open=c["open"][index],
+                      high=c["high"][index], low=c["low"][index],
+                      close=c["close"][index], volume=c["volume"][index],
+                      buy_volume=c["buy_volume"][index],
+                      sell_volume=c["sell_volume"][index])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self) -> str:
+        if not len(self):
+            return f"CandleSeries({self.timeframe}, empty)"
+        return (f"CandleSeries({self.timeframe}, {len(self)} bars, "
+                f"{self.label(0)}..{self.label(-1)})")
+
+
+def column(candles, name: str):
+    """足の列。CandleSeries なら memoryview(コピーなし)、リストなら値のリスト。"""
+    if isinstance(candles, CandleSeries):
+        return candles.column(name)
+    return [getattr(c, name) for c in candles]
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""確定足を1本ずつ投入して O(1) で更新するストリーミング指標。
+
+market.py の指標はサイクルごとに窓全体から計算し直す。ここでは各指標が
+状態(直近のEMA値・Wilder平滑値・ローリング窓の合計など)を持ち、新しく
+確定した足だけを update() で流し込む。状態は JSON にして履歴DBの
+indicator_state テーブルに保存し、次のサイクル(別プロセスの --collect /
+--once でも)はその続きから更新する。
+
+RSI / ATR / ADX は Wilder の平滑化(最初の n 本の単純平均を種に
+ avg = (avg × (n-1) + x) / n)。market.py の簡易版(直近 n 本の単純合計)
+とは値が異なる。EMA は先頭値を種にした market._ema_series と同じ漸化式、
+SMA・ボリンジャーはローリング窓で、こちらは market.py と同じ値になる。
+"""
+
+import json
+from collections import deque
+
+from .series import CandleSeries
+
+# 状態の形式。指標の構成を変えたら上げる(古い状態は捨てて作り直す)
+STATE_VERSION = 1
+
+# 状態が無いときに遡って投入する確定足の上限(Wilder平滑は数百本で収束する)
+WARMUP_BARS = {"1m": 1440, "1h": 24 * 31}
+
+
+class _Stream:
+    """状態の保存・復元の共通部分。FIELDS に JSON へ書く属性名を並べる。"""
+    FIELDS = ()
+
+    def to_dict(self) -> dict:
+        state = {"type": type(self).__name__}
+        for name in self.FIELDS:
+            value = getattr(self, name)
+            state[name] = list(value) if isinstance(value, deque) else value
+        return state
+
+    @classmethod
+    def from_dict(cls, state: dict):
+        obj = cls.__new__(cls)
+        for name in cls.FIELDS:
+            setattr(obj, name, state[name])
+        obj._restore()
+        return obj
+
+    def _restore(self):
+        pass
+
+
+class EMA(_Stream):
+    FIELDS = ("n", "value", "count")
+
+    def __init__(self, n: int):
+        self.n = n
+        self.value = None
+        self.count = 0
+
+    def update(self, x: float) -> float:
+        if self.value is None:
+            self.value = x
+        else:
+            k = 2.0 / (self.n + 1)
+            self.value = x * k + self.value * (1 - k)
+        self.count += 1
+        return self.value
+
+
+class Rolling(_Stream):
+    """直近 n 本の平均と母標準偏差(SMA・ボリンジャー用)。
+
+    合計は足し引きで更新し、n 本ごとに窓から取り直して誤差の蓄積を止める
+    (償却 O(1))。二乗和は窓の先頭値からの差で持ち、価格の桁による桁落ちを抑える。
+    """
+    FIELDS = ("n", "window", "shift", "total", "total_sq", "since_resum")
+
+    def __init__(self, n: int):
+        self.n = n
+        self.window = deque()
+        self.shift = 0.0
+        self.total = 0.0      # sum(x - shift)
+        self.total_sq = 0.0   # sum((x - shift) ** 2)
+        self.since_resum = 0
+
+    def _restore(self):
+        self.window = deque(self.window)
+
+    def _resum(self):
+        self.shift = self.window[0]
+        self.total = sum(x - self.shift for x in self.window)
+        self.total_sq = sum((x - self.shift) ** 2 for x in self.window)
+        self.since_resum = 0
+
+    def update(self, x: float):
+        self.window.append(x)
+        if len(self.window) == 1:
+            self.shift = x
+        d = x - self.shift
+        self.total += d
+        self.total_sq += d * d
+        if len(self.window) > self.n:
+            old = self.window.popleft() - self.shift
+            self.total -= old
+            self.total_sq -= old * old
+        self.since_resum += 1
+        if self.since_resum >= self.n:
+            self._resum()
+
+    @property
+    def ready(self) -> bool:
+        return len(self.window) >= self.n
+
+    @property
+    def mean(self) -> float:
+        if not self.window:
+            return 0.0
+        return self.shift + self.total / len(self.window)
+
+    @property
+    def std(self) -> float:
+        if not self.window:
+            return 0.0
+        m = self.total / len(self.window)
+        return max(self.total_sq / len(self.window) - m * m, 0.0) ** 0.5
+
+
+class WilderRSI(_Stream):
+    FIELDS = ("n", "prev", "avg_gain", "avg_loss", "count")
+
+    def __init__(self, n: int = 14):
+        self.n = n
+        self.prev = None
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.count = 0   # 投入した値幅の数
+
+    def update(self, close: float):
+        if self.prev is not None:
+            diff = close - self.prev
+            gain, loss = max(diff, 0.0), max(-diff, 0.0)
+            self.count += 1
+            if self.count <= self.n:  # 最初の n 本は単純平均を積み上げる
+                self.avg_gain += gain / self.n
+                self.avg_loss += loss / self.n
+            else:
+                self.avg_gain = (self.avg_gain * (self.n - 1) + gain) / self.n
+                self.avg_loss = (self.avg_loss * (self.n - 1) + loss) / self.n
+        self.prev = close
+
+    @property
+    def value(self):
+        if self.count < self.n:
+            return None
+        if self.avg_loss == 0:
+            return 100.0
+        return 100.0 - 100.0 / (1.0 + self.avg_gain / self.avg_loss)
+
+
+class WilderATR(_Stream):
+    FIELDS = ("n", "prev_close", "atr", "count")
+
+    def __init__(self, n: int = 14):
+        self.n = n
+        self.prev_close = None
+        self.atr = 0.0
+        self.count = 0   # 投入した True Range の数
+
+    def update(self, high: float, low: float, close: float):
+        if self.prev_close is not None:
+            tr = max(high - low, abs(high - self.prev_close),
+                     abs(low - self.prev_close))
+            self.count += 1
+            if self.count <= self.n:
+                self.atr += tr / self.n
+            else:
+                self.atr = (self.atr * (self.n - 1) + tr) / self.n
+        self.prev_close = close
+
+    @property
+    def value(self):
+        return self.atr if self.count >= self.n else None
+
+
+class WilderADX(_Stream):
+    FIELDS = ("n", "prev", "tr", "plus_dm", "minus_dm", "adx", "count", "dx_count")
+
+    def __init__(self, n: int = 14):
+        self.n = n
+        self.prev = None          # 前の足の [high, low, close]
+        self.tr = 0.0             # Wilder平滑した TR / +DM / -DM の合計
+        self.plus_dm = 0.0
+        self.minus_dm = 0.0
+        self.adx = 0.0
+        self.count = 0            # 投入した足の差分の数
+        self.dx_count = 0
+
+    def update(self, high: float, low: float, close: float):
+        if self.prev is not None:
+            prev_high, prev_low, prev_close = self.prev
+            up, down = high - prev_high, prev_low - low
+            plus_dm = up if up > down and up > 0 else 0.0
+            minus_dm = down if down > up and down > 0 else 0.0
+            tr = max(high - low, abs(high - prev_close), abs(low - prev_close))
+            self.count += 1
+            if self.count <= self.n:
+                self.tr += tr
+                self.plus_dm += plus_dm
+                self.minus_dm += minus_dm
+            else:
+                self.tr += tr - self.tr / self.n
+                self.plus_dm += plus_dm - self.plus_dm / self.n
+                self.minus_dm += minus_dm - self.minus_dm / self.n
+            if self.count >= self.n:
+                self._add_dx()
+        self.prev = [high, low, close]
+
+    def _add_dx(self):
+        tr = self.tr or 1e-9
+        pdi = 100.0 * self.plus_dm / tr
+        mdi = 100.0 * self.minus_dm / tr
+        dx = 100.0 * abs(pdi - mdi) / ((pdi + mdi) or 1e-9)
+        self.dx_count += 1
+        if self.dx_count <= self.n:
+            self.adx += dx / self.n
+        else:
+            self.adx = (self.adx * (self.n - 1) + dx) / self.n
+
+    @property
+    def value(self):
+        return self.adx if self.dx_count >= self.n else None
+
+
+class MACD(_Stream):
+    FIELDS = ("fast", "slow", "signal", "count")
+
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.signal = EMA(signal)
+        self.count = 0
+
+    def to_dict(self) -> dict:
+        return {"type": "MACD", "count": self.count,
+                "fast": self.fast.to_dict(), "slow": self.slow.to_dict(),
+                "signal": self.signal.to_dict()}
+
+    def _restore(self):
+        self.fast = EMA.from_dict(self.fast)
+        self.slow = EMA.from_dict(self.slow)
+        self.signal = EMA.from_dict(self.signal)
+
+    def update(self, close: float):
+        line = self.fast.update(close) - self.slow.update(close)
+        self.signal.update(line)
+        self.count += 1
+
+    @property
+    def value(self):
+        """(MACD線, シグナル線, ヒストグラム)。market._macd と同じく
+        slow + signal 本に満たなければ None。"""
+        if self.count < self.slow.n + self.signal.n:
+            return None
+        line = self.fast.value - self.slow.value
+        return line, self.signal.value, line - self.signal.value
+
+
+_TYPES = {cls.__name__: cls for cls in (EMA, Rolling, WilderRSI, WilderATR,
+                                        WilderADX, MACD)}
+
+
+class IndicatorSet:
+    """1銘柄・1時間足ぶんの指標一式。確定足を古い順に update() で流し込む。"""
+
+    def __init__(self):
+        self.last_time = None   # 最後に投入した足の time
+        self.bars = 0
+        self.streams = {
+            "sma_8": Rolling(8),
+            "sma_24": Rolling(24),
+            "ema_8": EMA(8),
+            "ema_24": EMA(24),
+            "boll_20": Rolling(20),
+            "rsi_14": WilderRSI(14),
+            "atr_14": WilderATR(14),
+            "adx_14": WilderADX(14),
+            "macd": MACD(12, 26, 9),
+        }
+
+    def update(self, candle) -> bool:
+        """確定足を1本投入する。投入済みの時刻以前なら無視して False。"""
+        if self.last_time is not None and candle.time <= self.last_time:
+            return False
+        s = self.streams
+        close = candle.close
+        for name in ("sma_8", "sma_24", "ema_8", "ema_24", "boll_20",
+                     "rsi_14", "macd"):
+            s[name].update(close)
+        s["atr_14"].update(candle.high, candle.low, close)
+        s["adx_14"].update(candle.high, candle.low, close)
+        self.last_time = candle.time
+        self.bars += 1
+        return True
+
+    def values(self) -> dict:
+        """最新値。まだ本数が足りない指標は None。"""
+        s = self.streams
+        boll = s["boll_20"]
+        return {
+            "bars": self.bars,
+            "last_time": self.last_time,
+            "sma_8": s["sma_8"].mean if s["sma_8"].ready else None,
+            "sma_24": s["sma_24"].mean if s["sma_24"].ready else None,
+            "ema_8": s["ema_8"].value,
+            "ema_24": s["ema_24"].value,
+            "rsi_14": s["rsi_14"].value,
+            "atr_14": s["atr_14"].value,
+            "adx_14": s["adx_14"].value,
+            "macd": s["macd"].value,
+            "bollinger_20": ((boll.mean, boll.mean + 2 * boll.std,
+                              boll.mean - 2 * boll.std) if boll.ready else None),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps({"version": STATE_VERSION, "last_time": self.last_time,
+                           "bars": self.bars,
+                           "streams": {name: stream.to_dict()
+                                       for name, stream in self.streams.items()}})
+
+    @classmethod
+    def from_json(cls, text: str):
+        """保存した状態から復元する。形式が古ければ None(作り直す)。"""
+        state = json.loads(text)
+        if state.get("version") != STATE_VERSION:
+            return None
+        obj = cls()
+        obj.last_time = state["last_time"]
+        obj.bars = state["bars"]
+        obj.streams = {name: _TYPES[s["type"]].from_dict(s)
+                       for name, s in state["streams"].items()}
+        return obj
+
+
+def _closed_bars(store, product_code: str, timeframe: str, after, limit: int) -> list:
+    """after より新しい確定足(古い順)。最新の足はまだ確定していないので除く。"""
+    if timeframe == "1h":
+        bars = store.hourly_candles_after(product_code, after, limit + 1)
+    elif timeframe == "1m":
+        bars = CandleSeries.from_minute_rows(
+            store.minute_candles_after(product_code, after, limit + 1))
+    else:
+        raise ValueError(f"未対応の時間足: {timeframe}")
+    return bars[:-1]
+
+
+def update_indicators(store, product_code: str, timeframe: str) -> dict:
+    """履歴DBの確定足のうち未投入の分だけを流し込み、状態を保存して最新値を返す。
+
+    timeframe: "1m"(1分足)または "1h"(1時間足)。状態が無い(または形式が
+    古い)ときは直近 WARMUP_BARS 本から作る。停止が長く未投入の足がそれより
+    多いときも直近 WARMUP_BARS 本だけを流し込む。
+    """
+    text = store.load_indicator_state(product_code, timeframe)
+    indicators = IndicatorSet.from_json(text) if text else None
+    if indicators is None:
+        indicators = IndicatorSet()
+    bars = _closed_bars(store, product_code, timeframe, indicators.last_time,
+                        WARMUP_BARS[timeframe])
+    if sum(indicators.update(bar) for bar in bars):
+        store.save_indicator_state(product_code, timeframe,
+                                   indicators.last_time, indicators.to_json())
+    return indicators.values()
@@ -17,8 +17,12 @@ class Trader:
         self.api = None
         if config.bitflyer_key and config.bitflyer_secret:
             self.api = bitFlyerAPI(key=config.bitflyer_key,
-                                   secret=config.bitflyer_secret)
+                                   secret=config.bitflyer_secret,
+                                   **config.bitflyer_options())
         self._last_trade_at = 0.0
+        # 実口座の同期(account.AccountSync)。設定されていれば残高は
+        # 同期済みのローカル値を読み、古ければAPIに問い合わせる
+        self.account = None
 
     # --- 残高・ポジション ---
 
@@ -27,6 +31,13 @@ class Trader:
         balances = {"JPY": 0.0, self.config.base_currency: 0.0}
         if self.api is None:
             return balances
+        if self.account is not None:
+            local = self.account.balances(max_age=self.config.account_max_age_sec)
+            if local is None:
+                local = self.account.refresh_balances()  # getbalance 1回だけ
+            for code in balances:
+                balances[code] = local.get(code, 0.0)
+            return balances
         for b in self.api.getbalance():
             code = b.get("currency_code")
             if code in balances:
@@ -58,6 +69,12 @@ class Trader:
                 return f"{base}残高不足({balances[base]:.6f} < {self.config.order_size_btc:.6f})"
         return ""
 
+    def _traded(self):
+        """発注成功後の共通処理(クールダウン開始・ローカル残高の無効化)。"""
+        self._last_trade_at = time.time()
+        if self.account is not None:
+            self.account.invalidate()
+
     # --- 執行 ---
 
     def close_position(self, size: float) -> dict:
@@ -88,7 +105,7 @@ class Trader:
             size=size,
         )
         if isinstance(result, dict) and "child_order_acceptance_id" in result:
-            self._last_trade_at = time.time()
+            self._traded()
             logger.info("損切り発注成功: %s SELL %.6f %s (受付ID: %s)",
                         self.config.product_code, size, base,
                         result["child_order_acceptance_id"])
@@ -126,7 +143,7 @@ class Trader:
             size=self.config.order_size_btc,
         )
         if isinstance(result, dict) and "child_order_acceptance_id" in result:
-            self._last_trade_at = time.time()
+            self._traded()
             logger.info("発注成功: %s %s %.6f %s (受付ID: %s)",
                         self.config.product_code, decision,
                         self.config.order_size_btc, self.config.base_currency,
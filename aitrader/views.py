@@ -16,6 +16,7 @@
 
 from .market import (MarketSnapshot, _adx, _atr, _bollinger, _change_pct,
                      _ema, _macd, _px, _rsi, _sma, _vwap)
+from .series import column
 
 
 def _common_header(s: MarketSnapshot, position: dict = None) -> str:
@@ -79,11 +80,13 @@ def _minute_lines(s: MarketSnapshot, minutes: int = 30) -> str:
 
 def _volume_surge(s: MarketSnapshot) -> tuple:
     """(直近1時間の出来高, 過去24時間の1時間平均, 倍率)。データ不足は(0,0,0)。"""
-    hourly = [c for c in (s.candles_1h or []) if c.minutes >= 40]
-    if len(hourly) < 4:
+    hourly = s.candles_1h or []
+    volumes = [v for v, minutes in zip(column(hourly, "volume"), column(hourly, "minutes"))
+               if minutes >= 40]
+    if len(volumes) < 4:
         return 0.0, 0.0, 0.0
-    recent = hourly[-1].volume
-    baseline = [c.volume for c in hourly[-25:-1]]
+    recent = volumes[-1]
+    baseline = volumes[-25:-1]
     avg = sum(baseline) / len(baseline) if baseline else 0.0
     return recent, avg, (recent / avg if avg > 0 else 0.0)
 
@@ -92,7 +95,7 @@ def _high_low(s: MarketSnapshot, hours: int) -> tuple:
     window = (s.candles_1h or [])[-hours:]
     if not window:
         return 0.0, 0.0
-    return max(c.high for c in window), min(c.low for c in window)
+    return max(column(window, "high")), min(column(window, "low"))
 
 
 def _sr_text(s: MarketSnapshot) -> str:
@@ -110,7 +113,7 @@ def _sr_text(s: MarketSnapshot) -> str:
 # --- 各ビュー ---
 
 def _trend_view(s: MarketSnapshot) -> str:
-    closes_1h = [c.close for c in (s.candles_1h or [])]
+    closes_1h = column(s.candles_1h or [], "close")
     adx = _adx(s.candles_1h or [], 14)
     text = "\n## トレンド指標(1時間足ベース)\n"
     if closes_1h:
@@ -128,7 +131,7 @@ def _trend_view(s: MarketSnapshot) -> str:
 
 
 def _momentum_view(s: MarketSnapshot) -> str:
-    closes_1h = [c.close for c in (s.candles_1h or [])]
+    closes_1h = column(s.candles_1h or [], "close")
     text = "\n## モメンタム指標\n"
     text += f"RSI(14, 1分足): {s.rsi_14:.1f} / RSI(14, 1時間足): {s.rsi_14h:.1f}\n"
     if closes_1h:
@@ -143,8 +146,12 @@ def _momentum_view(s: MarketSnapshot) -> str:
         if mid:
             text += (f"ボリンジャーバンド(20, 1時間足): 中心 {_px(mid)} / "
                      f"+2σ {_px(upper)} / -2σ {_px(lower)} (現在値 {_px(s.ltp)})\n")
+    wilder = (s.indicators or {}).get("1h") or {}
+    if wilder.get("rsi_14") is not None and wilder.get("adx_14") is not None:
+        text += (f"Wilder平滑(確定1時間足{wilder['bars']}本): RSI(14) {wilder['rsi_14']:.1f} / "
+                 f"ADX(14) {wilder['adx_14']:.1f} / ATR(14) {_px(wilder['atr_14'])}\n")
     text += f"15分騰落率: {s.change_pct_15m:+.2f}%\n"
-    closes_recent = [c.close for c in s.candles_1m][-24:]
+    closes_recent = column(s.candles_1m, "close")[-24:]
     if closes_recent:
         text += ("\n## 直近の終値推移(1分足、古い順)\n"
                  + " ".join(_px(c) for c in closes_recent) + "\n")
@@ -158,6 +165,10 @@ def _flow_view(s: MarketSnapshot) -> str:
     if total_depth > 0:
         text += (f"板の厚み(中値±0.5%): 買い {s.bid_depth:.3f} / 売り {s.ask_depth:.3f} "
                  f"(買い板比率 {s.bid_depth / total_depth * 100:.0f}%)\n")
+        if s.weighted_mid and s.ltp:
+            text += (f"板加重中値: {_px(s.weighted_mid)} "
+                     f"(現在値比 {(s.weighted_mid - s.ltp) / s.ltp * 100:+.3f}%。"
+                     f"板の薄い側に寄る)\n")
     else:
         text += "板の厚み: 取得できませんでした\n"
     if total_flow > 0:
@@ -201,7 +212,7 @@ def _risk_view(s: MarketSnapshot) -> str:
 
 
 def _macro_view(s: MarketSnapshot) -> str:
-    closes_1h = [c.close for c in (s.candles_1h or [])]
+    closes_1h = column(s.candles_1h or [], "close")
     text = "\n## 地合い(中期)\n"
     if closes_1h:
         text += (
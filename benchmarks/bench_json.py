@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""APIレスポンスのJSONデコード時間をエンドポイント別に比較する。
+
+実行: python benchmarks/bench_json.py [--repeat 200]
+
+/v1/board(全板)・/v1/executions(500件)・/v1/ticker と同じ形の
+合成ペイロードを、従来の経路(bytes → str → json.loads)と
+codec.available_decoders() の各デコーダ(bytesから直接)で読み比べる。
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bitflyerapi.codec import available_decoders
+
+
+def board_payload(levels=2500, mid=15000000.0):
+    rnd = random.Random(1)
+    side = lambda sign: [{"price": mid + sign * (i + 1) * 5.0,
+                          "size": round(rnd.uniform(0.001, 2.0), 8)}
+                         for i in range(levels)]
+    return {"mid_price": mid, "bids": side(-1), "asks": side(1)}
+
+
+def executions_payload(count=500):
+    rnd = random.Random(2)
+    return [{"id": 2500000000 - i,
+             "side": rnd.choice(("BUY", "SELL")),
+             "price": 15000000.0 + rnd.randint(-5000, 5000),
+             "size": round(rnd.uniform(0.001, 0.5), 8),
+             "exec_date": "2026-07-07T10:%02d:%02d.%03d" % (i // 60 % 60, i % 60, i),
+             "buy_child_order_acceptance_id": "JRF20260707-100000-%06d" % i,
+             "sell_child_order_acceptance_id": "JRF20260707-100000-%06d" % (i + 1)}
+            for i in range(count)]
+
+
+def ticker_payload():
+    return {"product_code": "BTC_JPY", "state": "RUNNING",
+            "timestamp": "2026-07-07T10:00:00.123", "tick_id": 123456789,
+            "best_bid": 14999000.0, "best_ask": 15001000.0,
+            "best_bid_size": 0.1, "best_ask_size": 0.2,
+            "total_bid_depth": 1234.5, "total_ask_depth": 1100.2,
+            "market_bid_size": 0.0, "market_ask_size": 0.0,
+            "ltp": 15000000.0, "volume": 23456.7, "volume_by_product": 3456.7}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    payloads = {
+        "board": json.dumps(board_payload()).encode(),
+        "executions": json.dumps(executions_payload()).encode(),
+        "ticker": json.dumps(ticker_payload()).encode(),
+    }
+    decoders = {"str+json (従来)": lambda b: json.loads(b.decode("utf-8"))}
+    decoders.update(available_decoders())
+
+    print("%-12s %8s  %s" % ("endpoint", "bytes", "  ".join(
+        "%16s" % name for name in decoders)))
+    for endpoint, body in payloads.items():
+        cells = []
+        for loads in decoders.values():
+            sec = min(timeit.repeat(lambda: loads(body), number=args.repeat,
+                                    repeat=3)) / args.repeat
+            cells.append("%13.1f us" % (sec * 1e6))
+        print("%-12s %8d  %s" % (endpoint, len(body), "  ".join(
+            "%16s" % c for c in cells)))
+
+
+if __name__ == "__main__":
+    main()
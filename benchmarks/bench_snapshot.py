@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""fetch_market_snapshot をカセット再生でオフライン計測する。
+
+1) 実APIから1サイクル分を記録(ネットワーク必要):
+       python benchmarks/bench_snapshot.py --record snapshot.jsonl.gz
+2) ネットワークなしで繰り返し再生して計測:
+       python benchmarks/bench_snapshot.py snapshot.jsonl.gz [--repeat 20] [--profile]
+
+毎回空の履歴DB(:memory:)から始めるので、各回が記録時と同じリクエスト列になる。
+run_collect / run_once も AITRADER_CASSETTE=... AITRADER_CASSETTE_MODE=replay で
+同じカセットからオフライン実行できる。
+"""
+
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bitflyerapi import bitFlyerAPI
+from bitflyerapi.metrics import MetricsCollector
+from bitflyerapi.transport import RecordingTransport, ReplayTransport
+
+from aitrader.history import HistoryStore
+from aitrader.market import fetch_market_snapshot
+
+
+def _snapshot(transport, product_code, include_macro, observers=()):
+    store = HistoryStore(":memory:")
+    try:
+        with bitFlyerAPI(key="", secret="", transport=transport,
+                         observers=list(observers)) as api:
+            return fetch_market_snapshot(product_code, store=store, api=api,
+                                         include_macro=include_macro)
+    finally:
+        store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("cassette", nargs="?")
+    parser.add_argument("--record", metavar="PATH")
+    parser.add_argument("--product", default="BTC_JPY")
+    parser.add_argument("--no-macro", action="store_true")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--profile", action="store_true")
+    args = parser.parse_args()
+    include_macro = not args.no_macro
+
+    if args.record:
+        snap = _snapshot(RecordingTransport(args.record), args.product, include_macro)
+        print("recorded %s: ltp=%.0f, %d executions, %d pages -> %s (%d bytes)"
+              % (args.product, snap.ltp, snap.exec_count, snap.exec_pages,
+                 args.record, os.path.getsize(args.record)))
+        return
+    if not args.cassette:
+        parser.error("cassette path (or --record PATH) is required")
+
+    replay = ReplayTransport(args.cassette)
+    metrics = MetricsCollector()
+    _snapshot(replay, args.product, include_macro)  # ウォームアップ
+    timings = []
+    profiler = cProfile.Profile() if args.profile else None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        snap = _snapshot(replay, args.product, include_macro, observers=[metrics])
+        if profiler:
+            profiler.disable()
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    print("%d responses in cassette, %d runs" % (len(replay), len(timings)))
+    print("fetch_market_snapshot: min %.1f ms / median %.1f ms / max %.1f ms"
+          % (timings[0] * 1e3, timings[len(timings) // 2] * 1e3, timings[-1] * 1e3))
+    print("per endpoint (replay + decode): %s" % metrics.summary(limit=10))
+    print("legs of the last run (concurrent): %s" % ", ".join(
+        "%s %.1f ms" % (name, ms) for name, ms in sorted(snap.leg_ms.items())))
+    if profiler:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+
+if __name__ == "__main__":
+    main()
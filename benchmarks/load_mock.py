@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""ローカルのbitFlyerモックに対して aitrader のデータ取得パイプラインを負荷試験する。
+
+実行: python benchmarks/load_mock.py [--products 4] [--cycles 20] [--latency 0.01]
+
+銘柄ごとに1スレッドで fetch_market_snapshot(履歴DBへの差分取り込み込み)を
+cycles 回繰り返し、サイクル間にモック市場を進める。全体のスループットと
+エンドポイント別の遅延(MetricsCollector)を表示する。取引所には一切触れない。
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bitflyerapi import bitFlyerAPI
+from bitflyerapi.metrics import MetricsCollector
+from bitflyerapi.mockserver import MockBitFlyer
+
+from aitrader.history import HistoryStore
+from aitrader.market import fetch_market_snapshot
+
+_PRODUCTS = ["BTC_JPY", "ETH_JPY", "XRP_JPY", "FX_BTC_JPY",
+             "BCH_JPY", "MONA_JPY", "XLM_JPY", "ETH_BTC"]
+
+
+def _worker(mock, product, cycles, metrics):
+    store = HistoryStore(":memory:")
+    try:
+        with bitFlyerAPI(key="", secret="", top=mock.url,
+                         observers=[metrics]) as api:
+            for _ in range(cycles):
+                fetch_market_snapshot(product, store=store, api=api,
+                                      include_macro=False)
+                mock.advance()
+    finally:
+        store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=4)
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    products = _PRODUCTS[:args.products]
+    metrics = MetricsCollector()
+    with MockBitFlyer(products=products, latency=args.latency,
+                      error_rate=args.error_rate, tick_interval=None,
+                      executions_per_tick=50) as mock:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(products)) as pool:
+            for f in [pool.submit(_worker, mock, p, args.cycles, metrics)
+                      for p in products]:
+                f.result()
+        elapsed = time.perf_counter() - start
+        requests = sum(mock.requests.values())
+
+    cycles = len(products) * args.cycles
+    print("%d products x %d cycles in %.2f s: %.1f snapshots/s, %.0f requests/s"
+          % (len(products), args.cycles, elapsed, cycles / elapsed,
+             requests / elapsed))
+    print("per endpoint: %s" % metrics.summary(limit=10))
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,3 @@
-from .bitflyerapi import bitFlyerAPI
\ No newline at end of file
+from .bitflyerapi import bitFlyerAPI
+from .asyncapi import AsyncBitFlyerAPI
+from .realtime import RealtimeClient
\ No newline at end of file
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+import logging
+import time
+
+from .bitflyerapi import bitFlyerAPI, _parse_response, _walk_page
+from .exception import DeadlineExceeded, RateLimitException, ServerException
+from .metrics import RequestEvent
+from .ratelimit import SQLiteTokenBucket
+from .transport import ReplayTransport
+
+logger = logging.getLogger(__name__)
+
+class AsyncBitFlyerAPI(bitFlyerAPI):
+	"""
+	asyncio twin of bitFlyerAPI. Every endpoint method (markets, board,
+	ticker, executions, getboardstate, getbalance, sendchildorder, ...)
+	is an ``async def`` taking the same arguments, and request signing is
+	shared with the synchronous client.
+
+	Requests go through one pooled httpx.AsyncClient (created on first use,
+	sized by pool_maxsize), so independent calls can be gathered:
+
+		async with AsyncBitFlyerAPI(key="", secret="") as api:
+			ticker, board = await asyncio.gather(
+				api.ticker(product_code="BTC_JPY"),
+				api.board(product_code="BTC_JPY"))
+	"""
+	def __init__(self, *args, **config):
+		super(AsyncBitFlyerAPI, self).__init__(*args, **config)
+		self._client = None
+		self._refreshes = set()  # background cache refreshes in flight
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc):
+		await self.aclose()
+
+	@staticmethod
+	def _httpx_timeout(timeout):
+		import httpx
+		if isinstance(timeout, tuple):
+			return httpx.Timeout(timeout[1], connect=timeout[0])
+		return httpx.Timeout(timeout)
+
+	def client(self):
+		"""Pooled httpx.AsyncClient bound to this instance."""
+		if self._client is None:
+			import httpx
+			timeout = self._httpx_timeout(self.timeout)
+			limits = httpx.Limits(max_connections=self.pool_maxsize,
+								max_keepalive_connections=self.pool_maxsize)
+			self._client = httpx.AsyncClient(timeout=timeout, limits=limits)
+		return self._client
+
+	async def aclose(self):
+		"""Close pooled connections (async counterpart of close())."""
+		self.close()
+		if self._client is not None:
+			client, self._client = self._client, None
+			await client.aclose()
+
+	async def request(self,path,method='GET',params=None,deadline=None):
+		cached = self._cache_key(path, method, params)
+		if cached is None:
+			return await self._request(path, method, params, deadline)
+		key, ttl = cached
+		hit = await self._cache_io(self.cache.get, key)
+		if hit is not None:
+			value, fresh = hit
+			if not fresh and self.cache.begin_refresh(key):
+				task = asyncio.ensure_future(self._revalidate(path, params, key, ttl))
+				self._refreshes.add(task)
+				task.add_done_callback(self._refreshes.discard)
+			return value
+		value = await self._request(path, method, params, deadline)
+		await self._cache_io(self.cache.put, key, value, ttl)
+		return value
+
+	async def _cache_io(self, func, *args):
+		"""Call a cache method, off the event loop when it may touch SQLite."""
+		if not self.cache.path:
+			return func(*args)
+		return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+	async def _revalidate(self, path, params, key, ttl):
+		try:
+			value = await self._request(path, 'GET', params, None)
+			await self._cache_io(self.cache.put, key, value, ttl)
+		except Exception:
+			logger.warning("refreshing %s failed; the stale response stays cached",
+							path, exc_info=True)
+		finally:
+			self.cache.end_refresh(key)
+
+	async def _request(self, path, method, params, deadline):
+		import httpx
+		deadline = self.deadline if deadline is None else deadline
+		expires = None if deadline is None else time.monotonic() + deadline
+		retries = self.max_retries if method == 'GET' else 0
+		attempt = 0
+		while True:
+			limiter = self.limiter(path)
+			if limiter is not None:
+				if isinstance(limiter, SQLiteTokenBucket):
+					# the shared bucket is a blocking SQLite transaction
+					wait = await asyncio.get_running_loop().run_in_executor(
+						None, limiter.reserve)
+				else:
+					wait = limiter.reserve()
+				if wait > 0:
+					await asyncio.sleep(wait)
+			timeout = self._attempt_timeout(expires)
+			url, body, headers = self._prepare(path, method, params)
+			event = None
+			if self.observers:
+				event = self._observe('before_request',
+									RequestEvent(method, path, attempt + 1))
+			started = time.monotonic()
+			try:
+				if isinstance(self.transport, ReplayTransport):
+					# a replay answers from memory and never blocks
+					response = self.transport.send(method, url, body=body,
+													headers=headers, timeout=timeout)
+				elif self.transport is not None:
+					# other transports (e.g. RecordingTransport) do blocking
+					# I/O; keep it off the event loop
+					send = functools.partial(self.transport.send, method, url,
+											body=body, headers=headers, timeout=timeout)
+					response = await asyncio.get_running_loop().run_in_executor(None, send)
+				elif method == 'GET':
+					response = await self.client().get(
+						url,headers=headers,timeout=self._httpx_timeout(timeout))
+				else:
+					response = await self.client().post(
+						url,content = body,headers=headers,
+						timeout=self._httpx_timeout(timeout))
+				if event is not None:
+					event.elapsed = time.monotonic() - started
+					event.status = response.status_code
+					event.bytes = len(response.content)
+				return _parse_response(response.status_code, response.content,
+										response.headers, self.json_loads)
+			except (httpx.TransportError, RateLimitException,
+					ServerException) as e:
+				error = e
+				if event is not None:
+					event.error = e
+			finally:
+				if event is not None:
+					if event.elapsed is None:
+						event.elapsed = time.monotonic() - started
+					self._observe('after_request', event)
+			attempt += 1
+			wait = self._retry_wait(attempt, error)
+			if attempt > retries:
+				raise error
+			if expires is not None and time.monotonic() + wait >= expires:
+				raise DeadlineExceeded("deadline exceeded after %d attempts: %s"
+										% (attempt, error)) from error
+			await asyncio.sleep(wait)
+
+	async def paginate(self, fetch, page_size=500, after_id=None, before_id=None,
+						stop=None, **params):
+		"""Async generator counterpart of bitFlyerAPI.paginate()."""
+		cursor = before_id
+		while True:
+			page_params = dict(params, count=page_size)
+			if cursor is not None:
+				page_params['before'] = cursor
+			if after_id is not None:
+				page_params['after'] = after_id
+			page = await fetch(**page_params)
+			items, cursor, done = _walk_page(page, cursor, after_id, stop, page_size)
+			for item in items:
+				yield item
+			if done:
+				return
+
+
+def _coroutine_method(func):
+	@functools.wraps(func)
+	async def inner(self, *args, **params):
+		return await func(self, *args, **params)
+	return inner
+
+_NOT_ENDPOINTS = {'request', 'session', 'close', 'limiter', 'auth_execution',
+				'paginate', 'iter_executions', 'add_observer'}
+
+for _name, _func in list(vars(bitFlyerAPI).items()):
+	if _name.startswith('_') or _name in _NOT_ENDPOINTS or not callable(_func):
+		continue
+	setattr(AsyncBitFlyerAPI, _name, _coroutine_method(_func))
@@ -1,17 +1,80 @@
 # -*- coding: utf-8 -*-
 
+import calendar
 import hmac
 import hashlib
 import json
+import logging
+import random
+import threading
 import time
 import urllib
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from .exception import AuthException
+from . import records
+from .cache import shared_cache
+from .codec import get_loads
+from .exception import (APIException, AuthException, DeadlineExceeded,
+						RateLimitException, ServerException)
+from .metrics import RequestEvent
+from .ratelimit import default_limiters
+
+logger = logging.getLogger(__name__)
 
 class bitFlyerAPI(object):
 	def __init__(self, *args, **config):
+		"""
+		key, secret: API key and secret (empty strings for public use only).
+		top: Base URL. Defaults to https://api.bitflyer.com; point it at a
+				mockserver.MockBitFlyer for offline load tests.
+		connect_timeout, read_timeout: Socket timeouts in seconds.
+
+		Connection pool (shared by every request of this instance):
+		pool_connections: Number of per-host pools to keep. Defaults to 1.
+		pool_maxsize: Maximum number of keep-alive connections per host.
+				Defaults to 10.
+		pool_block: When True, wait for a free connection instead of opening
+				an extra throwaway one once pool_maxsize is reached.
+
+		Client-side rate limiting (requests are paced, never rejected):
+		rate_limit: When True, use bitFlyer's documented budgets with
+				separate public and private buckets (see ratelimit.py).
+		rate_limit_path: SQLite file holding the bucket state, so that
+				several processes share the same budget.
+		public_limiter, private_limiter: Custom buckets (anything with
+				acquire() and reserve()); override rate_limit.
+
+		Retries (GET only; orders are never sent twice):
+		max_retries: Extra attempts after a 429, a 5xx or a connection
+				error/timeout. Defaults to 3.
+		backoff, backoff_max: Base and cap in seconds of the jittered
+				exponential wait between attempts. Default 0.5 and 8.0.
+		deadline: Seconds a whole call may take, retries and waits
+				included. Defaults to None (unbounded).
+
+		json_loads: Response decoder, parsing the body straight from bytes.
+				'orjson', 'ujson', 'json' or a callable; defaults to the
+				fastest one installed (see codec.py).
+
+		observers: Objects notified around every HTTP attempt (retries
+				included) through optional before_request(event) and
+				after_request(event) methods; see metrics.RequestEvent.
+				metrics.MetricsCollector is a ready-made one.
+
+		transport: Sends the HTTP requests instead of the pooled session,
+				e.g. transport.RecordingTransport / ReplayTransport to
+				capture a cassette and run offline from it.
+
+		Response cache (opt-in, GET only) for slow-changing endpoints such
+		as getmarkets, getboardstate and gettradingcommission:
+		cache: True for the process-wide cache with the default TTLs, or a
+				cache.TTLCache with custom TTLs. Expired entries are served
+				while one background request refreshes them.
+		cache_path: SQLite file for the process-wide cache, so several
+				processes share it (implies cache=True).
+		"""
 		self.key = config["key"]
 		self.secret	= config["secret"]
 		try:
@@ -19,57 +82,230 @@ class bitFlyerAPI(object):
 							float(config["read_timeout"]))
 		except:
 			self.timeout = 3.5
-		self.top = 'https://api.bitflyer.com'
+		self.pool_connections = int(config.get("pool_connections", 1))
+		self.pool_maxsize = int(config.get("pool_maxsize", 10))
+		self.pool_block = bool(config.get("pool_block", False))
+		self.top = config.get("top", 'https://api.bitflyer.com')
 		self.public = '/v1/'
 		self.private = '/v1/me/'
-		self.header = None
-
-	def _make_header(self, path, method, params):
-		"""
-		ACCESS-KEY: API key issued by the developer's page
-		ACCESS-TIMESTAMP: The request's Unix Timestamp.
-		ACCESS-SIGN: Signature generated for each request with the following method.
-		The ACCESS-SIGN is the resulting HMAC-SHA256 hash of the ACCESS-TIMESTAMP, 
-		HTTP method, request path, and request body concatenated together as a character
-		string, created using your API secret.
-		"""
-		timestamp = str(time.time())
-		body = ""
+		self._hmac = None
+		self._session = None
+		self._session_lock = threading.Lock()
+		limiters = {}
+		if config.get("rate_limit"):
+			limiters = default_limiters(config.get("rate_limit_path"))
+		self.public_limiter = config.get("public_limiter", limiters.get("public"))
+		self.private_limiter = config.get("private_limiter", limiters.get("private"))
+		self.max_retries = int(config.get("max_retries", 3))
+		self.backoff = float(config.get("backoff", 0.5))
+		self.backoff_max = float(config.get("backoff_max", 8.0))
+		self.deadline = config.get("deadline")
+		self.json_loads = get_loads(config.get("json_loads"))
+		self.observers = list(config.get("observers", ()))
+		self.transport = config.get("transport")
+		cache = config.get("cache")
+		if cache is True or (cache is None and config.get("cache_path")):
+			cache = shared_cache(config.get("cache_path"))
+		self.cache = cache or None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def session(self):
+		"""
+		Long-lived requests.Session with a keep-alive connection pool. 
+		Created on first use and reused until close(), so consecutive calls 
+		skip the TCP+TLS handshake. urllib3 pools are thread-safe; per-request 
+		headers are passed explicitly and never stored on the session.
+		"""
+		with self._session_lock:
+			if self._session is None:
+				s = requests.Session()
+				adapter = HTTPAdapter(pool_connections=self.pool_connections,
+									pool_maxsize=self.pool_maxsize,
+									pool_block=self.pool_block)
+				s.mount('https://', adapter)
+				s.mount('http://', adapter)
+				self._session = s
+			return self._session
+
+	def limiter(self, path):
+		"""Rate limiter bucket for path, or None when rate limiting is off."""
+		if path.startswith(self.private):
+			return self.private_limiter
+		return self.public_limiter
+
+	def close(self):
+		"""Close pooled connections. The next request opens a new pool."""
+		with self._session_lock:
+			if self._session is not None:
+				self._session.close()
+				self._session = None
+
+	def _mac(self):
+		"""
+		HMAC-SHA256 object keyed with the API secret, built once and only
+		ever copied, so concurrent requests never share signing state.
+		Rebuilt if the secret is reassigned.
+		"""
+		cached = self._hmac
+		if cached is None or cached[0] != self.secret:
+			cached = self._hmac = (self.secret, hmac.new(
+				str.encode(self.secret), digestmod=hashlib.sha256))
+		return cached[1]
+
+	def _prepare(self, path, method, params):
+		"""
+		(url, body, headers) for one attempt. The query string and body are
+		encoded once here and sent exactly as signed; headers is None for
+		public use (no key and secret).
+		"""
+		query = ""
+		body = None
 		if method == "POST":
 			body = json.dumps(params)
-		else:
-			if params:
-				body = "?" + urllib.parse.urlencode(params)
-		text = timestamp + method + path + body
-		signature = hmac.new(str.encode(self.secret),
-							str.encode(text),
-							hashlib.sha256).hexdigest()
-
-		self.header = {
-			"ACCESS-KEY": self.key,
-			"ACCESS-TIMESTAMP": timestamp,
-			"ACCESS-SIGN": signature,
-			"Content-Type": "application/json"
-		}
-
-	def request(self,path,method='GET',params=None):
-		url = self.top + path
+		elif params:
+			query = "?" + urllib.parse.urlencode(params)
+		headers = None
+		if self.key and self.secret:
+			headers = sign_request(self._mac(), self.key, method, path + query,
+									body or "")
+		return self.top + path + query, body, headers
+
+	def _send(self, method, url, body, headers, timeout):
+		if self.transport is not None:
+			return self.transport.send(method, url, body=body, headers=headers,
+										timeout=timeout)
+		s = self.session()
+		if method == 'GET':
+			return s.get(url,headers=headers,timeout=timeout)
+		return s.post(url,data = body,headers=headers,timeout=timeout)
+
+	def add_observer(self, observer):
+		"""Register a request observer (see the observers config option)."""
+		self.observers.append(observer)
+
+	def _observe(self, hook, event):
+		for observer in self.observers:
+			fn = getattr(observer, hook, None)
+			if fn is None:
+				continue
+			try:
+				fn(event)
+			except Exception:
+				logger.exception("request observer %r failed", observer)
+		return event
+
+	def _attempt_timeout(self, expires):
+		"""Socket timeout for one attempt, clipped to the time left."""
+		if expires is None:
+			return self.timeout
+		left = expires - time.monotonic()
+		if left <= 0:
+			raise DeadlineExceeded("deadline exceeded")
+		if isinstance(self.timeout, tuple):
+			return tuple(min(t, left) for t in self.timeout)
+		return min(self.timeout, left)
+
+	def _retry_wait(self, attempt, error):
+		"""Full-jitter exponential backoff, stretched to honour Retry-After."""
+		wait = random.uniform(0, min(self.backoff_max,
+									self.backoff * 2 ** (attempt - 1)))
+		if getattr(error, 'retry_after', None):
+			wait = max(wait, error.retry_after)
+		return wait
+
+	def _cache_key(self, path, method, params):
+		"""(key, ttl) when this call goes through the response cache, else None."""
+		if self.cache is None or method != 'GET':
+			return None
+		ttl = self.cache.ttl(path)
+		if not ttl:
+			return None
+		who = ''
+		if path.startswith(self.private):
+			# entries may be written to a shared file; never store the key itself
+			who = hashlib.sha256((self.key or '').encode('utf-8')).hexdigest()[:16]
+		return self.cache.key(path, params, who), ttl
+
+	def request(self,path,method='GET',params=None,deadline=None):
+		"""
+		deadline: Overrides the deadline config option for this call.
+
+		Raises RateLimitException (429), AuthException (401/403),
+		ServerException (5xx) and APIException (body is not JSON); other
+		4xx replies are returned as parsed, since bitFlyer reports order
+		errors as JSON there.
+		"""
+		cached = self._cache_key(path, method, params)
+		if cached is None:
+			return self._request(path, method, params, deadline)
+		key, ttl = cached
+		hit = self.cache.get(key)
+		if hit is not None:
+			value, fresh = hit
+			if not fresh and self.cache.begin_refresh(key):
+				threading.Thread(target=self._revalidate,
+								args=(path, params, key, ttl), daemon=True).start()
+			return value
+		value = self._request(path, method, params, deadline)
+		self.cache.put(key, value, ttl)
+		return value
+
+	def _revalidate(self, path, params, key, ttl):
 		try:
-			with requests.Session() as s:
-				if self.key and self.secret:
-					self._make_header(path,method,params)
-					s.headers.update(self.header)
-				if method == 'GET':
-					response = s.get(url,params=params,timeout=self.timeout)
-				else:
-					response = s.post(url,data = json.dumps(params),
-										timeout=self.timeout)
-		except Exception as e:
-			print(e)
-			raise e
-
-		content = json.loads(response.content.decode("utf-8"))
-		return(content)
+			self.cache.put(key, self._request(path, 'GET', params, None), ttl)
+		except Exception:
+			logger.warning("refreshing %s failed; the stale response stays cached",
+							path, exc_info=True)
+		finally:
+			self.cache.end_refresh(key)
+
+	def _request(self, path, method, params, deadline):
+		deadline = self.deadline if deadline is None else deadline
+		expires = None if deadline is None else time.monotonic() + deadline
+		retries = self.max_retries if method == 'GET' else 0
+		attempt = 0
+		while True:
+			limiter = self.limiter(path)
+			if limiter is not None:
+				limiter.acquire()
+			timeout = self._attempt_timeout(expires)
+			url, body, headers = self._prepare(path, method, params)
+			event = None
+			if self.observers:
+				event = self._observe('before_request',
+									RequestEvent(method, path, attempt + 1))
+			started = time.monotonic()
+			try:
+				response = self._send(method, url, body, headers, timeout)
+				if event is not None:
+					event.elapsed = time.monotonic() - started
+					event.status = response.status_code
+					event.bytes = len(response.content)
+				return _parse_response(response.status_code, response.content,
+										response.headers, self.json_loads)
+			except (requests.ConnectionError, requests.Timeout,
+					RateLimitException, ServerException) as e:
+				error = e
+				if event is not None:
+					event.error = e
+			finally:
+				if event is not None:
+					if event.elapsed is None:
+						event.elapsed = time.monotonic() - started
+					self._observe('after_request', event)
+			attempt += 1
+			wait = self._retry_wait(attempt, error)
+			if attempt > retries:
+				raise error
+			if expires is not None and time.monotonic() + wait >= expires:
+				raise DeadlineExceeded("deadline exceeded after %d attempts: %s"
+										% (attempt, error)) from error
+			time.sleep(wait)
 
 	"""HTTP PUBLIC API"""
 
@@ -652,9 +888,136 @@ class bitFlyerAPI(object):
 		return self.request(path, params = params)
 
 
-
-
-
-
-
-
+	"""PAGINATION"""
+	def paginate(self, fetch, page_size=500, after_id=None, before_id=None,
+				stop=None, **params):
+		"""
+		Lazily walk an endpoint that supports count/before/after (executions, 
+		getchildorders, getbalancehistory, ...) from newest to oldest.
+
+		fetch: Bound endpoint method, e.g. api.executions.
+		page_size: count per request (bitFlyer caps it at 500).
+		after_id: Stop before yielding an item whose id is <= after_id.
+		before_id: Start below this id (resume point of a previous walk).
+		stop: Optional predicate; the walk ends at the first item for which 
+				stop(item) is true (that item is not yielded).
+		params: Passed through to fetch (product_code, ...).
+
+		Items are yielded once each even when pages overlap. The id of the 
+		last yielded item is the cursor: pass it back as before_id to resume.
+		"""
+		cursor = before_id
+		while True:
+			page_params = dict(params, count=page_size)
+			if cursor is not None:
+				page_params['before'] = cursor
+			if after_id is not None:
+				page_params['after'] = after_id
+			page = fetch(**page_params)
+			items, cursor, done = _walk_page(page, cursor, after_id, stop, page_size)
+			for item in items:
+				yield item
+			if done:
+				return
+
+	def iter_executions(self, product_code, after_id=None, before_id=None,
+						page_size=500, since=None, private=False):
+		"""
+		Lazily iterate executions from newest to oldest across pages.
+
+		after_id, before_id: Id bounds (exclusive), see paginate().
+		since: Time bound. Stops at the first execution older than this 
+				(datetime; naive values are taken as UTC, aware ones are 
+				converted. Or a UTC string in exec_date's format).
+		private: Walk the account's own executions (/v1/me/getexecutions) 
+				instead of the public market executions.
+
+		Note: bitFlyer serves only the most recent 31 days through before.
+		"""
+		stop = None
+		if since is not None:
+			since_ms = _since_ms(since)
+			stop = lambda ex: records.epoch_ms(ex['exec_date']) < since_ms
+		fetch = self.getexecutions if private else self.executions
+		return self.paginate(fetch, page_size=page_size, after_id=after_id,
+							before_id=before_id, stop=stop,
+							product_code=product_code)
+
+
+def _since_ms(since):
+	"""Epoch milliseconds of iter_executions' since bound."""
+	if hasattr(since, 'utctimetuple'):
+		# utctimetuple() converts aware datetimes and keeps naive ones as is
+		return calendar.timegm(since.utctimetuple()) * 1000 + since.microsecond // 1000
+	return records.epoch_ms(since)
+
+def _walk_page(page, cursor, after_id, stop, page_size):
+	"""
+	Filter one page of a newest-first listing.
+	Returns (items to yield, new cursor, whether the walk is finished).
+	"""
+	if not isinstance(page, list) or not page:
+		return [], cursor, True
+	items = []
+	for item in page:
+		if cursor is not None and item['id'] >= cursor:
+			continue
+		if after_id is not None and item['id'] <= after_id:
+			return items, cursor, True
+		if stop is not None and stop(item):
+			return items, cursor, True
+		items.append(item)
+		cursor = item['id']
+	return items, cursor, not items or len(page) < page_size
+
+
+def sign_request(mac, key, method, path, body="", timestamp=None):
+	"""
+	Authentication headers for one private request.
+
+	ACCESS-KEY: API key issued by the developer's page
+	ACCESS-TIMESTAMP: The request's Unix Timestamp.
+	ACCESS-SIGN: HMAC-SHA256 of ACCESS-TIMESTAMP, HTTP method, request path
+	(with its query string) and request body concatenated together,
+	created using your API secret.
+
+	mac is an hmac object keyed with the secret; it is copied, never
+	updated, so one object can be shared by every thread.
+	"""
+	timestamp = timestamp or str(time.time())
+	h = mac.copy()
+	h.update(str.encode(timestamp + method + path + body))
+	return {
+		"ACCESS-KEY": key,
+		"ACCESS-TIMESTAMP": timestamp,
+		"ACCESS-SIGN": h.hexdigest(),
+		"Content-Type": "application/json"
+	}
+
+def _retry_after(headers):
+	try:
+		return float(headers.get('Retry-After'))
+	except (TypeError, ValueError):
+		return None
+
+def _parse_response(status, content, headers, loads=json.loads):
+	"""Decode a response body, raising the typed exception for its status."""
+	if status == 429:
+		raise RateLimitException("rate limited (HTTP 429)", status,
+								_text(content), _retry_after(headers))
+	if status in (401, 403):
+		raise AuthException("authentication failed (HTTP %d): %s"
+							% (status, _text(content)[:200]), status, _text(content))
+	if status >= 500:
+		raise ServerException("server error (HTTP %d): %s"
+							% (status, _text(content)[:200]), status, _text(content))
+	if not content.strip() and status < 300:
+		return None  # e.g. cancelchildorder answers 200 with an empty body
+	try:
+		return loads(content)
+	except ValueError:
+		raise APIException("non-JSON response (HTTP %d): %s"
+							% (status, _text(content)[:200]), status, _text(content))
+
+def _text(content):
+	return content.decode("utf-8", "replace")
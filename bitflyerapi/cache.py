@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import json
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+# Seconds a response stays fresh, per endpoint (the path segment after
+# /v1/ or /v1/me/, so /v1/markets/usa counts as 'markets'). Endpoints not
+# listed here are never cached.
+DEFAULT_TTLS = {
+	'markets': 3600.0,
+	'getmarkets': 3600.0,
+	'getboardstate': 5.0,
+	'gethealth': 5.0,
+	'getcorporateleverage': 3600.0,
+	'gettradingcommission': 3600.0,
+}
+
+def endpoint_name(path):
+	"""'getmarkets' for '/v1/getmarkets/usa', 'getbalance' for '/v1/me/getbalance'."""
+	parts = path.strip('/').split('/')
+	if parts[:2] == ['v1', 'me']:
+		parts = parts[2:]
+	elif parts[:1] == ['v1']:
+		parts = parts[1:]
+	return parts[0] if parts else ''
+
+
+class TTLCache(object):
+	"""
+	Thread-safe TTL cache of parsed GET responses, keyed by path, query
+	parameters and (for private endpoints) a hash of the API key.
+
+	ttls: {endpoint name: seconds}; defaults to DEFAULT_TTLS.
+	stale: Seconds past expiry during which an entry is still served while
+			one background request refreshes it (stale-while-revalidate).
+			None (default) uses each endpoint's TTL; 0 disables it.
+	path: SQLite file backing the cache, so that processes share entries
+			and restarts start warm. Memory is checked first.
+
+	Cached values are shared between callers and must be treated as
+	read-only. Error replies (JSON bodies with an error_message) are not
+	stored.
+	"""
+	def __init__(self, ttls=None, stale=None, path=None):
+		self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+		self.stale = stale
+		self.path = path
+		self._lock = threading.Lock()
+		self._entries = {}      # key -> (value, stored_at, ttl)
+		self._refreshing = set()
+		self.hits = 0
+		self.misses = 0
+		if path:
+			conn = self._connect()
+			try:
+				conn.execute("""
+					CREATE TABLE IF NOT EXISTS response_cache (
+						key TEXT PRIMARY KEY,
+						value TEXT NOT NULL,
+						stored_at REAL NOT NULL,
+						ttl REAL NOT NULL
+					)
+				""")
+			finally:
+				conn.close()
+
+	def _connect(self):
+		return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+	def ttl(self, path):
+		"""Fresh lifetime for path in seconds, or None if it is not cached."""
+		return self.ttls.get(endpoint_name(path))
+
+	@staticmethod
+	def key(path, params=None, who=''):
+		query = urllib.parse.urlencode(sorted((params or {}).items()))
+		return '%s %s?%s' % (who, path, query)
+
+	def _stale_for(self, ttl):
+		return ttl if self.stale is None else self.stale
+
+	def get(self, key):
+		"""
+		(value, fresh) for a usable entry, or None. fresh is False when the
+		entry has expired but is still inside its stale window.
+		"""
+		now = time.time()
+		with self._lock:
+			entry = self._entries.get(key)
+		if self.path and (entry is None or now - entry[1] >= entry[2]):
+			# another process may have refreshed it
+			stored = self._load(key)
+			if stored is not None and (entry is None or stored[1] > entry[1]):
+				entry = stored
+				with self._lock:
+					self._entries[key] = entry
+		with self._lock:
+			if entry is not None:
+				value, stored_at, ttl = entry
+				age = now - stored_at
+				if age < ttl + self._stale_for(ttl):
+					self.hits += 1
+					return value, age < ttl
+			self.misses += 1
+		return None
+
+	def put(self, key, value, ttl):
+		if isinstance(value, dict) and 'error_message' in value:
+			return
+		entry = (value, time.time(), ttl)
+		with self._lock:
+			self._entries[key] = entry
+		if self.path:
+			conn = self._connect()
+			try:
+				conn.execute("INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)",
+							(key, json.dumps(value), entry[1], ttl))
+			finally:
+				conn.close()
+
+	def _load(self, key):
+		conn = self._connect()
+		try:
+			row = conn.execute(
+				"SELECT value, stored_at, ttl FROM response_cache WHERE key = ?",
+				(key,)).fetchone()
+		finally:
+			conn.close()
+		if row is None:
+			return None
+		return json.loads(row[0]), row[1], row[2]
+
+	def begin_refresh(self, key):
+		"""True if the caller should refresh key (only one refresh at a time)."""
+		with self._lock:
+			if key in self._refreshing:
+				return False
+			self._refreshing.add(key)
+			return True
+
+	def end_refresh(self, key):
+		with self._lock:
+			self._refreshing.discard(key)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+		if self.path:
+			conn = self._connect()
+			try:
+				conn.execute("DELETE FROM response_cache")
+			finally:
+				conn.close()
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def shared_cache(path=None):
+	"""
+	TTLCache with the default TTLs shared by every client in this process
+	(and, with a SQLite path, with other processes too).
+	"""
+	with _shared_lock:
+		if path not in _shared:
+			_shared[path] = TTLCache(path=path)
+		return _shared[path]
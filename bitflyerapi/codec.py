@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+import importlib
+import json
+
+# Fastest first. Each backend's loads() accepts the raw response bytes, so
+# the body is parsed without first being decoded to a str.
+_BACKENDS = ('orjson', 'ujson')
+
+def available_decoders():
+	"""{name: loads} for every JSON backend importable here, fastest first."""
+	found = {}
+	for name in _BACKENDS:
+		try:
+			found[name] = importlib.import_module(name).loads
+		except ImportError:
+			pass
+	found['json'] = json.loads
+	return found
+
+def get_loads(decoder=None):
+	"""
+	JSON decoder for response bodies.
+
+	decoder: None picks the fastest installed backend (orjson, then ujson,
+			then the standard library); a name from available_decoders();
+			or any callable taking bytes, returned unchanged.
+	"""
+	if callable(decoder):
+		return decoder
+	found = available_decoders()
+	if decoder is None:
+		return next(iter(found.values()))
+	try:
+		return found[decoder]
+	except KeyError:
+		raise ValueError("JSON decoder %r is not installed (available: %s)"
+						% (decoder, ", ".join(found)))
@@ -1,6 +1,29 @@
 # coding: utf-8
 
-class AuthException(Exception):
-    def __init__(self):
-        msg = "Please specify your valid API Key and API Secret."
-        super(AuthException, self).__init__(msg)
\ No newline at end of file
+class APIException(Exception):
+    """
+    Error response from the HTTP API. status is the HTTP status code
+    (None when the request never got a response) and body the raw
+    response text.
+    """
+    def __init__(self, msg, status=None, body=None):
+        super(APIException, self).__init__(msg)
+        self.status = status
+        self.body = body
+
+class AuthException(APIException):
+    def __init__(self, msg=None, status=None, body=None):
+        msg = msg or "Please specify your valid API Key and API Secret."
+        super(AuthException, self).__init__(msg, status, body)
+
+class RateLimitException(APIException):
+    """HTTP 429. retry_after is the server's Retry-After in seconds, if any."""
+    def __init__(self, msg, status=None, body=None, retry_after=None):
+        super(RateLimitException, self).__init__(msg, status, body)
+        self.retry_after = retry_after
+
+class ServerException(APIException):
+    """HTTP 5xx, including the HTML maintenance and gateway error pages."""
+
+class DeadlineExceeded(APIException):
+    """The request's deadline passed before a usable response arrived."""
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+from bisect import bisect_left
+
+class RequestEvent(object):
+	"""
+	One HTTP attempt, passed to request observers.
+
+	before_request(event) sees method, path and attempt (1 for the first
+	try, 2+ for retries). after_request(event) also gets elapsed (seconds),
+	status (None if no response arrived), bytes (response body size) and
+	error (the transport/HTTP exception that triggers a retry, if any).
+	"""
+	__slots__ = ('method', 'path', 'attempt', 'elapsed', 'status', 'bytes',
+				'error')
+
+	def __init__(self, method, path, attempt):
+		self.method = method
+		self.path = path
+		self.attempt = attempt
+		self.elapsed = None
+		self.status = None
+		self.bytes = 0
+		self.error = None
+
+
+# Upper bounds (ms) of the latency histogram buckets; the last is open-ended.
+LATENCY_BUCKETS_MS = (25, 50, 100, 200, 400, 800, 1600, 3200, 6400)
+
+class _EndpointStats(object):
+	__slots__ = ('count', 'errors', 'retries', 'bytes', 'total_ms', 'max_ms',
+				'histogram', 'statuses')
+
+	def __init__(self):
+		self.count = 0
+		self.errors = 0
+		self.retries = 0
+		self.bytes = 0
+		self.total_ms = 0.0
+		self.max_ms = 0.0
+		self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+		self.statuses = {}
+
+	def quantile(self, q):
+		"""Upper bound (ms) of the bucket holding the q-quantile."""
+		rank = q * self.count
+		seen = 0
+		for i, n in enumerate(self.histogram):
+			seen += n
+			if n and seen >= rank:
+				return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+		return 0.0
+
+
+class MetricsCollector(object):
+	"""
+	Request observer aggregating per-endpoint count, latency histogram,
+	response bytes, retries and status codes. Thread-safe, so one collector
+	can watch several clients.
+
+		metrics = MetricsCollector()
+		api = bitFlyerAPI(key="", secret="", observers=[metrics])
+		...
+		metrics.stats()['/v1/ticker']['p95_ms']
+		metrics.dump_sqlite(conn)
+
+	Endpoints are keyed by path, so /v1/markets/usa and /v1/markets are
+	counted separately. Attempts without a response count as errors with
+	status None.
+	"""
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._stats = {}
+		self.since = time.time()
+
+	def after_request(self, event):
+		ms = (event.elapsed or 0.0) * 1000.0
+		with self._lock:
+			st = self._stats.get(event.path)
+			if st is None:
+				st = self._stats[event.path] = _EndpointStats()
+			st.count += 1
+			if event.attempt > 1:
+				st.retries += 1
+			if event.error is not None or event.status is None or event.status >= 400:
+				st.errors += 1
+			st.bytes += event.bytes or 0
+			st.total_ms += ms
+			st.max_ms = max(st.max_ms, ms)
+			st.histogram[bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+			st.statuses[event.status] = st.statuses.get(event.status, 0) + 1
+
+	def stats(self):
+		"""{path: {count, errors, retries, bytes, mean_ms, p50_ms, p95_ms,
+		max_ms, statuses, histogram}} for everything recorded since reset()."""
+		with self._lock:
+			return {path: {
+				'count': st.count,
+				'errors': st.errors,
+				'retries': st.retries,
+				'bytes': st.bytes,
+				'mean_ms': st.total_ms / st.count,
+				'p50_ms': st.quantile(0.5),
+				'p95_ms': st.quantile(0.95),
+				'max_ms': st.max_ms,
+				'statuses': dict(st.statuses),
+				'histogram': list(st.histogram),
+			} for path, st in self._stats.items()}
+
+	def reset(self):
+		with self._lock:
+			self._stats = {}
+			self.since = time.time()
+
+	def summary(self, limit=5):
+		"""One line with the slowest endpoints by mean latency."""
+		rows = sorted(self.stats().items(), key=lambda kv: -kv[1]['mean_ms'])
+		return ", ".join("%s x%d %.0fms (p95 %.0fms%s)" % (
+			path, st['count'], st['mean_ms'], st['p95_ms'],
+			", %d retries" % st['retries'] if st['retries'] else "")
+			for path, st in rows[:limit])
+
+	def dump_sqlite(self, conn, reset=True):
+		"""
+		Append one row per endpoint to the api_metrics table of an open
+		sqlite3 connection (created if missing) and commit. The interval
+		covered is [since, now). Returns the number of rows written.
+		"""
+		now = time.time()
+		since = self.since
+		stats = self.stats()
+		if reset:
+			self.reset()
+		conn.execute("""
+			CREATE TABLE IF NOT EXISTS api_metrics (
+				since REAL NOT NULL,
+				until REAL NOT NULL,
+				path TEXT NOT NULL,
+				count INTEGER NOT NULL,
+				errors INTEGER NOT NULL,
+				retries INTEGER NOT NULL,
+				bytes INTEGER NOT NULL,
+				mean_ms REAL NOT NULL,
+				p50_ms REAL NOT NULL,
+				p95_ms REAL NOT NULL,
+				max_ms REAL NOT NULL,
+				statuses TEXT NOT NULL,
+				histogram TEXT NOT NULL
+			)
+		""")
+		conn.executemany(
+			"INSERT INTO api_metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+			[(since, now, path, st['count'], st['errors'], st['retries'],
+			st['bytes'], st['mean_ms'], st['p50_ms'], st['p95_ms'], st['max_ms'],
+			json.dumps({str(k): v for k, v in st['statuses'].items()}),
+			json.dumps(st['histogram']))
+			for path, st in stats.items()])
+		conn.commit()
+		return len(stats)
@@ -0,0 +1,705 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the bitFlyer Lightning HTTP API and Realtime API, for
+integration and load testing without touching the exchange.
+
+	with MockBitFlyer(products=('BTC_JPY', 'ETH_JPY'), latency=0.005) as mock:
+		api = bitFlyerAPI(key=mock.key, secret=mock.secret, top=mock.url)
+		api.ticker(product_code='BTC_JPY')
+		client = RealtimeClient(url=mock.ws_url)
+
+Markets are synthetic random walks, or replay recorded executions (API
+rows, e.g. from a cassette) before continuing synthetically. They advance
+every tick_interval seconds (None: only when advance() is called), and
+every advance is also published on the JSON-RPC WebSocket channels.
+
+Public endpoints: markets, board, ticker, executions (count/before/after),
+getboardstate, gethealth and their get* aliases. Private endpoints check
+ACCESS-KEY/ACCESS-SIGN exactly like the exchange: getpermissions,
+getbalance, sendchildorder (MARKET fills at the touch, crossing LIMIT
+orders fill, others rest), cancelchildorder, getchildorders,
+sendparentorder (SIMPLE/IFD/OCO/IFDOCO with LIMIT, MARKET and STOP legs,
+triggered as the market moves), cancelparentorder, getparentorders,
+getparentorder, getexecutions, getbalancehistory (one row per fill and
+currency) and getcollateralhistory (always empty: spot only).
+
+Fault injection: latency (seconds, or a (min, max) range), error_rate
+(fraction of requests answered with a 503 HTML page) and rate_limit
+((requests, seconds) per client address for public and per key for
+private endpoints, answered with 429 and Retry-After).
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import urllib.parse
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .realtime import (board_channel, board_snapshot_channel,
+						executions_channel, ticker_channel)
+
+_START_PRICES = {'BTC_JPY': 15000000.0, 'ETH_JPY': 500000.0,
+				'XRP_JPY': 90.0, 'FX_BTC_JPY': 15000000.0}
+
+def _iso(ms):
+	return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ms // 1000)) + ".%03d" % (ms % 1000)
+
+
+class MockMarket(object):
+	"""
+	Price path, trade tape and book of one product.
+
+	executions: Recorded API rows to replay first (any order); step()
+			releases them oldest first, then continues synthetically from
+			the last recorded price.
+	"""
+	def __init__(self, product_code, price=None, volatility=0.0003, depth=100,
+				executions=None, seed=None, next_id=None, history=100000):
+		self.product_code = product_code
+		self.price = float(price or _START_PRICES.get(product_code, 1000.0))
+		self.volatility = volatility
+		self.depth = depth
+		self.tape = deque(maxlen=history)  # oldest first
+		self._rnd = random.Random(seed)
+		self._ids = next_id or iter(range(1, 1 << 62)).__next__
+		self._recorded = deque(sorted(executions or (), key=lambda ex: ex['id']))
+
+	@property
+	def tick(self):
+		return max(0.001, round(self.price * 1e-5, 3 if self.price < 1000 else 0))
+
+	def step(self, count=5):
+		"""Add count executions to the tape and return them (oldest first)."""
+		new = []
+		now = int(time.time() * 1000)
+		for _ in range(count):
+			if self._recorded:
+				ex = dict(self._recorded.popleft())
+				self.price = float(ex['price'])
+			else:
+				self.price = max(self.tick, self.price * (
+					1.0 + self._rnd.gauss(0.0, self.volatility)))
+				side = self._rnd.choice(('BUY', 'SELL'))
+				price = round(self.price / self.tick) * self.tick
+				ex = {'id': self._ids(), 'side': side, 'price': price,
+					'size': round(self._rnd.expovariate(20.0) + 0.001, 8),
+					'exec_date': _iso(now),
+					'buy_child_order_acceptance_id': 'JRF-MOCK-B%d' % self._rnd.getrandbits(32),
+					'sell_child_order_acceptance_id': 'JRF-MOCK-S%d' % self._rnd.getrandbits(32)}
+			self.tape.append(ex)
+			new.append(ex)
+		return new
+
+	def best(self):
+		half = self.tick
+		mid = round(self.price / self.tick) * self.tick
+		return mid - half, mid + half
+
+	def board(self):
+		bid, ask = self.best()
+		rnd = random.Random(int(self.price / self.tick))  # stable for a given price
+		level = lambda p: {'price': p, 'size': round(rnd.uniform(0.01, 1.5), 8)}
+		return {'mid_price': (bid + ask) / 2.0,
+				'bids': [level(bid - i * self.tick) for i in range(self.depth)],
+				'asks': [level(ask + i * self.tick) for i in range(self.depth)]}
+
+	def ticker(self):
+		bid, ask = self.best()
+		last = self.tape[-1] if self.tape else None
+		volume = sum(ex['size'] for ex in self.tape)
+		return {'product_code': self.product_code, 'state': 'RUNNING',
+				'timestamp': _iso(int(time.time() * 1000)),
+				'tick_id': last['id'] if last else 0,
+				'best_bid': bid, 'best_ask': ask,
+				'best_bid_size': 0.5, 'best_ask_size': 0.5,
+				'total_bid_depth': 100.0, 'total_ask_depth': 100.0,
+				'market_bid_size': 0.0, 'market_ask_size': 0.0,
+				'ltp': float(last['price']) if last else self.price,
+				'volume': volume, 'volume_by_product': volume}
+
+	def executions(self, count=100, before=None, after=None):
+		count = min(int(count), 1000)
+		out = []
+		for ex in reversed(self.tape):
+			if before is not None and ex['id'] >= before:
+				continue
+			if after is not None and ex['id'] <= after:
+				break
+			out.append(ex)
+			if len(out) >= count:
+				break
+		return out
+
+
+class _Window(object):
+	"""Fixed-window request counter per client (address or API key)."""
+	def __init__(self, limit, per):
+		self.limit = limit
+		self.per = per
+		self._windows = {}
+
+	def hit(self, who):
+		"""None if allowed, else seconds until the window resets."""
+		now = time.monotonic()
+		start, count = self._windows.get(who, (now, 0))
+		if now - start >= self.per:
+			start, count = now, 0
+		if count >= self.limit:
+			return start + self.per - now
+		self._windows[who] = (start, count + 1)
+		return None
+
+
+class MockBitFlyer(object):
+	def __init__(self, products=('BTC_JPY',), key='mock-key', secret='mock-secret',
+				latency=0.0, error_rate=0.0, rate_limit=None, tick_interval=0.1,
+				executions_per_tick=5, balances=None, recorded=None, seed=0,
+				host='127.0.0.1'):
+		"""
+		recorded: {product_code: [execution rows]} replayed by that market.
+		balances: Initial {currency: amount}; defaults to 1,000,000 JPY and
+				1.0 of every traded base currency.
+		"""
+		self.key = key
+		self.secret = secret
+		self.latency = latency
+		self.error_rate = error_rate
+		self.tick_interval = tick_interval
+		self.executions_per_tick = executions_per_tick
+		self.host = host
+		self._rnd = random.Random(seed)
+		self._lock = threading.RLock()
+		ids = iter(range(2500000000, 1 << 62))
+		self._next_exec_id = lambda: next(ids)
+		recorded = recorded or {}
+		self.markets = {p: MockMarket(p, seed=seed + i, next_id=self._next_exec_id,
+									executions=recorded.get(p))
+						for i, p in enumerate(products)}
+		self.balances = dict(balances) if balances else dict(
+			[('JPY', 1000000.0)] + [(p.split('_')[-2], 1.0) for p in products])
+		self.orders = []        # child orders, oldest first
+		self.parent_orders = [] # parent orders, oldest first
+		self.fills = []         # own executions, oldest first
+		self.balance_history = []  # getbalancehistory rows, oldest first
+		self._order_seq = 0
+		self._limits = None
+		if rate_limit:
+			self._limits = {'public': _Window(*rate_limit),
+							'private': _Window(*rate_limit)}
+		self.requests = {}      # path -> count
+		self._httpd = None
+		self._ws_loop = None
+		self._ws_clients = set()
+		self._stop = threading.Event()
+
+	# --- lifecycle ---
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def start(self):
+		for market in self.markets.values():
+			market.step(200)  # some history before the first request
+		self._httpd = ThreadingHTTPServer((self.host, 0), _Handler)
+		self._httpd.daemon_threads = True
+		self._httpd.mock = self
+		threading.Thread(target=self._httpd.serve_forever, args=(0.05,),
+						daemon=True).start()
+		ready = threading.Event()
+		threading.Thread(target=self._run_ws, args=(ready,), daemon=True).start()
+		ready.wait(5)
+		if self.tick_interval:
+			threading.Thread(target=self._run_ticker, daemon=True).start()
+		return self
+
+	def stop(self):
+		self._stop.set()
+		if self._httpd is not None:
+			self._httpd.shutdown()
+			self._httpd.server_close()
+		if self._ws_loop is not None:
+			self._ws_loop.call_soon_threadsafe(self._ws_stop.set)
+
+	@property
+	def url(self):
+		return 'http://%s:%d' % self._httpd.server_address
+
+	def _run_ticker(self):
+		while not self._stop.wait(self.tick_interval):
+			self.advance()
+
+	def advance(self, count=None):
+		"""Step every market and publish the result on the WebSocket feed."""
+		count = count or self.executions_per_tick
+		with self._lock:
+			updates = [(p, m.step(count), m.ticker(), m.board())
+						for p, m in self.markets.items()]
+			self._match_resting_orders()
+		if self._ws_loop is not None and self._ws_clients:
+			self._ws_loop.call_soon_threadsafe(
+				lambda: asyncio.ensure_future(self._publish(updates)))
+
+	# --- HTTP ---
+
+	def handle(self, method, target, body, headers, client):
+		"""(status, body bytes, extra headers) for one request."""
+		parsed = urllib.parse.urlsplit(target)
+		path = parsed.path
+		params = dict(urllib.parse.parse_qsl(parsed.query))
+		with self._lock:
+			self.requests[path] = self.requests.get(path, 0) + 1
+		if self.latency:
+			lo, hi = (self.latency if isinstance(self.latency, tuple)
+						else (self.latency, self.latency))
+			time.sleep(self._rnd.uniform(lo, hi))
+		private = path.startswith('/v1/me/')
+		if self._limits is not None:
+			who = headers.get('ACCESS-KEY', '') if private else client
+			wait = self._limits['private' if private else 'public'].hit(who)
+			if wait is not None:
+				return 429, b'{"status":-1,"error_message":"Too many requests"}', {
+					'Retry-After': '%d' % max(1, round(wait))}
+		if self.error_rate and self._rnd.random() < self.error_rate:
+			return 503, b'<html><body>503 Service Temporarily Unavailable</body></html>', {
+				'Content-Type': 'text/html'}
+		if private:
+			if not self._authorized(method, target, body, headers):
+				return 401, b'{"status":-500,"error_message":"Invalid signature"}', {}
+			if method == 'POST':
+				try:
+					params = json.loads(body or b'{}')
+				except ValueError:
+					return 400, b'{"status":-100,"error_message":"Invalid JSON"}', {}
+		name = path.rstrip('/').rsplit('/', 1)[-1]
+		handler = getattr(self, ('_private_' if private else '_public_') + name, None)
+		if handler is None:
+			return 404, b'{"status":-1,"error_message":"Not found"}', {}
+		with self._lock:
+			status, payload = handler(params)
+		if payload is None:
+			return status, b'', {}  # like the exchange's cancel endpoints
+		return status, json.dumps(payload).encode(), {}
+
+	def _authorized(self, method, target, body, headers):
+		if headers.get('ACCESS-KEY') != self.key:
+			return False
+		text = (headers.get('ACCESS-TIMESTAMP', '') + method + target
+				+ (body or b'').decode('utf-8', 'replace'))
+		expected = hmac.new(self.secret.encode(), text.encode(),
+							hashlib.sha256).hexdigest()
+		return hmac.compare_digest(expected, headers.get('ACCESS-SIGN', ''))
+
+	def _market(self, params):
+		return self.markets.get(params.get('product_code', 'BTC_JPY'))
+
+	def _bad_product(self):
+		return 400, {'status': -120, 'error_message': 'Invalid product'}
+
+	def _public_markets(self, params):
+		return 200, [{'product_code': p, 'market_type': 'Spot'} for p in self.markets]
+	_public_getmarkets = _public_markets
+
+	def _public_board(self, params):
+		m = self._market(params)
+		return (200, m.board()) if m else self._bad_product()
+	_public_getboard = _public_board
+
+	def _public_ticker(self, params):
+		m = self._market(params)
+		return (200, m.ticker()) if m else self._bad_product()
+	_public_getticker = _public_ticker
+
+	def _public_executions(self, params):
+		m = self._market(params)
+		if m is None:
+			return self._bad_product()
+		before, after = params.get('before'), params.get('after')
+		return 200, m.executions(params.get('count', 100),
+								int(before) if before else None,
+								int(after) if after else None)
+	_public_getexecutions = _public_executions
+
+	def _public_getboardstate(self, params):
+		return 200, {'health': 'NORMAL', 'state': 'RUNNING'}
+
+	def _public_gethealth(self, params):
+		return 200, {'status': 'NORMAL'}
+
+	# --- private ---
+
+	def _private_getpermissions(self, params):
+		return 200, ['/v1/me/' + name[len('_private_'):] for name in dir(self)
+					if name.startswith('_private_')]
+
+	def _private_getbalance(self, params):
+		return 200, [{'currency_code': c, 'amount': a, 'available': a}
+					for c, a in self.balances.items()]
+
+	def _private_sendchildorder(self, params):
+		m = self._market(params)
+		if m is None:
+			return self._bad_product()
+		order_type = params.get('child_order_type')
+		side = params.get('side')
+		size = float(params.get('size') or 0)
+		if order_type not in ('MARKET', 'LIMIT') or side not in ('BUY', 'SELL') or size <= 0:
+			return 400, {'status': -106, 'error_message': 'Invalid parameter'}
+		bid, ask = m.best()
+		touch = ask if side == 'BUY' else bid
+		price = touch if order_type == 'MARKET' else float(params.get('price') or 0)
+		quote, base = m.product_code.split('_')[-1], m.product_code.split('_')[-2]
+		cost = (price if order_type == 'LIMIT' else touch) * size
+		if side == 'BUY' and self.balances.get(quote, 0.0) < cost:
+			return 400, {'status': -205, 'error_message': 'Margin amount is insufficient for this order.'}
+		if side == 'SELL' and self.balances.get(base, 0.0) < size:
+			return 400, {'status': -205, 'error_message': 'Margin amount is insufficient for this order.'}
+		self._order_seq += 1
+		now = int(time.time() * 1000)
+		acceptance_id = 'JRF%s-%06d' % (time.strftime('%Y%m%d-%H%M%S', time.gmtime(now // 1000)),
+										self._order_seq)
+		self.orders.append({
+			'id': self._order_seq, 'child_order_id': 'JOR-MOCK-%06d' % self._order_seq,
+			'product_code': m.product_code, 'side': side,
+			'child_order_type': order_type, 'price': price, 'average_price': 0.0,
+			'size': size, 'child_order_state': 'ACTIVE',
+			'expire_date': _iso(now + 30 * 86400000), 'child_order_date': _iso(now),
+			'child_order_acceptance_id': acceptance_id, 'outstanding_size': size,
+			'cancel_size': 0.0, 'executed_size': 0.0, 'total_commission': 0.0})
+		self._match_resting_orders()
+		return 200, {'child_order_acceptance_id': acceptance_id}
+
+	def _match_resting_orders(self):
+		self._trigger_parent_orders()
+		for order in self.orders:
+			if order['child_order_state'] != 'ACTIVE':
+				continue
+			m = self.markets[order['product_code']]
+			bid, ask = m.best()
+			if order['child_order_type'] == 'MARKET':
+				fill = ask if order['side'] == 'BUY' else bid
+			elif order['side'] == 'BUY' and order['price'] >= ask:
+				fill = ask
+			elif order['side'] == 'SELL' and order['price'] <= bid:
+				fill = bid
+			else:
+				continue
+			self._fill(order, m, fill)
+
+	def _fill(self, order, market, price):
+		quote = market.product_code.split('_')[-1]
+		base = market.product_code.split('_')[-2]
+		size = order['outstanding_size']
+		sign = 1.0 if order['side'] == 'BUY' else -1.0
+		self.balances[base] = self.balances.get(base, 0.0) + sign * size
+		self.balances[quote] = self.balances.get(quote, 0.0) - sign * size * price
+		order.update(child_order_state='COMPLETED', average_price=price,
+					outstanding_size=0.0, executed_size=size)
+		now = _iso(int(time.time() * 1000))
+		for currency, amount in ((quote, -sign * size * price), (base, sign * size)):
+			self.balance_history.append({
+				'id': len(self.balance_history) + 1, 'trade_date': now,
+				'event_date': now, 'product_code': market.product_code,
+				'currency_code': currency, 'trade_type': order['side'],
+				'price': price, 'amount': amount, 'quantity': size,
+				'commission': 0.0, 'balance': self.balances[currency],
+				'order_id': order['child_order_id']})
+		self.fills.append({
+			'id': self._next_exec_id(), 'side': order['side'], 'price': price,
+			'size': size, 'exec_date': now,
+			'child_order_id': order['child_order_id'],
+			'child_order_acceptance_id': order['child_order_acceptance_id'],
+			'commission': 0.0, 'product_code': market.product_code})
+
+	# Legs of each order_method in stages: every leg of the active stage
+	# is working; a fill in it ends the stage (cancelling its other legs,
+	# as OCO does) and starts the next.
+	_PARENT_STAGES = {'SIMPLE': ((0,),), 'IFD': ((0,), (1,)),
+					'OCO': ((0, 1),), 'IFDOCO': ((0,), (1, 2))}
+
+	def _private_sendparentorder(self, params):
+		method = params.get('order_method', 'SIMPLE')
+		legs = params.get('parameters') or []
+		stages = self._PARENT_STAGES.get(method)
+		if stages is None or len(legs) != max(max(s) for s in stages) + 1:
+			return 400, {'status': -106, 'error_message': 'Invalid parameter'}
+		for leg in legs:
+			if leg.get('product_code') not in self.markets:
+				return self._bad_product()
+			if leg.get('condition_type') not in ('LIMIT', 'MARKET', 'STOP') \
+					or leg.get('side') not in ('BUY', 'SELL') \
+					or float(leg.get('size') or 0) <= 0 \
+					or (leg['condition_type'] == 'LIMIT' and not leg.get('price')) \
+					or (leg['condition_type'] == 'STOP' and not leg.get('trigger_price')):
+				return 400, {'status': -106, 'error_message': 'Invalid parameter'}
+		self._order_seq += 1
+		now = int(time.time() * 1000)
+		acceptance_id = 'JRF%s-%06d' % (time.strftime('%Y%m%d-%H%M%S', time.gmtime(now // 1000)),
+										self._order_seq)
+		first = legs[0]
+		self.parent_orders.append({
+			'id': self._order_seq, 'parent_order_id': 'JCO-MOCK-%06d' % self._order_seq,
+			'product_code': first['product_code'], 'side': first['side'],
+			'parent_order_type': method if method != 'SIMPLE' else first['condition_type'],
+			'price': float(first.get('price') or 0), 'average_price': 0.0,
+			'size': float(first['size']), 'parent_order_state': 'ACTIVE',
+			'expire_date': _iso(now + int(params.get('minute_to_expire', 43200)) * 60000),
+			'parent_order_date': _iso(now), 'parent_order_acceptance_id': acceptance_id,
+			'outstanding_size': float(first['size']), 'cancel_size': 0.0,
+			'executed_size': 0.0, 'total_commission': 0.0,
+			'order_method': method, 'parameters': legs, 'stage': 0})
+		self._match_resting_orders()
+		return 200, {'parent_order_acceptance_id': acceptance_id}
+
+	def _trigger_parent_orders(self):
+		for parent in self.parent_orders:
+			stages = self._PARENT_STAGES[parent['order_method']]
+			while parent['parent_order_state'] == 'ACTIVE':
+				leg = next((parent['parameters'][i] for i in stages[parent['stage']]
+							if self._leg_fill_price(parent['parameters'][i]) is not None),
+							None)
+				if leg is None:
+					break
+				m = self.markets[leg['product_code']]
+				price = self._leg_fill_price(leg)
+				self._order_seq += 1
+				size = float(leg['size'])
+				order = {
+					'id': self._order_seq, 'child_order_id': 'JOR-MOCK-%06d' % self._order_seq,
+					'product_code': m.product_code, 'side': leg['side'],
+					'child_order_type': 'LIMIT' if leg['condition_type'] == 'LIMIT' else 'MARKET',
+					'price': price, 'average_price': 0.0, 'size': size,
+					'child_order_state': 'ACTIVE',
+					'expire_date': parent['expire_date'],
+					'child_order_date': _iso(int(time.time() * 1000)),
+					'child_order_acceptance_id': 'JRF-MOCK-P%06d' % self._order_seq,
+					'parent_order_id': parent['parent_order_id'],
+					'outstanding_size': size, 'cancel_size': 0.0,
+					'executed_size': 0.0, 'total_commission': 0.0}
+				self.orders.append(order)
+				self._fill(order, m, price)
+				parent['stage'] += 1
+				if parent['stage'] == len(stages):
+					parent.update(parent_order_state='COMPLETED', average_price=price,
+								executed_size=size, outstanding_size=0.0)
+
+	def _leg_fill_price(self, leg):
+		"""Price a parent order leg executes at now, or None if it waits."""
+		bid, ask = self.markets[leg['product_code']].best()
+		touch = ask if leg['side'] == 'BUY' else bid
+		kind = leg['condition_type']
+		if kind == 'MARKET':
+			return touch
+		if kind == 'LIMIT':
+			price = float(leg['price'])
+			crossed = price >= ask if leg['side'] == 'BUY' else price <= bid
+			return touch if crossed else None
+		trigger = float(leg['trigger_price'])  # STOP: market order once triggered
+		fired = ask >= trigger if leg['side'] == 'BUY' else bid <= trigger
+		return touch if fired else None
+
+	def _private_cancelparentorder(self, params):
+		for parent in self.parent_orders:
+			if parent['product_code'] == params.get('product_code') \
+					and params.get('parent_order_acceptance_id') in (
+						None, parent['parent_order_acceptance_id']) \
+					and params.get('parent_order_id') in (None, parent['parent_order_id']) \
+					and parent['parent_order_state'] == 'ACTIVE':
+				parent.update(parent_order_state='CANCELED',
+							cancel_size=parent['outstanding_size'], outstanding_size=0.0)
+		return 200, None
+
+	def _private_getparentorders(self, params):
+		rows = [p for p in reversed(self.parent_orders)
+				if p['product_code'] == params.get('product_code', p['product_code'])
+				and p['parent_order_state'] == params.get(
+					'parent_order_state', p['parent_order_state'])]
+		hidden = ('order_method', 'parameters', 'stage')
+		return 200, [dict((k, v) for k, v in p.items() if k not in hidden)
+					for p in _page(rows, params)]
+
+	def _private_getparentorder(self, params):
+		for parent in self.parent_orders:
+			if params.get('parent_order_acceptance_id') in (
+						None, parent['parent_order_acceptance_id']) \
+					and params.get('parent_order_id') in (None, parent['parent_order_id']):
+				return 200, {'id': parent['id'],
+							'parent_order_id': parent['parent_order_id'],
+							'order_method': parent['order_method'],
+							'expire_date': parent['expire_date'],
+							'time_in_force': 'GTC',
+							'parameters': parent['parameters'],
+							'parent_order_acceptance_id': parent['parent_order_acceptance_id']}
+		return 400, {'status': -111, 'error_message': 'Order not found'}
+
+	def _private_cancelchildorder(self, params):
+		for order in self.orders:
+			if order['product_code'] != params.get('product_code'):
+				continue
+			if params.get('child_order_acceptance_id') in (None, order['child_order_acceptance_id']) \
+					and params.get('child_order_id') in (None, order['child_order_id']) \
+					and order['child_order_state'] == 'ACTIVE':
+				order.update(child_order_state='CANCELED',
+							cancel_size=order['outstanding_size'], outstanding_size=0.0)
+		return 200, None
+
+	def _private_cancelallchildorders(self, params):
+		for order in self.orders:
+			if order['product_code'] == params.get('product_code') \
+					and order['child_order_state'] == 'ACTIVE':
+				order.update(child_order_state='CANCELED',
+							cancel_size=order['outstanding_size'], outstanding_size=0.0)
+		return 200, None
+
+	def _private_getchildorders(self, params):
+		rows = [o for o in reversed(self.orders)
+				if o['product_code'] == params.get('product_code', o['product_code'])
+				and o['child_order_state'] == params.get('child_order_state', o['child_order_state'])
+				and o['child_order_acceptance_id'] == params.get(
+					'child_order_acceptance_id', o['child_order_acceptance_id'])]
+		return 200, _page(rows, params)
+
+	def _private_getexecutions(self, params):
+		rows = [f for f in reversed(self.fills)
+				if f['product_code'] == params.get('product_code', f['product_code'])]
+		return 200, [dict((k, v) for k, v in f.items() if k != 'product_code')
+					for f in _page(rows, params)]
+
+	def _private_getbalancehistory(self, params):
+		rows = [r for r in reversed(self.balance_history)
+				if r['currency_code'] == params.get('currency_code', 'JPY')]
+		return 200, _page(rows, params)
+
+	def _private_getcollateralhistory(self, params):
+		return 200, []
+
+	# --- Realtime API ---
+
+	def _run_ws(self, ready):
+		from websockets.asyncio.server import serve
+		loop = asyncio.new_event_loop()
+		self._ws_loop = loop
+
+		async def main():
+			self._ws_stop = asyncio.Event()
+			async with serve(self._ws_handler, self.host, 0) as server:
+				self.ws_url = 'ws://%s:%d' % server.sockets[0].getsockname()[:2]
+				ready.set()
+				await self._ws_stop.wait()
+		try:
+			loop.run_until_complete(main())
+		finally:
+			loop.close()
+
+	async def _ws_handler(self, ws):
+		ws.channels = set()
+		self._ws_clients.add(ws)
+		try:
+			async for raw in ws:
+				req = json.loads(raw)
+				channel = (req.get('params') or {}).get('channel')
+				if req.get('method') == 'subscribe':
+					ws.channels.add(channel)
+				elif req.get('method') == 'unsubscribe':
+					ws.channels.discard(channel)
+				await ws.send(json.dumps({'jsonrpc': '2.0', 'id': req.get('id'),
+										'result': True}))
+				for product, market in self.markets.items():
+					if channel == board_snapshot_channel(product):
+						with self._lock:
+							board = market.board()
+						await self._send(ws, channel, board)
+		except Exception:
+			pass
+		finally:
+			self._ws_clients.discard(ws)
+
+	async def _send(self, ws, channel, message):
+		await ws.send(json.dumps({'jsonrpc': '2.0', 'method': 'channelMessage',
+								'params': {'channel': channel, 'message': message}}))
+
+	async def _publish(self, updates):
+		for ws in list(self._ws_clients):
+			try:
+				for product, executions, ticker, board in updates:
+					if executions_channel(product) in ws.channels:
+						await self._send(ws, executions_channel(product), executions)
+					if ticker_channel(product) in ws.channels:
+						await self._send(ws, ticker_channel(product), ticker)
+					if board_snapshot_channel(product) in ws.channels:
+						await self._send(ws, board_snapshot_channel(product), board)
+					if board_channel(product) in ws.channels:
+						top = {'mid_price': board['mid_price'],
+							'bids': board['bids'][:5], 'asks': board['asks'][:5]}
+						await self._send(ws, board_channel(product), top)
+			except Exception:
+				self._ws_clients.discard(ws)
+
+
+def _page(rows, params):
+	"""count/before/after pagination over rows sorted newest first."""
+	before, after = params.get('before'), params.get('after')
+	out = [r for r in rows
+			if (before is None or r['id'] < int(before))
+			and (after is None or r['id'] > int(after))]
+	return out[:int(params.get('count', 100))]
+
+
+class _Handler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	# headers and body go out in one segment (flushed after each request);
+	# otherwise Nagle plus delayed ACK adds ~40 ms to every keep-alive call
+	wbufsize = -1
+	disable_nagle_algorithm = True
+
+	def _serve(self, method):
+		body = None
+		if method == 'POST':
+			body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+		status, payload, headers = self.server.mock.handle(
+			method, self.path, body, self.headers, self.client_address[0])
+		self.send_response(status)
+		headers.setdefault('Content-Type', 'application/json')
+		for name, value in headers.items():
+			self.send_header(name, value)
+		self.send_header('Content-Length', str(len(payload)))
+		self.end_headers()
+		self.wfile.write(payload)
+
+	def do_GET(self):
+		self._serve('GET')
+
+	def do_POST(self):
+		self._serve('POST')
+
+	def log_message(self, *args):
+		pass
+
+
+def main():
+	import argparse
+	parser = argparse.ArgumentParser(description='Run a local bitFlyer mock.')
+	parser.add_argument('--products', default='BTC_JPY,ETH_JPY')
+	parser.add_argument('--latency', type=float, default=0.0)
+	parser.add_argument('--error-rate', type=float, default=0.0)
+	args = parser.parse_args()
+	mock = MockBitFlyer(products=args.products.split(','), latency=args.latency,
+						error_rate=args.error_rate).start()
+	print('HTTP %s  WebSocket %s  key=%s secret=%s'
+		% (mock.url, mock.ws_url, mock.key, mock.secret))
+	try:
+		while True:
+			time.sleep(3600)
+	except KeyboardInterrupt:
+		mock.stop()
+
+
+if __name__ == '__main__':
+	main()
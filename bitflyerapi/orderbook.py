@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_left, bisect_right, insort
+
+from .realtime import board_channel, board_snapshot_channel
+
+_INF = float('inf')
+
+class _Side(object):
+	"""
+	Price levels of one side of the book: a sorted list of prices (binary
+	search for lookup, insert and delete) plus a price -> size dict.
+	"""
+	__slots__ = ('prices', 'sizes')
+
+	def __init__(self):
+		self.prices = []
+		self.sizes = {}
+
+	def clear(self):
+		self.prices = []
+		self.sizes = {}
+
+	def set(self, price, size):
+		if size > 0:
+			if price not in self.sizes:
+				insort(self.prices, price)
+			self.sizes[price] = size
+		elif price in self.sizes:
+			del self.sizes[price]
+			del self.prices[bisect_left(self.prices, price)]
+
+	def remove_from(self, lo, hi):
+		"""Remove every level with lo <= price <= hi."""
+		i = bisect_left(self.prices, lo)
+		j = bisect_right(self.prices, hi)
+		for price in self.prices[i:j]:
+			del self.sizes[price]
+		del self.prices[i:j]
+
+	def sum_between(self, lo, hi):
+		"""(total size, total price*size) of the levels with lo <= price <= hi."""
+		i = bisect_left(self.prices, lo)
+		j = bisect_right(self.prices, hi)
+		sizes = self.sizes
+		qty = notional = 0.0
+		for price in self.prices[i:j]:
+			size = sizes[price]
+			qty += size
+			notional += price * size
+		return qty, notional
+
+
+class OrderBook(object):
+	"""
+	Local order book maintained from the Realtime API board channels.
+
+	lightning_board_snapshot_{product_code} replaces the whole book and is
+	the resync point; lightning_board_{product_code} carries diffs where a
+	size of 0 removes the level. The board channels have no sequence
+	numbers, so diffs received before the first snapshot are ignored
+	(ready stays False) and a diff that crosses the book evicts the stale
+	opposite levels it overlaps.
+
+		book = OrderBook()
+		book.attach(client, 'BTC_JPY')  # RealtimeClient
+		...
+		bid_qty, ask_qty = book.depth(0.5)
+
+	A REST /v1/board response can be loaded the same way with
+	OrderBook.from_board(api.board(product_code='BTC_JPY')).
+	"""
+	def __init__(self):
+		self.bids = _Side()
+		self.asks = _Side()
+		self.mid_price = 0.0
+		self.ready = False
+		self.snapshots = 0
+		self.updates = 0
+
+	@classmethod
+	def from_board(cls, board):
+		book = cls()
+		book.apply_snapshot(board)
+		return book
+
+	def attach(self, client, product_code):
+		"""Feed this book from a RealtimeClient's board channels."""
+		client.subscribe(board_snapshot_channel(product_code), self.apply_snapshot)
+		client.subscribe(board_channel(product_code), self.apply_diff)
+
+	def apply_snapshot(self, message):
+		self.bids.clear()
+		self.asks.clear()
+		for level in message.get('bids', ()):
+			self.bids.set(float(level['price']), float(level['size']))
+		for level in message.get('asks', ()):
+			self.asks.set(float(level['price']), float(level['size']))
+		self.mid_price = float(message.get('mid_price') or 0.0)
+		self.ready = True
+		self.snapshots += 1
+
+	def apply_diff(self, message):
+		if not self.ready:
+			return
+		for level in message.get('bids', ()):
+			price, size = float(level['price']), float(level['size'])
+			self.bids.set(price, size)
+			if size > 0 and self.asks.prices and self.asks.prices[0] <= price:
+				self.asks.remove_from(self.asks.prices[0], price)
+		for level in message.get('asks', ()):
+			price, size = float(level['price']), float(level['size'])
+			self.asks.set(price, size)
+			if size > 0 and self.bids.prices and self.bids.prices[-1] >= price:
+				self.bids.remove_from(price, self.bids.prices[-1])
+		if message.get('mid_price'):
+			self.mid_price = float(message['mid_price'])
+		self.updates += 1
+
+	def best_bid(self):
+		"""(price, size) of the best bid, or None."""
+		if not self.bids.prices:
+			return None
+		price = self.bids.prices[-1]
+		return price, self.bids.sizes[price]
+
+	def best_ask(self):
+		"""(price, size) of the best ask, or None."""
+		if not self.asks.prices:
+			return None
+		price = self.asks.prices[0]
+		return price, self.asks.sizes[price]
+
+	def mid(self):
+		"""mid_price from the feed, else the midpoint of the best quotes."""
+		if self.mid_price:
+			return self.mid_price
+		bid, ask = self.best_bid(), self.best_ask()
+		if bid and ask:
+			return (bid[0] + ask[0]) / 2.0
+		return 0.0
+
+	def depth(self, band_pct, mid=None):
+		"""
+		Cumulative (bid size, ask size) within +-band_pct% of mid.
+		mid defaults to mid().
+		"""
+		mid = mid or self.mid()
+		band = mid * band_pct / 100.0
+		bid, _ = self.bids.sum_between(mid - band, _INF)
+		ask, _ = self.asks.sum_between(-_INF, mid + band)
+		return bid, ask
+
+	def depth_weighted_mid(self, band_pct, mid=None):
+		"""
+		Micro-price over a band: the size-weighted average bid and ask
+		prices within +-band_pct% of mid, each weighted by the opposite
+		side's size. Leans towards the thinner side, where the price is more
+		likely to move next. Falls back to mid when a side is empty.
+		"""
+		mid = mid or self.mid()
+		band = mid * band_pct / 100.0
+		bid_qty, bid_notional = self.bids.sum_between(mid - band, _INF)
+		ask_qty, ask_notional = self.asks.sum_between(-_INF, mid + band)
+		if bid_qty <= 0 or ask_qty <= 0:
+			return mid
+		bid_px = bid_notional / bid_qty
+		ask_px = ask_notional / ask_qty
+		return (bid_px * ask_qty + ask_px * bid_qty) / (bid_qty + ask_qty)
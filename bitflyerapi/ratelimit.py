@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import threading
+import time
+
+# bitFlyer Lightning HTTP API limits: 500 requests per 5 minutes per IP for
+# public endpoints, and 500 per 5 minutes per API key for private endpoints.
+PUBLIC_RATE = (500, 300.0)
+PRIVATE_RATE = (500, 300.0)
+
+class TokenBucket(object):
+	"""
+	Thread-safe token bucket pacing requests to `rate` per `per` seconds.
+
+	capacity: Largest burst allowed after an idle period. Defaults to a
+			tenth of rate so a full budget is not spent in one burst.
+
+	reserve() books tokens and returns how long the caller has to wait
+	before using them (0.0 when they are available now); acquire() sleeps
+	for that long. Reservations queue up, so concurrent callers are spread
+	out instead of all failing once the budget is gone.
+	"""
+	def __init__(self, rate, per=1.0, capacity=None):
+		self.rate = float(rate) / float(per)
+		self.capacity = float(capacity if capacity is not None else max(1.0, rate / 10.0))
+		self._tokens = self.capacity
+		self._updated = time.monotonic()
+		self._lock = threading.Lock()
+
+	def reserve(self, tokens=1):
+		with self._lock:
+			now = time.monotonic()
+			self._tokens = min(self.capacity,
+							self._tokens + (now - self._updated) * self.rate)
+			self._updated = now
+			self._tokens -= tokens
+			if self._tokens >= 0:
+				return 0.0
+			return -self._tokens / self.rate
+
+	def acquire(self, tokens=1):
+		wait = self.reserve(tokens)
+		if wait > 0:
+			time.sleep(wait)
+		return wait
+
+
+class SQLiteTokenBucket(TokenBucket):
+	"""
+	Token bucket whose state lives in a SQLite file, so that several
+	processes (e.g. one cron job per product) share one budget. Each
+	reservation is a short IMMEDIATE transaction on a single row.
+	"""
+	def __init__(self, path, name, rate, per=1.0, capacity=None):
+		super(SQLiteTokenBucket, self).__init__(rate, per, capacity)
+		self.path = path
+		self.name = name
+		conn = self._connect()
+		try:
+			conn.execute("""
+				CREATE TABLE IF NOT EXISTS rate_buckets (
+					name TEXT PRIMARY KEY,
+					tokens REAL NOT NULL,
+					updated REAL NOT NULL
+				)
+			""")
+			conn.execute("INSERT OR IGNORE INTO rate_buckets VALUES (?, ?, ?)",
+						(name, self.capacity, time.time()))
+			conn.commit()
+		finally:
+			conn.close()
+
+	def _connect(self):
+		return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+	def reserve(self, tokens=1):
+		with self._lock:
+			conn = self._connect()
+			try:
+				conn.execute("BEGIN IMMEDIATE")
+				stored, updated = conn.execute(
+					"SELECT tokens, updated FROM rate_buckets WHERE name = ?",
+					(self.name,)).fetchone()
+				now = time.time()
+				available = min(self.capacity,
+								stored + max(0.0, now - updated) * self.rate) - tokens
+				conn.execute("UPDATE rate_buckets SET tokens = ?, updated = ? WHERE name = ?",
+							(available, now, self.name))
+				conn.execute("COMMIT")
+			finally:
+				conn.close()
+		if available >= 0:
+			return 0.0
+		return -available / self.rate
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def default_limiters(path=None):
+	"""
+	{'public': bucket, 'private': bucket} with bitFlyer's documented limits.
+	Without path the buckets are shared by every client in this process;
+	with a SQLite path they are also shared with other processes.
+	"""
+	with _shared_lock:
+		if path not in _shared:
+			if path:
+				_shared[path] = {
+					'public': SQLiteTokenBucket(path, 'public', *PUBLIC_RATE),
+					'private': SQLiteTokenBucket(path, 'private', *PRIVATE_RATE),
+				}
+			else:
+				_shared[path] = {
+					'public': TokenBucket(*PUBLIC_RATE),
+					'private': TokenBucket(*PRIVATE_RATE),
+				}
+		return _shared[path]
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+
+from .codec import get_loads
+
+logger = logging.getLogger(__name__)
+
+REALTIME_URL = 'wss://ws.lightstream.bitflyer.com/json-rpc'
+
+def executions_channel(product_code):
+	return 'lightning_executions_' + product_code
+
+def ticker_channel(product_code):
+	return 'lightning_ticker_' + product_code
+
+def board_snapshot_channel(product_code):
+	return 'lightning_board_snapshot_' + product_code
+
+def board_channel(product_code):
+	return 'lightning_board_' + product_code
+
+
+_CLOSED = object()
+
+class ChannelStream(object):
+	"""
+	Async iterator over the messages of one channel.
+
+	Backed by a bounded queue. When the consumer falls behind and the queue
+	is full, the reader stops pulling frames off the socket until there is
+	room again (backpressure), unless the stream was opened with
+	drop_oldest=True, in which case the oldest queued message is discarded.
+	"""
+	def __init__(self, channel, maxsize=1000, drop_oldest=False):
+		self.channel = channel
+		self.drop_oldest = drop_oldest
+		self.dropped = 0
+		self._closed = False
+		self._queue = asyncio.Queue(maxsize)
+
+	def __aiter__(self):
+		return self
+
+	async def __anext__(self):
+		if self._closed and self._queue.empty():
+			raise StopAsyncIteration
+		message = await self._queue.get()
+		if message is _CLOSED:
+			raise StopAsyncIteration
+		return message
+
+	async def _put(self, message):
+		if self.drop_oldest and self._queue.full():
+			self._queue.get_nowait()
+			self.dropped += 1
+		await self._queue.put(message)
+
+	def _close(self):
+		# Queued messages stay readable; the sentinel only wakes a waiting
+		# consumer (a full queue has no waiting consumer to wake).
+		self._closed = True
+		if not self._queue.full():
+			self._queue.put_nowait(_CLOSED)
+
+
+class RealtimeClient(object):
+	"""
+	JSON-RPC 2.0 subscriber for the bitFlyer Lightning Realtime API.
+
+	Channels (see executions_channel() and friends):
+	lightning_executions_{product_code}, lightning_ticker_{product_code},
+	lightning_board_snapshot_{product_code}, lightning_board_{product_code}
+
+	Register callbacks with subscribe() or iterate with stream(), then run
+	the client with ``await client.run()``. The connection is re-established
+	with exponential backoff whenever it drops, and every registered channel
+	is subscribed again on each new connection.
+
+		client = RealtimeClient()
+		client.subscribe(ticker_channel('BTC_JPY'), print)
+		executions = client.stream(executions_channel('BTC_JPY'))
+		asyncio.ensure_future(client.run())
+		async for batch in executions:
+			...
+
+	Callbacks receive the channel message (a list of executions, a ticker
+	dict, a board dict) and may be plain functions or coroutines.
+	"""
+	def __init__(self, url=REALTIME_URL, reconnect_delay=1.0,
+				max_reconnect_delay=30.0, ping_interval=20.0, json_loads=None):
+		self.url = url
+		self.json_loads = get_loads(json_loads)
+		self.reconnect_delay = reconnect_delay
+		self.max_reconnect_delay = max_reconnect_delay
+		self.ping_interval = ping_interval
+		self.connections = 0
+		self._callbacks = {}
+		self._streams = {}
+		self._ws = None
+		self._stopping = False
+		self._next_id = 0
+		self._tasks = set()  # background sends, referenced until done
+
+	@property
+	def channels(self):
+		return sorted(set(self._callbacks) | set(self._streams))
+
+	def subscribe(self, channel, callback=None):
+		"""Register a callback for channel (also subscribes if connected)."""
+		is_new = channel not in self.channels
+		self._callbacks.setdefault(channel, [])
+		if callback is not None:
+			self._callbacks[channel].append(callback)
+		if is_new:
+			self._send_subscribe(channel)
+
+	def stream(self, channel, maxsize=1000, drop_oldest=False):
+		"""Return a ChannelStream for channel (also subscribes if connected)."""
+		is_new = channel not in self.channels
+		stream = ChannelStream(channel, maxsize, drop_oldest)
+		self._streams.setdefault(channel, []).append(stream)
+		if is_new:
+			self._send_subscribe(channel)
+		return stream
+
+	async def unsubscribe(self, channel):
+		self._callbacks.pop(channel, None)
+		for stream in self._streams.pop(channel, []):
+			stream._close()
+		if self._ws is not None:
+			await self._call('unsubscribe', {'channel': channel})
+
+	def stop(self):
+		"""Stop run() after the current message and end all streams."""
+		self._stopping = True
+		if self._ws is not None:
+			self._spawn(self._ws.close())
+
+	async def run(self):
+		"""Connect, subscribe and dispatch until stop() is called."""
+		from websockets.asyncio.client import connect
+		from websockets.exceptions import WebSocketException
+
+		delay = self.reconnect_delay
+		try:
+			while not self._stopping:
+				try:
+					async with connect(self.url, ping_interval=self.ping_interval) as ws:
+						self._ws = ws
+						self.connections += 1
+						delay = self.reconnect_delay
+						for channel in self.channels:
+							await self._call('subscribe', {'channel': channel})
+						async for frame in ws:
+							await self._dispatch(frame)
+				except (WebSocketException, OSError, asyncio.TimeoutError) as e:
+					if self._stopping:
+						break
+					logger.warning("realtime connection lost (%s); reconnecting in %.1fs",
+								e, delay)
+				finally:
+					self._ws = None
+				if self._stopping:
+					break
+				await asyncio.sleep(delay)
+				delay = min(delay * 2, self.max_reconnect_delay)
+		finally:
+			for streams in self._streams.values():
+				for stream in streams:
+					stream._close()
+
+	def _spawn(self, coro):
+		task = asyncio.ensure_future(coro)
+		self._tasks.add(task)
+		task.add_done_callback(self._tasks.discard)
+		return task
+
+	def _send_subscribe(self, channel):
+		if self._ws is not None:
+			task = self._spawn(self._call('subscribe', {'channel': channel}))
+			task.add_done_callback(lambda t: self._subscribe_done(t, channel))
+
+	def _subscribe_done(self, task, channel):
+		"""
+		A subscribe sent outside run() failed: drop the connection so that
+		run() reconnects and subscribes every channel again.
+		"""
+		if task.cancelled() or task.exception() is None:
+			return
+		logger.warning("realtime subscribe to %s failed (%s); reconnecting",
+						channel, task.exception())
+		if self._ws is not None and not self._stopping:
+			self._spawn(self._ws.close())
+
+	async def _call(self, method, params):
+		self._next_id += 1
+		await self._ws.send(json.dumps({'jsonrpc': '2.0', 'method': method,
+										'params': params, 'id': self._next_id}))
+
+	async def _dispatch(self, frame):
+		"""
+		Route one frame to its callbacks and streams.
+
+		A malformed frame or a failing callback is logged and skipped, so it
+		never ends run() or stops the other subscribers from being served.
+		"""
+		try:
+			data = self.json_loads(frame)
+			if data.get('method') != 'channelMessage':
+				if 'error' in data:
+					logger.warning("realtime error response: %s", data['error'])
+				return
+			channel = data['params']['channel']
+			message = data['params']['message']
+		except Exception:
+			logger.exception("realtime: ignoring malformed frame %.200r", frame)
+			return
+		for callback in self._callbacks.get(channel, ()):
+			try:
+				result = callback(message)
+				if asyncio.iscoroutine(result):
+					await result
+			except Exception:
+				logger.exception("realtime: callback %r for %s failed", callback, channel)
+		for stream in self._streams.get(channel, ()):
+			await stream._put(message)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import calendar
+import time
+from functools import lru_cache
+
+@lru_cache(maxsize=4096)
+def _minute_epoch_ms(minute):
+	return calendar.timegm(time.strptime(minute, "%Y-%m-%dT%H:%M")) * 1000
+
+@lru_cache(maxsize=4096)
+def minute_label(minute_ms):
+	"""'YYYY-MM-DDTHH:MM' (UTC) for an epoch-ms value on a minute boundary."""
+	return time.strftime("%Y-%m-%dT%H:%M", time.gmtime(minute_ms // 1000))
+
+def epoch_ms(timestamp):
+	"""
+	Epoch milliseconds of an API timestamp such as exec_date
+	("2024-01-01T12:34:56.789", UTC; more digits and a trailing Z are
+	fine). The date-to-minute part is cached, so timestamps in the same
+	minute only cost two small int() calls.
+	"""
+	ms = _minute_epoch_ms(timestamp[:16]) + int(timestamp[17:19]) * 1000
+	frac = timestamp[20:23].rstrip("Z")
+	if frac:
+		ms += int(frac.ljust(3, "0"))
+	return ms
+
+
+class Execution(object):
+	"""
+	One /v1/executions (or lightning_executions) row with numeric fields
+	converted once. exec_ms is exec_date as epoch milliseconds; side is
+	'BUY', 'SELL' or '' (itayose).
+	"""
+	__slots__ = ('id', 'side', 'price', 'size', 'exec_ms', 'exec_date')
+
+	def __init__(self, id, side, price, size, exec_ms, exec_date=None):
+		self.id = id
+		self.side = side
+		self.price = price
+		self.size = size
+		self.exec_ms = exec_ms
+		self.exec_date = exec_date
+
+	@classmethod
+	def from_dict(cls, d):
+		return cls(d.get('id', 0), d.get('side') or '', float(d.get('price', 0.0)),
+					float(d.get('size', 0.0)), epoch_ms(d['exec_date']),
+					d['exec_date'])
+
+	def __repr__(self):
+		return 'Execution(id=%r, side=%r, price=%r, size=%r, exec_date=%r)' % (
+			self.id, self.side, self.price, self.size, self.exec_date)
+
+
+class Ticker(object):
+	"""
+	/v1/ticker (or lightning_ticker) with numeric fields as floats.
+
+	ltp, best_bid and best_ask are required: from_dict raises KeyError
+	for a reply without them (such as a JSON error body) rather than
+	reading them as 0. The other numeric fields default to 0.0.
+	"""
+	__slots__ = ('product_code', 'state', 'timestamp_ms', 'tick_id',
+				'best_bid', 'best_ask', 'best_bid_size', 'best_ask_size',
+				'total_bid_depth', 'total_ask_depth', 'ltp', 'volume',
+				'volume_by_product')
+
+	_REQUIRED = ('ltp', 'best_bid', 'best_ask')
+	_FLOATS = ('best_bid_size', 'best_ask_size', 'total_bid_depth',
+				'total_ask_depth', 'volume', 'volume_by_product')
+
+	@classmethod
+	def from_dict(cls, d):
+		t = cls()
+		t.product_code = d.get('product_code')
+		t.state = d.get('state')
+		t.timestamp_ms = epoch_ms(d['timestamp']) if d.get('timestamp') else 0
+		t.tick_id = d.get('tick_id', 0)
+		for name in cls._REQUIRED:
+			setattr(t, name, float(d[name]))
+		for name in cls._FLOATS:
+			setattr(t, name, float(d.get(name) or 0.0))
+		return t
+
+	def __repr__(self):
+		return 'Ticker(product_code=%r, ltp=%r, best_bid=%r, best_ask=%r)' % (
+			self.product_code, self.ltp, self.best_bid, self.best_ask)
+
+
+class BoardLevel(object):
+	"""One price level of /v1/board (or the board channels)."""
+	__slots__ = ('price', 'size')
+
+	def __init__(self, price, size):
+		self.price = price
+		self.size = size
+
+	@classmethod
+	def from_dict(cls, d):
+		return cls(float(d['price']), float(d['size']))
+
+	def __repr__(self):
+		return 'BoardLevel(price=%r, size=%r)' % (self.price, self.size)
+
+
+def executions(rows):
+	"""List of Execution from API rows; rows that already are records pass."""
+	from_dict = Execution.from_dict
+	return [r if isinstance(r, Execution) else from_dict(r) for r in rows]
+
+def board_levels(levels):
+	"""List of BoardLevel from the 'bids' or 'asks' list of a board reply."""
+	return [BoardLevel(float(l['price']), float(l['size'])) for l in levels]
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import threading
+import urllib.parse
+from collections import deque
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Response headers worth keeping in a cassette (the rest is noise).
+_KEPT_HEADERS = ('Content-Type', 'Retry-After')
+
+class Response(object):
+	"""
+	Minimal stand-in for requests.Response returned by ReplayTransport:
+	status_code, content (bytes), headers, text, json() and
+	raise_for_status().
+	"""
+	def __init__(self, status_code, content, headers=None, url=None):
+		self.status_code = status_code
+		self.content = content
+		self.headers = CaseInsensitiveDict(headers or {})
+		self.url = url
+
+	@property
+	def text(self):
+		return self.content.decode('utf-8', 'replace')
+
+	def json(self):
+		return json.loads(self.content)
+
+	def raise_for_status(self):
+		if self.status_code >= 400:
+			raise requests.HTTPError("%d error for url: %s"
+									% (self.status_code, self.url), response=self)
+
+
+class CassetteMiss(LookupError):
+	"""ReplayTransport has no recorded response for a request."""
+
+
+def with_query(url, params):
+	"""url with params appended as a query string (as requests would)."""
+	if not params:
+		return url
+	sep = '&' if '?' in url else '?'
+	return url + sep + urllib.parse.urlencode(params)
+
+
+class RequestsTransport(object):
+	"""
+	Sends requests over a pooled requests.Session (created on first use).
+	Every transport has the same interface:
+
+		send(method, url, body=None, headers=None, timeout=None) -> response
+
+	where url already carries the query string and the response exposes
+	status_code, content and headers.
+	"""
+	def __init__(self, session=None):
+		self._session = session
+		self._lock = threading.Lock()
+
+	def session(self):
+		with self._lock:
+			if self._session is None:
+				self._session = requests.Session()
+			return self._session
+
+	def send(self, method, url, body=None, headers=None, timeout=None):
+		return self.session().request(method, url, data=body, headers=headers,
+									timeout=timeout)
+
+	def close(self):
+		with self._lock:
+			if self._session is not None:
+				self._session.close()
+				self._session = None
+
+
+class RecordingTransport(object):
+	"""
+	Passes requests to inner (a RequestsTransport by default) and appends
+	each exchange to a gzip JSON-lines cassette. Every record is written
+	as its own gzip member and flushed, so a crash loses at most the
+	request in flight and several runs can append to one file.
+	"""
+	def __init__(self, path, inner=None):
+		self.path = path
+		self.inner = inner or RequestsTransport()
+		self._lock = threading.Lock()
+
+	def send(self, method, url, body=None, headers=None, timeout=None):
+		response = self.inner.send(method, url, body=body, headers=headers,
+								timeout=timeout)
+		record = {
+			'method': method,
+			'url': url,
+			'body': body,
+			'status': response.status_code,
+			'headers': {k: response.headers[k] for k in _KEPT_HEADERS
+						if k in response.headers},
+			'content': response.content.decode('utf-8', 'replace'),
+		}
+		line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+		with self._lock:
+			with open(self.path, 'ab') as f:
+				f.write(gzip.compress(line))
+		return response
+
+	def close(self):
+		if hasattr(self.inner, 'close'):
+			self.inner.close()
+
+
+class ReplayTransport(object):
+	"""
+	Serves responses from a cassette written by RecordingTransport,
+	without touching the network.
+
+	Requests are matched on (method, url, body); repeated requests get the
+	recorded responses in order and then keep getting the last one, so a
+	cassette can be replayed in a loop for benchmarks. Unless strict, a
+	request with no exact match falls back to the responses recorded for
+	the same method and path with any query string and body (timestamps
+	in macro URLs, signed order bodies). Raises CassetteMiss otherwise.
+	"""
+	def __init__(self, path, strict=False):
+		self.path = path
+		self.strict = strict
+		self._lock = threading.Lock()
+		self._exact = {}
+		self._loose = {}
+		with gzip.open(path, 'rt', encoding='utf-8') as f:
+			for line in f:
+				if not line.strip():
+					continue
+				r = json.loads(line)
+				response = (r['status'], r['content'].encode('utf-8'),
+							r.get('headers') or {})
+				key = (r['method'], r['url'], r.get('body'))
+				self._exact.setdefault(key, []).append(response)
+				self._loose.setdefault(self._loose_key(r['method'], r['url']),
+										[]).append(response)
+		self._queues = {}
+
+	@staticmethod
+	def _loose_key(method, url):
+		return method, url.split('?', 1)[0]
+
+	def __len__(self):
+		return sum(len(v) for v in self._exact.values())
+
+	def send(self, method, url, body=None, headers=None, timeout=None):
+		key = (method, url, body)
+		recorded = self._exact.get(key)
+		if recorded is None and not self.strict:
+			key = self._loose_key(method, url)
+			recorded = self._loose.get(key)
+		if recorded is None:
+			raise CassetteMiss("no recorded response for %s %s" % (method, url))
+		with self._lock:
+			queue = self._queues.get(key)
+			if queue is None:
+				queue = self._queues[key] = deque(recorded)
+			status, content, resp_headers = (queue.popleft() if len(queue) > 1
+											else queue[0])
+		return Response(status, content, resp_headers, url)
+
+	def close(self):
+		pass
+
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+def cassette(path, mode):
+	"""
+	Shared transport for a cassette file: mode 'record' appends to it,
+	'replay' serves from it. One instance per (path, mode) in a process,
+	so every client (and aitrader.macro) records to or replays from the
+	same stream.
+	"""
+	if mode not in ('record', 'replay'):
+		raise ValueError("cassette mode must be 'record' or 'replay': %r" % mode)
+	with _cassettes_lock:
+		key = (path, mode)
+		if key not in _cassettes:
+			_cassettes[key] = (RecordingTransport(path) if mode == 'record'
+								else ReplayTransport(path))
+		return _cassettes[key]
@@ -16,7 +16,8 @@ setup(
     long_description=readme,
     author='pedestrian618',
     url='https://github.com/pedestrian618/bitflyerapi',
-    install_requires=['requests', 'anthropic', 'openai', 'google-genai'],
+    install_requires=['requests', 'httpx', 'websockets', 'anthropic', 'openai', 'google-genai'],
+    extras_require={'fast': ['orjson', 'numpy']},
     license=license,
     packages=find_packages(exclude=('tests', 'docs'))
 )
@@ -16,8 +16,8 @@ from aitrader.dashboard import generate_html, write_dashboard
 from aitrader.history import HistoryStore, HourCandle
 from aitrader.llm import LLMError, LLMRouter, estimate_cost_usd
 from aitrader.market import (Candle, MarketSnapshot, _adx, _atr, _bollinger,
-                             _build_candles_1m, _ema, _macd, _rsi, _sma,
-                             _taker_flow, _vwap)
+                             _build_candles_1m, _ema, _ema_series, _macd,
+                             _rsi, _sma, _taker_flow, _vwap)
 from aitrader.views import build_view_text
 from aitrader.paper import PaperBook
 from aitrader.personas import PERSONAS, PRODUCT_MARKER, product_label
@@ -111,6 +111,31 @@ class TestIndicators(unittest.TestCase):
         self.assertEqual(candles[1].close, 105)
         self.assertAlmostEqual(candles[1].volume, 0.3)
 
+    def test_aggregate_in_one_pass(self):
+        from aitrader.market import aggregate_executions
+        executions = [  # 新しい順(3件目は時刻が前後している)
+            {"id": 6, "exec_date": "2026-07-07T11:00:30.5", "side": "BUY", "price": 110, "size": 1.0},
+            {"id": 5, "exec_date": "2026-07-07T10:58:00", "side": "SELL", "price": 108, "size": 2.0},
+            {"id": 4, "exec_date": "2026-07-07T11:00:01", "side": "SELL", "price": 109, "size": 0.5},
+            {"id": 3, "exec_date": "2026-07-07T10:52:10", "side": "BUY", "price": 101, "size": 0.25},
+            {"id": 2, "exec_date": "2026-07-07T10:20:00", "side": "BUY", "price": 99, "size": 4.0},
+            {"id": 1, "exec_date": "2026-07-07T10:20:00", "side": "", "price": 98, "size": 1.0},
+        ]
+        result = aggregate_executions(executions)
+        self.assertEqual(result.count, 6)
+        self.assertEqual(result.taker[5], (1.0, 2.5, 3))
+        self.assertEqual(result.taker[15], (1.25, 2.5, 4))
+        self.assertEqual(result.taker[60], (5.25, 2.5, 6))
+        candles = result.candles
+        self.assertEqual([c.time for c in candles],
+                         ["2026-07-07T10:20:00Z", "2026-07-07T10:52:00Z",
+                          "2026-07-07T10:58:00Z", "2026-07-07T11:00:00Z"])
+        self.assertEqual(list(candles.trades), [2, 1, 1, 2])
+        self.assertEqual((candles[0].open, candles[0].close), (98, 99))
+        self.assertEqual((candles[-1].open, candles[-1].close), (109, 110))
+        self.assertEqual(candles[0].buy_volume, 4.0)  # 板寄せ(side空)は数えない
+        self.assertEqual(_taker_flow(executions, minutes=5), (1.0, 2.5))
+
     def test_sma(self):
         self.assertEqual(_sma([1, 2, 3, 4], 2), 3.5)
 
@@ -205,6 +230,382 @@ class TestIndicatorsExtra(unittest.TestCase):
         self.assertAlmostEqual(buy, 0.5)
         self.assertAlmostEqual(sell, 0.2)
 
+    def test_board_depth_prefers_live_book(self):
+        from bitflyerapi.orderbook import OrderBook
+        from aitrader.market import _board_depth
+        book = OrderBook.from_board({
+            "mid_price": 1000,
+            "bids": [{"price": 999, "size": 1.0}, {"price": 900, "size": 9.0}],
+            "asks": [{"price": 1001, "size": 3.0}]})
+        # api=None でも例外にならない = RESTの板取得を呼んでいない
+        bid, ask, wmid = _board_depth(None, "BTC_JPY", 1000.0, book=book)
+        self.assertEqual((bid, ask), (1.0, 3.0))
+        self.assertLess(wmid, 1000.0)  # 買い板が薄い → 買い側に寄る
+        self.assertEqual(_board_depth(None, "BTC_JPY", 1000.0), (0.0, 0.0, 0.0))
+
+
+def _fake_execution(i, seconds_per_exec=6):
+    from datetime import datetime, timedelta
+    t0 = datetime(2026, 7, 7, 0, 0, 0)
+    return {"id": i,
+            "exec_date": (t0 + timedelta(seconds=i * seconds_per_exec)).isoformat() + ".0",
+            "price": 100.0 + i % 7, "size": 0.01,
+            "side": "BUY" if i % 2 else "SELL"}
+
+
+def _fake_public_api(n=3000, seconds_per_exec=6, items=None):
+    """id 1..n の約定を1件あたりN秒間隔で持つ公開APIの代役(新しい順で返す)。
+
+    items(新しい順のリスト)を渡すと、テスト側で約定を追加できる。
+    """
+    from bitflyerapi import bitFlyerAPI
+    if items is None:
+        items = [_fake_execution(i, seconds_per_exec) for i in range(n, 0, -1)]
+    calls = []
+
+    def executions(count=100, before=None, after=None, **params):
+        calls.append({"before": before, "after": after, "count": count})
+        rows = [ex for ex in items
+                if (before is None or ex["id"] < before)
+                and (after is None or ex["id"] > after)]
+        return rows[:count]
+    api = bitFlyerAPI(key="", secret="")
+    api.executions = executions
+    api.ticker = lambda **kw: {"ltp": items[0]["price"], "best_bid": 99.0,
+                               "best_ask": 101.0, "volume_by_product": 1.0}
+    api.getboardstate = lambda **kw: {"state": "RUNNING", "health": "NORMAL"}
+    api.board = lambda **kw: {"mid_price": 100.0, "bids": [], "asks": []}
+    return api, calls
+
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(numpy is None, "numpy 未インストール")
+class TestNumpyIndicators(unittest.TestCase):
+    """aitrader.indicators が market.py の指標と同じ値を返すこと。"""
+
+    @staticmethod
+    def _random_candles(n, seed):
+        import random
+        rng = random.Random(seed)
+        price, candles = 10000000.0, []
+        for i in range(n):
+            o = price
+            price *= 1 + rng.gauss(0, 0.003)
+            if i % 17 == 0:
+                price = o  # 横ばい(値幅0)の足も混ぜる
+            h = max(o, price) * (1 + rng.random() * 0.002)
+            l = min(o, price) * (1 - rng.random() * 0.002)
+            candles.append(Candle(time=str(i), open=o, high=h, low=l, close=price,
+                                  volume=rng.random() * (i % 5)))
+        return candles
+
+    def assertClose(self, a, b):
+        if isinstance(a, tuple):
+            self.assertEqual(len(a), len(b))
+            for x, y in zip(a, b):
+                self.assertClose(x, y)
+            return
+        self.assertTrue(abs(a - b) <= 1e-9 * max(1.0, abs(a), abs(b)), (a, b))
+
+    def test_latest_values_match_pure_python(self):
+        from aitrader import indicators as ind
+        for n in (0, 1, 2, 14, 15, 20, 35, 72, 500):
+            candles = self._random_candles(n, seed=n)
+            cols = ind.from_candles(candles)
+            closes = [c.close for c in candles]
+            with self.subTest(bars=n):
+                self.assertClose(ind.sma(cols["close"], 10), _sma(closes, 10))
+                self.assertClose(ind.ema(cols["close"], 24), _ema(closes, 24))
+                self.assertClose(ind.rsi(cols["close"], 14), _rsi(closes, 14))
+                self.assertClose(ind.atr(cols["high"], cols["low"], cols["close"], 14),
+                                 _atr(candles, 14))
+                self.assertClose(ind.adx(cols["high"], cols["low"], cols["close"], 14),
+                                 _adx(candles, 14))
+                self.assertClose(ind.macd(cols["close"]), _macd(closes))
+                self.assertClose(ind.bollinger(cols["close"], 20), _bollinger(closes, 20))
+                self.assertClose(ind.vwap(cols["close"], cols["volume"]), _vwap(candles))
+
+    def test_series_match_prefix_recomputation(self):
+        from aitrader import indicators as ind
+        candles = self._random_candles(120, seed=7)
+        cols = ind.from_candles(candles)
+        closes = [c.close for c in candles]
+        series = {
+            "sma": ind.sma_series(cols["close"], 10),
+            "rsi": ind.rsi_series(cols["close"], 14),
+            "atr": ind.atr_series(cols["high"], cols["low"], cols["close"], 14),
+            "adx": ind.adx_series(cols["high"], cols["low"], cols["close"], 14),
+            "boll": ind.bollinger_series(cols["close"], 20)[1],
+            "vwap": ind.vwap_series(cols["close"], cols["volume"], 24),
+        }
+        for values in series.values():
+            self.assertEqual(len(values), len(candles))
+        for i in range(1, len(candles)):
+            prefix, head = candles[:i + 1], closes[:i + 1]
+            self.assertClose(float(series["sma"][i]), _sma(head, 10))
+            self.assertClose(float(series["atr"][i]), _atr(prefix, 14))
+            self.assertClose(float(series["vwap"][i]), _vwap(prefix[-24:]))
+            if i >= 14:
+                self.assertClose(float(series["rsi"][i]), _rsi(head, 14))
+                self.assertClose(float(series["adx"][i]), _adx(prefix, 14))
+            if i >= 19:
+                self.assertClose(float(series["boll"][i]), _bollinger(head, 20)[1])
+        self.assertTrue(numpy.isnan(series["rsi"][13]))
+        self.assertEqual(ind.ema_series(cols["close"], 8).tolist(),
+                         _ema_series(closes, 8))  # 同じ漸化式なので完全一致
+
+
+class TestCandleSeries(unittest.TestCase):
+    def test_columns_rows_and_zero_copy_slices(self):
+        from aitrader.series import CandleSeries
+        items = [_fake_execution(i, 7) for i in range(600, 0, -1)]
+        candles = list(_build_candles_1m(items))
+        series = CandleSeries.from_candles(candles)
+        self.assertEqual(len(series), len(candles))
+        self.assertEqual(list(series), candles)  # 行は従来の Candle と同じ
+        self.assertEqual(series[-1], candles[-1])
+
+        window = series[-30:]
+        self.assertIs(window.close.obj, series.close.obj)  # スライスはコピーしない
+        self.assertEqual(list(window), candles[-30:])
+        self.assertEqual(list(window.close), [c.close for c in candles[-30:]])
+        self.assertEqual(window.times[0] % 60, 0)
+
+        closes = [c.close for c in candles]
+        self.assertEqual(_sma(series.close, 10), _sma(closes, 10))
+        self.assertEqual(_rsi(series.close, 14), _rsi(closes, 14))
+        self.assertEqual(_macd(series.close), _macd(closes))
+        self.assertEqual(_atr(series, 14), _atr(candles, 14))
+        self.assertEqual(_adx(series, 14), _adx(candles, 14))
+        self.assertEqual(_vwap(series), _vwap(candles))
+
+    def test_hourly_series_from_store(self):
+        store = HistoryStore(":memory:")
+        store.upsert_candles("BTC_JPY", [
+            Candle(time=f"2026-07-01T{h:02d}:{m:02d}:00Z", open=100.0 + m,
+                   high=200.0 + m, low=50.0 + m, close=150.0 + m, volume=1.0)
+            for h in range(3) for m in range(0, 60, 2)])
+        hourly = store.hourly_candles("BTC_JPY", hours=2)
+        self.assertEqual([c.time for c in hourly], ["2026-07-01T01", "2026-07-01T02"])
+        self.assertEqual(hourly[0], HourCandle(time="2026-07-01T01", open=100.0,
+                                               high=258.0, low=50.0, close=208.0,
+                                               volume=30.0, minutes=30))
+        self.assertEqual(list(hourly.minutes), [30, 30])
+        self.assertEqual(_atr(hourly, 14), _atr(list(hourly), 14))
+        store.close()
+
+
+class TestStreamingIndicators(unittest.TestCase):
+    def test_matches_batch_and_survives_serialization(self):
+        from aitrader.streaming import IndicatorSet
+        candles = TestNumpyIndicators._random_candles(200, seed=3)
+        closes = [c.close for c in candles]
+        live = IndicatorSet()
+        for i, c in enumerate(candles[:120]):
+            c.time = f"{i:05d}"
+            live.update(c)
+        restored = IndicatorSet.from_json(live.to_json())
+        for i, c in enumerate(candles[120:], 120):
+            c.time = f"{i:05d}"
+            live.update(c)
+            restored.update(c)
+            self.assertFalse(restored.update(c))  # 投入済みの足は無視
+        values = live.values()
+        self.assertEqual(restored.values(), values)
+        self.assertEqual(values["bars"], 200)
+        self.assertAlmostEqual(values["sma_24"], _sma(closes, 24), places=6)
+        self.assertAlmostEqual(values["ema_8"], _ema(closes, 8), places=6)
+        for got, want in zip(values["bollinger_20"], _bollinger(closes, 20)):
+            self.assertAlmostEqual(got, want, places=4)
+        for got, want in zip(values["macd"], _macd(closes)):
+            self.assertAlmostEqual(got, want, places=6)
+
+        # Wilder RSI: 最初の14本の単純平均を種にした平滑
+        diffs = [b - a for a, b in zip(closes[:-1], closes[1:])]
+        gain = sum(max(d, 0.0) for d in diffs[:14]) / 14
+        loss = sum(max(-d, 0.0) for d in diffs[:14]) / 14
+        for d in diffs[14:]:
+            gain = (gain * 13 + max(d, 0.0)) / 14
+            loss = (loss * 13 + max(-d, 0.0)) / 14
+        self.assertAlmostEqual(values["rsi_14"], 100 - 100 / (1 + gain / loss), places=9)
+        self.assertGreater(values["atr_14"], 0)
+        self.assertTrue(0 <= values["adx_14"] <= 100)
+
+    def test_feeds_only_newly_closed_candles_from_store(self):
+        from aitrader.streaming import update_indicators
+        store = HistoryStore(":memory:")
+
+        def add_hours(start, count):
+            store.upsert_candles("BTC_JPY", [
+                Candle(time=f"2026-07-01T{h:02d}:{m:02d}:00Z", open=100.0 + h,
+                       high=101.0 + h + m / 60, low=99.0 + h, close=100.5 + h,
+                       volume=1.0)
+                for h in range(start, start + count) for m in range(60)])
+
+        add_hours(0, 20)
+        values = update_indicators(store, "BTC_JPY", "1h")
+        self.assertEqual(values["bars"], 19)  # 最新のhourは未確定
+        self.assertEqual(values["last_time"], "2026-07-01T18")
+        self.assertIsNotNone(values["rsi_14"])
+        self.assertEqual(update_indicators(store, "BTC_JPY", "1h"), values)
+
+        add_hours(20, 2)
+        later = update_indicators(store, "BTC_JPY", "1h")
+        self.assertEqual((later["bars"], later["last_time"]), (21, "2026-07-01T20"))
+        minutes = update_indicators(store, "BTC_JPY", "1m")
+        self.assertEqual(minutes["bars"], 22 * 60 - 1)
+        self.assertIsNotNone(store.load_indicator_state("BTC_JPY", "1m"))
+        store.close()
+
+
+class TestExecutionWindow(unittest.TestCase):
+    def test_pages_back_until_horizon_covered(self):
+        from aitrader.market import _fetch_executions
+        api, calls = _fake_public_api(seconds_per_exec=1)  # 500約定 ≒ 8分
+        executions, pages, coverage = _fetch_executions(
+            api, "BTC_JPY", horizon_min=30, max_pages=20, page_size=500)
+        self.assertEqual(pages, 4)
+        self.assertGreaterEqual(coverage, 29.9)
+        self.assertLess(coverage, 30.1)
+        ids = [ex.id for ex in executions]
+        self.assertEqual(ids, sorted(set(ids), reverse=True))  # 重複・欠番なし
+        self.assertEqual(len(_build_candles_1m(executions)), 31)
+
+    def test_page_budget_caps_requests(self):
+        from aitrader.market import _fetch_executions
+        api, calls = _fake_public_api(seconds_per_exec=1)
+        executions, pages, coverage = _fetch_executions(
+            api, "BTC_JPY", horizon_min=60, max_pages=2, page_size=500)
+        self.assertEqual(pages, 2)
+        self.assertEqual(len(executions), 1000)
+        self.assertLess(coverage, 60)
+
+    def test_single_page_when_market_is_quiet(self):
+        from aitrader.market import _fetch_executions
+        api, calls = _fake_public_api(seconds_per_exec=60)
+        executions, pages, coverage = _fetch_executions(
+            api, "BTC_JPY", horizon_min=65, page_size=500)
+        self.assertEqual(pages, 1)
+        self.assertGreater(coverage, 65)
+
+
+class TestSnapshotFanOut(unittest.TestCase):
+    def test_legs_run_concurrently_and_are_timed(self):
+        import time
+        from unittest.mock import patch
+        from aitrader import macro
+        from aitrader.market import fetch_market_snapshot
+        api, _calls = _fake_public_api(n=600)
+
+        def slow(fn):
+            def wrapper(*args, **kwargs):
+                time.sleep(0.2)
+                return fn(*args, **kwargs)
+            return wrapper
+        for name in ("ticker", "getboardstate", "board"):
+            setattr(api, name, slow(getattr(api, name)))
+        sources = tuple(slow(lambda out, transport=None, key=key: out.update({key: 1.0}))
+                        for key in ("btc_dominance", "usdjpy", "nasdaq"))
+        with patch.multiple(macro, _coingecko_global=sources[0],
+                            _fetch_usdjpy=sources[1], _fetch_nasdaq=sources[2]):
+            start = time.perf_counter()
+            snap = fetch_market_snapshot("BTC_JPY", api=api)
+            elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 0.6)  # 逐次なら6回分(1.2秒)
+        self.assertEqual(snap.macro, {"btc_dominance": 1.0, "usdjpy": 1.0,
+                                      "nasdaq": 1.0})
+        self.assertEqual(snap.board_state, "RUNNING")
+        self.assertEqual(set(snap.leg_ms),
+                         {"ticker", "executions", "boardstate", "board", "macro"})
+        self.assertGreaterEqual(snap.leg_ms["ticker"], 200)
+
+    def test_optional_leg_timeout_and_failure_fall_back(self):
+        import threading
+        from unittest.mock import patch
+        from aitrader import market
+        api, _calls = _fake_public_api(n=600)
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def hang(**kw):
+            release.wait(5)
+            return {"state": "RUNNING", "health": "NORMAL"}
+
+        def broken(**kw):
+            raise IOError("board down")
+        api.getboardstate = hang
+        api.board = broken
+        with patch.dict(market.LEG_TIMEOUTS, boardstate=0.1):
+            snap = market.fetch_market_snapshot("BTC_JPY", api=api,
+                                                include_macro=False)
+        self.assertEqual((snap.board_state, snap.health), ("UNKNOWN", "UNKNOWN"))
+        self.assertEqual((snap.bid_depth, snap.ask_depth), (0.0, 0.0))
+        self.assertIsNone(snap.macro)
+        self.assertLess(snap.leg_ms["boardstate"], 1000)
+
+        # 4xxのエラー応答(JSON)は例外にならずに返る。0円のスナップショットにしない
+        api.getboardstate = lambda **kw: {"state": "RUNNING", "health": "NORMAL"}
+        api.ticker = lambda **kw: {"status": -1, "error_message": "x"}
+        with self.assertRaises(KeyError):
+            market.fetch_market_snapshot("BTC_JPY", api=api, include_macro=False)
+
+        api.ticker = hang  # ティッカーは必須
+        with patch.dict(market.LEG_TIMEOUTS, ticker=0.1):
+            with self.assertRaises(TimeoutError):
+                market.fetch_market_snapshot("BTC_JPY", api=api, include_macro=False)
+
+
+class TestIncrementalIngest(unittest.TestCase):
+    def test_second_cycle_fetches_only_new_and_merges_exactly(self):
+        from aitrader.market import fetch_market_snapshot
+        items = [_fake_execution(i) for i in range(1000, 0, -1)]
+        api, calls = _fake_public_api(items=items)
+        store = HistoryStore(":memory:")
+        fetch_market_snapshot("BTC_JPY", store=store, include_macro=False, api=api)
+        self.assertEqual(store.last_exec_id("BTC_JPY"), 1000)
+
+        # 2サイクル目までに約定が1200件増えた(1ページ500件 → 3ページ)
+        items[:0] = [_fake_execution(i) for i in range(2200, 1000, -1)]
+        calls.clear()
+        snap = fetch_market_snapshot("BTC_JPY", store=store,
+                                     include_macro=False, api=api)
+        self.assertEqual(store.last_exec_id("BTC_JPY"), 2200)
+        self.assertTrue(all(c["after"] == 1000 for c in calls))
+        self.assertEqual(snap.exec_count, 1200)
+
+        # 全約定から一括で作った1分足と完全一致する(境界の分も含めて)
+        expected = _build_candles_1m(items[:65 * 10 + 10])
+        by_minute = {c.time: c for c in expected}
+        for c in snap.candles_1m:
+            e = by_minute[c.time]
+            self.assertEqual((c.open, c.high, c.low, c.close),
+                             (e.open, e.high, e.low, e.close))
+            self.assertAlmostEqual(c.volume, e.volume)
+            self.assertAlmostEqual(c.buy_volume, e.buy_volume)
+        # 最新足(約定1件のみ)を含む直近15本 = id 2060 以降
+        buy = sum(ex["size"] for ex in items
+                  if ex["id"] >= 2060 and ex["side"] == "BUY")
+        self.assertAlmostEqual(snap.taker_buy_15m, buy)
+        store.close()
+
+    def test_merge_keeps_open_and_adds_volume(self):
+        store = HistoryStore(":memory:")
+        store.upsert_candles("BTC_JPY", [Candle("2026-07-07T10:00:00Z",
+                                                100, 110, 95, 105, 1.0, 0.6, 0.4)],
+                             last_exec_id=10)
+        store.merge_candles("BTC_JPY", [Candle("2026-07-07T10:00:00Z",
+                                               106, 120, 101, 90, 0.5, 0.5, 0.0)],
+                            last_exec_id=12)
+        row = store.minute_candles("BTC_JPY")[0]
+        self.assertEqual(row, ("2026-07-07T10:00", 100, 120, 95, 90, 1.5, 1.1, 0.4))
+        self.assertEqual(store.last_exec_id("BTC_JPY"), 12)
+        store.close()
+
 
 class TestViews(unittest.TestCase):
     def _snap(self):
@@ -442,6 +843,466 @@ class TestHistoryStore(unittest.TestCase):
         store.close()
 
 
+class TestAgainstMockServer(unittest.TestCase):
+    def test_snapshot_cycles_against_local_mock(self):
+        from bitflyerapi import bitFlyerAPI
+        from bitflyerapi.mockserver import MockBitFlyer
+        from aitrader.market import fetch_market_snapshot
+        with MockBitFlyer(products=("ETH_JPY",), tick_interval=None) as mock:
+            config = Config()
+            config.bitflyer_url = mock.url + "/"
+            config.rate_limit = False
+            store = HistoryStore(":memory:")
+            with bitFlyerAPI(key="", secret="", **config.bitflyer_options()) as api:
+                first = fetch_market_snapshot("ETH_JPY", store=store,
+                                              include_macro=False, api=api)
+                mock.advance(40)
+                second = fetch_market_snapshot("ETH_JPY", store=store,
+                                               include_macro=False, api=api)
+            store.close()
+        self.assertEqual(first.exec_count, 200)
+        self.assertEqual(second.exec_count, 40)  # カーソル以降だけ取得
+        self.assertGreater(second.bid_depth, 0)
+        self.assertEqual(second.board_state, "RUNNING")
+
+
+class TestProtectiveOrders(unittest.TestCase):
+    def _setup(self, mock, **overrides):
+        import tempfile
+        from aitrader.protect import ProtectiveOrders
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        config = Config()
+        config.bitflyer_key, config.bitflyer_secret = mock.key, mock.secret
+        config.bitflyer_url = mock.url
+        config.rate_limit = False
+        config.dry_run = False
+        config.protective_stop = True
+        config.order_size_btc = 0.1
+        config.max_position_btc = 1.0
+        for name, value in overrides.items():
+            setattr(config, name, value)
+        trader = Trader(config)
+        self.addCleanup(trader.api.close)
+        book = PaperBook(path=os.path.join(tmp.name, "t.db"), order_size=0.1,
+                         max_position=1.0)
+        self.addCleanup(book.close)
+        return config, trader, book, ProtectiveOrders(config, trader, book.conn)
+
+    def _buy(self, mock, trader, book, ts):
+        bid, ask = mock.markets["BTC_JPY"].best()
+        snapshot = _snapshot_for_paper(ts=ts, ltp=(bid + ask) / 2)
+        book.record_cycle(snapshot, _council_decision(
+            [(i, "BUY", 0.9) for i in range(5)]))
+        trader.execute("BUY")
+        return snapshot
+
+    def test_stop_follows_position_and_closes_ledger_on_fill(self):
+        from bitflyerapi.mockserver import MockBitFlyer
+        with MockBitFlyer(tick_interval=None,
+                          balances={"JPY": 1e7, "BTC": 0.0}) as mock:
+            config, trader, book, protection = self._setup(mock, trade_cooldown_sec=0)
+            self._buy(mock, trader, book, "2026-07-07T10:00:00+00:00")
+            self.assertEqual(protection.refresh(book.council_state()), "発注")
+            first = protection.current()
+            self.assertEqual(first["order_method"], "SIMPLE")
+            self.assertAlmostEqual(first["size"], 0.1)
+            avg_cost = book.council_state()["avg_cost"]
+            self.assertAlmostEqual(first["stop_price"], round(avg_cost * 0.98), delta=1)
+            # 変化なしなら置き直さない
+            self.assertEqual(protection.refresh(book.council_state()), "")
+
+            # 買い増し → 取り消して全量で置き直す
+            self._buy(mock, trader, book, "2026-07-07T11:00:00+00:00")
+            self.assertEqual(protection.refresh(book.council_state()), "発注")
+            second = protection.current()
+            self.assertAlmostEqual(second["size"], 0.2)
+            states = {p["parent_order_acceptance_id"]: p["parent_order_state"]
+                      for p in mock.parent_orders}
+            self.assertEqual(states[first["acceptance_id"]], "CANCELED")
+            self.assertEqual(states[second["acceptance_id"]], "ACTIVE")
+
+            # 急落 → 取引所側で約定 → 台帳をクローズ
+            mock.markets["BTC_JPY"].price *= 0.9
+            mock.advance(1)
+            crash = _snapshot_for_paper(ts="2026-07-07T11:10:00+00:00",
+                                        ltp=mock.markets["BTC_JPY"].price)
+            filled = protection.sync(book, crash)
+            self.assertAlmostEqual(filled["size"], 0.2)
+            self.assertIsNone(protection.current())
+            self.assertEqual(book.council_state()["position"], 0.0)
+            served_by = book.conn.execute(
+                "SELECT served_by FROM council_log WHERE ts = ?",  # 検知したサイクルの1秒前
+                ("2026-07-07T11:09:59+00:00",)).fetchone()[0]
+            self.assertEqual(served_by, "protect")
+            self.assertAlmostEqual(mock.balances["BTC"], 0.0)
+
+    def test_oco_and_cancel_when_flat(self):
+        from bitflyerapi.mockserver import MockBitFlyer
+        with MockBitFlyer(tick_interval=None,
+                          balances={"JPY": 1e7, "BTC": 0.0}) as mock:
+            config, trader, book, protection = self._setup(mock, take_profit_pct=3.0)
+            self._buy(mock, trader, book, "2026-07-07T10:00:00+00:00")
+            protection.refresh(book.council_state())
+            self.assertEqual(protection.current()["order_method"], "OCO")
+            self.assertEqual(protection.refresh({"position": 0.0, "avg_cost": 0.0}),
+                             "取消")
+            self.assertIsNone(protection.current())
+            self.assertEqual(mock.parent_orders[0]["parent_order_state"], "CANCELED")
+
+    def test_rejected_cancel_books_the_fill(self):
+        from bitflyerapi.mockserver import MockBitFlyer
+        with MockBitFlyer(tick_interval=None,
+                          balances={"JPY": 1e7, "BTC": 0.0}) as mock:
+            config, trader, book, protection = self._setup(mock)
+            self._buy(mock, trader, book, "2026-07-07T10:00:00+00:00")
+            protection.refresh(book.council_state())
+            mock.markets["BTC_JPY"].price *= 0.9
+            mock.advance(1)  # ストップが取引所側で約定
+            # 約定済みの注文の取消はエラー応答で拒否される
+            trader.api.cancelparentorder = lambda **params: {
+                "status": -111, "error_message": "Order not found"}
+            crash = _snapshot_for_paper(ts="2026-07-07T10:10:00+00:00",
+                                        ltp=mock.markets["BTC_JPY"].price)
+            self.assertFalse(protection.cancel(book, crash))
+            self.assertIsNone(protection.current())
+            self.assertEqual(book.council_state()["position"], 0.0)
+            served_by = book.conn.execute(
+                "SELECT served_by FROM council_log WHERE ts = ?",
+                ("2026-07-07T10:09:59+00:00",)).fetchone()[0]
+            self.assertEqual(served_by, "protect")
+
+    def test_fill_survives_cycle_record_and_partial_fill_closes_part(self):
+        from bitflyerapi.mockserver import MockBitFlyer
+        with MockBitFlyer(tick_interval=None,
+                          balances={"JPY": 1e7, "BTC": 0.0}) as mock:
+            config, trader, book, protection = self._setup(mock)
+            self._buy(mock, trader, book, "2026-07-07T10:00:00+00:00")
+            # 台帳だけ買い増し(実残高は0.1のまま)→ 保護注文は0.1に切り詰め
+            book.record_cycle(_snapshot_for_paper(ts="2026-07-07T10:30:00+00:00",
+                                                  ltp=mock.markets["BTC_JPY"].price),
+                              _council_decision([(i, "BUY", 0.9) for i in range(5)]))
+            self.assertAlmostEqual(book.council_state()["position"], 0.2)
+            protection.refresh(book.council_state())
+            self.assertAlmostEqual(protection.current()["size"], 0.1)
+
+            mock.markets["BTC_JPY"].price *= 0.9
+            mock.advance(1)
+            crash = _snapshot_for_paper(ts="2026-07-07T11:00:00+00:00",
+                                        ltp=mock.markets["BTC_JPY"].price)
+            filled = protection.sync(book, crash)
+            self.assertAlmostEqual(filled["size"], 0.1)
+            self.assertAlmostEqual(book.council_state()["position"], 0.1)
+
+            # 同じサイクルの協議結果の記録で約定が上書きされない
+            book.record_cycle(crash, _council_decision(
+                [(i, "HOLD", 0.5) for i in range(5)]))
+            rows = book.conn.execute("""
+                SELECT ts, vote, size, position FROM paper_ledger
+                WHERE actor = 'council' AND ts >= '2026-07-07T10:59'
+                ORDER BY ts""").fetchall()
+            self.assertEqual([r[:2] for r in rows],
+                             [("2026-07-07T10:59:59+00:00", "SELL"),
+                              ("2026-07-07T11:00:00+00:00", "HOLD")])
+            self.assertAlmostEqual(rows[1][3], 0.1)
+            served = [r[0] for r in book.conn.execute(
+                "SELECT served_by FROM council_log WHERE actor = 'council'")]
+            self.assertIn("protect", served)
+
+    def test_rejected_cancel_without_snapshot_keeps_record(self):
+        from bitflyerapi.mockserver import MockBitFlyer
+        with MockBitFlyer(tick_interval=None,
+                          balances={"JPY": 1e7, "BTC": 0.0}) as mock:
+            config, trader, book, protection = self._setup(mock)
+            self._buy(mock, trader, book, "2026-07-07T10:00:00+00:00")
+            protection.refresh(book.council_state())
+            trader.api.cancelparentorder = lambda **params: {"status": -111}
+            self.assertEqual(protection.refresh({"position": 0.0}), "")
+            self.assertIsNotNone(protection.current())  # 次の sync で確認する
+
+    def test_replace_reads_fresh_balance_after_cancel(self):
+        from bitflyerapi.mockserver import MockBitFlyer
+        from aitrader.account import AccountSync
+        with MockBitFlyer(tick_interval=None,
+                          balances={"JPY": 1e7, "BTC": 0.0}) as mock:
+            config, trader, book, protection = self._setup(mock)
+            trader.account = AccountSync.from_config(config, trader.api, book.conn)
+            self._buy(mock, trader, book, "2026-07-07T10:00:00+00:00")
+            protection.refresh(book.council_state())
+            # サイクル冒頭の同期では旧注文が BTC を拘束していた
+            trader.account.sync()
+            book.conn.execute("UPDATE account_balances SET available = 0")
+            state = dict(book.council_state(), avg_cost=book.council_state()["avg_cost"] * 1.01)
+            self.assertEqual(protection.refresh(state), "発注")
+            self.assertAlmostEqual(protection.current()["size"], 0.1)
+
+    def test_stop_loss_sells_even_if_cancel_fails(self):
+        from bitflyerapi.exception import ServerException
+        from bitflyerapi.mockserver import MockBitFlyer
+        from aitrader.bot import execute_stop_loss
+        with MockBitFlyer(tick_interval=None,
+                          balances={"JPY": 1e7, "BTC": 0.0}) as mock:
+            config, trader, book, protection = self._setup(mock)
+            self._buy(mock, trader, book, "2026-07-07T10:00:00+00:00")
+            protection.refresh(book.council_state())
+            cancel = trader.api.cancelparentorder
+
+            def cancel_then_fail(**params):
+                cancel(**params)  # 取消は処理されたが応答が5xx
+                raise ServerException("server error (HTTP 502)", 502, "")
+            trader.api.cancelparentorder = cancel_then_fail
+            snap = _snapshot_for_paper(ts="2026-07-07T11:00:00+00:00")
+            with self.assertLogs("aitrader.bot", "ERROR"):
+                result = execute_stop_loss(config, trader, book, protection, snap,
+                                           "ルール損切り: テスト")
+            self.assertTrue(result["executed"])
+            self.assertAlmostEqual(mock.balances["BTC"], 0.0)
+            self.assertEqual(book.council_state()["position"], 0.0)
+
+    def test_stop_loss_keeps_ledger_when_sell_fails(self):
+        from bitflyerapi.mockserver import MockBitFlyer
+        from aitrader.bot import execute_stop_loss
+        with MockBitFlyer(tick_interval=None,
+                          balances={"JPY": 1e7, "BTC": 0.0}) as mock:
+            config, trader, book, protection = self._setup(mock)
+            self._buy(mock, trader, book, "2026-07-07T10:00:00+00:00")
+            trader.api.sendchildorder = lambda **params: {"status": -200}
+            snap = _snapshot_for_paper(ts="2026-07-07T11:00:00+00:00")
+            with self.assertLogs("aitrader.trader", "ERROR"):
+                result = execute_stop_loss(config, trader, book, None, snap,
+                                           "ルール損切り: テスト")
+            self.assertFalse(result["executed"])
+            self.assertAlmostEqual(book.council_state()["position"], 0.1)
+
+    def test_dry_run_places_nothing(self):
+        from aitrader.protect import ProtectiveOrders
+        config = Config()
+        config.dry_run = True
+        config.protective_stop = True
+        book = PaperBook(path=":memory:")
+        protection = ProtectiveOrders(config, Trader(config), book.conn)
+        self.assertTrue(protection.enabled)
+        self.assertEqual(protection.refresh({"position": 0.001, "avg_cost": 1e7}), "")
+        self.assertIsNone(protection.current())
+        book.close()
+
+
+class TestAccountSync(unittest.TestCase):
+    def test_incremental_sync_and_local_balances(self):
+        from bitflyerapi.mockserver import MockBitFlyer
+        from aitrader.account import AccountSync, reconcile
+        from aitrader.dashboard import generate_html
+        with MockBitFlyer(tick_interval=None,
+                          balances={"JPY": 1e7, "BTC": 0.0}) as mock:
+            config = Config()
+            config.bitflyer_key, config.bitflyer_secret = mock.key, mock.secret
+            config.bitflyer_url = mock.url
+            config.rate_limit = False
+            config.dry_run = False
+            config.trade_cooldown_sec = 0
+            config.order_size_btc = 0.1
+            config.max_position_btc = 1.0
+            trader = Trader(config)
+            self.addCleanup(trader.api.close)
+            book = PaperBook(path=":memory:")
+            self.addCleanup(book.close)
+            account = AccountSync.from_config(config, trader.api, book.conn)
+            trader.account = account
+
+            trader.execute("BUY")
+            trader.execute("BUY")
+            resting = trader.api.sendchildorder(
+                product_code="BTC_JPY", child_order_type="LIMIT", side="BUY",
+                price=1000, size=0.01)
+            counts = account.sync()
+            self.assertEqual(counts["orders"], 3)
+            self.assertEqual(counts["executions"], 2)
+            self.assertEqual(counts["balance_history"], 4)  # JPY・BTC × 2約定
+
+            # 残高はローカルから読む(getbalance を呼ばない)
+            calls = mock.requests["/v1/me/getbalance"]
+            self.assertAlmostEqual(trader.get_balances()["BTC"], 0.2)
+            self.assertEqual(trader.check_risk("SELL"), "")
+            self.assertEqual(mock.requests["/v1/me/getbalance"], calls)
+
+            # 2回目は新しい分と ACTIVE だった注文だけを取り直す
+            trader.api.cancelchildorder(product_code="BTC_JPY", **resting)
+            trader.execute("SELL")  # 発注でローカル残高は無効化される
+            self.assertAlmostEqual(trader.get_balances()["BTC"], 0.1)
+            self.assertEqual(mock.requests["/v1/me/getbalance"], calls + 1)
+            counts = account.sync()
+            self.assertEqual(counts["orders"], 2)
+            self.assertEqual(counts["executions"], 1)
+            states = dict(book.conn.execute(
+                "SELECT acceptance_id, state FROM account_orders").fetchall())
+            self.assertEqual(states[resting["child_order_acceptance_id"]], "CANCELED")
+            self.assertEqual(account.sync()["executions"], 0)
+
+            state = reconcile(book.conn, "BTC_JPY", "BTC")
+            self.assertAlmostEqual(state["real_position"], 0.1)
+            self.assertEqual(state["fills"], 3)
+            self.assertAlmostEqual(state["diff"], 0.1)  # 台帳は空
+            self.assertIn("実口座(同期済み)", generate_html(book.conn, config))
+
+    def test_sync_skipped_while_fresh_and_trade_path_reads_locally(self):
+        from bitflyerapi.mockserver import MockBitFlyer
+        from aitrader.account import AccountSync
+        from aitrader.bot import sync_account
+        with MockBitFlyer(tick_interval=None,
+                          balances={"JPY": 1e7, "BTC": 0.5}) as mock:
+            config = Config()
+            config.bitflyer_key, config.bitflyer_secret = mock.key, mock.secret
+            config.bitflyer_url = mock.url
+            config.rate_limit = False
+            config.dry_run = False
+            trader = Trader(config)
+            self.addCleanup(trader.api.close)
+            book = PaperBook(path=":memory:")
+            self.addCleanup(book.close)
+
+            def private_calls():
+                return sum(n for path, n in mock.requests.items()
+                           if path.startswith("/v1/me/"))
+
+            # 売買サイクルは履歴を同期しない(残高参照の準備だけ)
+            sync_account(config, trader, book, history=False)
+            self.assertIsInstance(trader.account, AccountSync)
+            self.assertEqual(private_calls(), 0)
+
+            sync_account(config, trader, book)
+            first = private_calls()
+            self.assertGreaterEqual(first, 6)
+            sync_account(config, trader, book)  # account_max_age_sec 以内
+            self.assertEqual(private_calls(), first)
+            self.assertIsNone(trader.account.sync(max_age=60))
+            self.assertIsNotNone(trader.account.sync(max_age=0))
+
+            # 無効化後の残高は getbalance 1回で読み直し、以後はローカル
+            before = private_calls()
+            trader.account.invalidate()
+            self.assertAlmostEqual(trader.get_balances()["BTC"], 0.5)
+            self.assertAlmostEqual(trader.get_balances()["BTC"], 0.5)
+            self.assertEqual(private_calls(), before + 1)
+
+    def test_reconcile_before_first_sync(self):
+        import sqlite3
+        from aitrader.account import reconcile
+        self.assertIsNone(reconcile(sqlite3.connect(":memory:"), "BTC_JPY", "BTC"))
+
+
+class TestBackfill(unittest.TestCase):
+    def test_parallel_ranges_match_sequential_candles(self):
+        from datetime import datetime, timedelta
+        from bitflyerapi import bitFlyerAPI
+        from bitflyerapi.mockserver import MockBitFlyer
+        from aitrader.backfill import backfill
+        from aitrader.market import _build_candles_1m
+
+        # 3日分・20秒ごとの約定(IDは他銘柄と共有の連番なので飛び飛び)
+        start = datetime(2026, 7, 1)
+        rows = [{"id": 1000 + i * 7, "side": "BUY" if i % 3 else "SELL",
+                 "price": 10000000.0 + (i % 50) * 100, "size": 0.01,
+                 "exec_date": (start + timedelta(seconds=20 * i)).isoformat(
+                     timespec="milliseconds")}
+                for i in range(3 * 4320)]
+        with MockBitFlyer(tick_interval=None, recorded={"BTC_JPY": rows}) as mock:
+            mock.advance(len(rows) - 200)  # 起動時に200件出ている
+            config = Config()
+            config.bitflyer_url = mock.url
+            config.rate_limit = False
+            store = HistoryStore(":memory:")
+            with bitFlyerAPI(key="", secret="", **config.bitflyer_options()) as api:
+                result = backfill(config, 2, workers=3, api=api, store=store,
+                                  page_size=500)
+
+        newest_ms = records_epoch(rows[-1]["exec_date"])
+        expected = [r for r in rows
+                    if records_epoch(r["exec_date"]) >= newest_ms - 2 * 86400000]
+        self.assertLessEqual(result["probes"], 20)
+        self.assertGreaterEqual(result["executions"], len(expected))
+        self.assertLessEqual(result["executions"], len(expected) + 3)  # 境目は1分以内
+        self.assertEqual(store.last_exec_id("BTC_JPY"), rows[-1]["id"])
+
+        stored = store.minute_candles("BTC_JPY", 10000)
+        self.assertGreaterEqual(len(stored), 2 * 1440)
+        reference = {c.time[:16]: c for c in _build_candles_1m(rows[::-1])}
+        for minute, o, h, l, c, v, b, sv in stored[1:]:  # 先頭の分は途中から
+            ref = reference[minute]
+            self.assertEqual((o, h, l, c), (ref.open, ref.high, ref.low, ref.close))
+            self.assertAlmostEqual(v, ref.volume)
+            self.assertAlmostEqual(b, ref.buy_volume)
+            self.assertAlmostEqual(sv, ref.sell_volume)
+        self.assertGreaterEqual(store.coverage_hours("BTC_JPY"), 48)
+        store.close()
+
+    def test_cli_rejects_non_positive_days(self):
+        import contextlib
+        import io
+        from unittest.mock import patch
+        from aitrader import __main__ as cli
+        for argv in (["--backfill", "0"], ["--backfill", "-3"],
+                     ["--backfill", "1", "--workers", "0"]):
+            with patch.object(sys, "argv", ["aitrader"] + argv), \
+                    patch.object(cli, "backfill") as run_backfill, \
+                    patch.object(cli, "run_loop") as run_loop, \
+                    contextlib.redirect_stderr(io.StringIO()):
+                with self.assertRaises(SystemExit):
+                    cli.main()
+            run_backfill.assert_not_called()
+            run_loop.assert_not_called()  # 売買ループに落ちない
+
+
+def records_epoch(timestamp):
+    from bitflyerapi.records import epoch_ms
+    return epoch_ms(timestamp)
+
+
+class TestTickStore(unittest.TestCase):
+    def test_append_and_range_query(self):
+        import json
+        from bitflyerapi.records import epoch_ms
+        store = HistoryStore(":memory:")
+        store.TICK_CHUNK = 400  # 塊の境界をまたぐ検索も確認する
+        executions = [_fake_execution(i) for i in range(1000, 0, -1)]
+        self.assertEqual(store.append_ticks("BTC_JPY", executions), 1000)
+        # 重複分は追記されない(追記専用)
+        self.assertEqual(store.append_ticks("BTC_JPY", executions[:10]), 0)
+
+        all_ticks = store.ticks("BTC_JPY")
+        self.assertEqual(list(all_ticks["id"]), list(range(1, 1001)))
+        self.assertEqual(all_ticks["side"][:2], b"BS")
+        self.assertEqual(all_ticks["price"][9], executions[-10]["price"])
+
+        lo = epoch_ms(_fake_execution(350)["exec_date"])
+        hi = epoch_ms(_fake_execution(450)["exec_date"])
+        window = store.ticks("BTC_JPY", lo, hi)
+        self.assertEqual(list(window["id"]), list(range(350, 450)))
+        self.assertEqual(len(window["size"]), 100)
+
+        blob_bytes = store.conn.execute(
+            "SELECT SUM(LENGTH(data)) FROM ticks").fetchone()[0]
+        self.assertLess(blob_bytes * 4, len(json.dumps(executions)))
+        store.close()
+
+    def test_retention_prunes_old_chunks(self):
+        executions = [_fake_execution(i, seconds_per_exec=600)
+                      for i in range(1000, 0, -1)]  # 10分間隔で約7日分
+        store = HistoryStore(":memory:", tick_retention_days=1)
+        store.TICK_CHUNK = 100
+        store.append_ticks("BTC_JPY", executions[500:])
+        self.assertEqual(store.ticks("BTC_JPY")["id"][0], 301)
+        store.append_ticks("BTC_JPY", executions)
+        # 最新から1日(144件)より古い塊は削除、境目をまたぐ塊(801〜900)は残る
+        self.assertEqual(list(store.ticks("BTC_JPY")["id"]), list(range(801, 1001)))
+        self.assertEqual(store.last_tick_id("BTC_JPY"), 1000)
+        store.close()
+
+        unlimited = HistoryStore(":memory:", tick_retention_days=0)
+        unlimited.append_ticks("BTC_JPY", executions)
+        self.assertEqual(len(unlimited.ticks("BTC_JPY")["id"]), 1000)
+        unlimited.close()
+
+
 class TestSnapshotPrompt(unittest.TestCase):
     def _snapshot(self, **overrides):
         snap = MarketSnapshot(
@@ -595,6 +1456,24 @@ class TestMacro(unittest.TestCase):
         self.assertAlmostEqual(out["usdjpy"], 155.54)
         self.assertAlmostEqual(out["usdjpy_change_pct"], 1.0)
 
+    def test_macro_through_replay_transport(self):
+        import tempfile
+        from bitflyerapi.transport import RecordingTransport, ReplayTransport, Response
+        from aitrader import macro
+
+        class Canned:  # 記録時のネットワーク代わり
+            def send(self, method, url, **kw):
+                if "coingecko" in url:
+                    return Response(200, b'{"data": {"market_cap_percentage": {"btc": 56.8}}}')
+                return Response(503, b"down", url=url)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "macro.jsonl.gz")
+            recorded = macro.fetch_macro(transport=RecordingTransport(path, Canned()))
+            replayed = macro.fetch_macro(transport=ReplayTransport(path))
+        self.assertEqual(recorded, {"btc_dominance": 56.8,
+                                    "crypto_mcap_change_24h": 0.0})
+        self.assertEqual(replayed, recorded)
+
     def test_all_sources_down_returns_partial(self):
         def fake_get(url, **kw):
             raise IOError("network down")
@@ -0,0 +1,1033 @@
+# -*- coding: utf-8 -*-
+"""bitflyerapi クライアントのオフラインテスト(ローカルHTTPサーバー相手)。
+
+実行: python -m pytest tests/ または python tests/test_bitflyerapi.py
+"""
+
+import json
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bitflyerapi import AsyncBitFlyerAPI, bitFlyerAPI
+from bitflyerapi.exception import (APIException, AuthException,
+                                   DeadlineExceeded, RateLimitException,
+                                   ServerException)
+from bitflyerapi.ratelimit import SQLiteTokenBucket, TokenBucket
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        self.server.ports.add(self.client_address[1])
+        reply = self.server.reply(self)
+        status, headers = 200, {}
+        if isinstance(reply, _Raw):
+            status, headers, body = reply.status, reply.headers, reply.body
+        else:
+            body = json.dumps(reply).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class _Raw:
+    """JSON以外・200以外の応答をテストから返すための入れ物。"""
+
+    def __init__(self, status, body=b"", headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+class _LocalServer:
+    """テスト用の最小HTTPサーバー。reply(handler) の戻り値をJSONで返す。"""
+
+    def __init__(self, reply=None):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.paths = []
+        self.httpd.ports = set()
+        self.httpd.reply = reply or (lambda h: {"ok": True})
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05,),
+                         daemon=True).start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.httpd.server_address[1]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _client(server, **config):
+    api = bitFlyerAPI(key="", secret="", **config)
+    api.top = server.url
+    return api
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = _LocalServer()
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_connection_reused_across_calls(self):
+        with _client(self.server) as api:
+            for _ in range(5):
+                api.ticker(product_code="BTC_JPY")
+        self.assertEqual(len(self.server.httpd.paths), 5)
+        self.assertEqual(len(self.server.httpd.ports), 1)  # 同じ接続で5回
+
+    def test_close_drops_pool_and_reopens(self):
+        api = _client(self.server, pool_maxsize=2)
+        api.ticker(product_code="BTC_JPY")
+        api.close()
+        self.assertIsNone(api._session)
+        api.ticker(product_code="BTC_JPY")
+        self.assertEqual(len(self.server.httpd.ports), 2)
+        api.close()
+
+    def test_thread_pool_shares_one_session(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with _client(self.server, pool_maxsize=4) as api:
+            with ThreadPoolExecutor(max_workers=4) as ex:
+                results = list(ex.map(
+                    lambda _: api.board(product_code="BTC_JPY"), range(20)))
+            self.assertTrue(all(r == {"ok": True} for r in results))
+        self.assertLessEqual(len(self.server.httpd.ports), 4)
+
+
+
+def _scripted(*replies):
+    """呼ばれるたびに replies を順に返し、尽きたら最後の応答を返し続ける。"""
+    replies = list(replies)
+    return lambda h: replies.pop(0) if len(replies) > 1 else replies[0]
+
+
+class TestErrorHandling(unittest.TestCase):
+    def _serve(self, *replies):
+        self.server = _LocalServer(reply=_scripted(*replies))
+        self.addCleanup(self.server.close)
+        api = _client(self.server, backoff=0.001)
+        self.addCleanup(api.close)
+        return api
+
+    def test_get_retries_transient_5xx(self):
+        api = self._serve(_Raw(503, b"<html>maintenance</html>"),
+                          _Raw(502), {"ltp": 1})
+        self.assertEqual(api.ticker(product_code="BTC_JPY"), {"ltp": 1})
+        self.assertEqual(len(self.server.httpd.paths), 3)
+
+    def test_retries_are_bounded(self):
+        api = self._serve(_Raw(429, b"", {"Retry-After": "0"}))
+        api.max_retries = 2
+        with self.assertRaises(RateLimitException) as cm:
+            api.ticker(product_code="BTC_JPY")
+        self.assertEqual(cm.exception.status, 429)
+        self.assertEqual(cm.exception.retry_after, 0.0)
+        self.assertEqual(len(self.server.httpd.paths), 3)
+
+    def test_post_is_not_retried(self):
+        api = self._serve(_Raw(500, b"oops"))
+        api.key, api.secret = "k", "s"
+        with self.assertRaises(ServerException) as cm:
+            api.sendchildorder(product_code="BTC_JPY", child_order_type="MARKET",
+                               side="BUY", size=0.001)
+        self.assertEqual(cm.exception.body, "oops")
+        self.assertEqual(len(self.server.httpd.paths), 1)
+
+    def test_status_mapping(self):
+        api = self._serve(_Raw(401, b'{"status":-500}'))
+        with self.assertRaises(AuthException) as cm:
+            api.ticker(product_code="BTC_JPY")
+        self.assertEqual(cm.exception.status, 401)
+
+        api = self._serve(_Raw(200, b"<html>not json</html>"))
+        with self.assertRaises(APIException):
+            api.ticker(product_code="BTC_JPY")
+
+        # 注文エラー等の4xx JSONは従来どおりそのまま返す
+        api = self._serve(_Raw(400, b'{"status":-205,"error_message":"Margin amount is insufficient"}'))
+        self.assertEqual(api.ticker(product_code="BTC_JPY")["status"], -205)
+
+        api = self._serve(_Raw(200, b""))
+        self.assertIsNone(api.ticker(product_code="BTC_JPY"))
+
+    def test_deadline_bounds_total_latency(self):
+        import time
+        api = self._serve(_Raw(503))
+        api.backoff = api.backoff_max = 5.0
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded) as cm:
+            api.request("/v1/ticker", deadline=0.3)
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertIsInstance(cm.exception.__cause__, ServerException)
+
+    def test_connection_error_retried_then_raised(self):
+        import requests
+        import socket
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()  # 誰も listen していないポート
+        api = bitFlyerAPI(key="", secret="", max_retries=1, backoff=0.001)
+        api.top = "http://127.0.0.1:%d" % port
+        with self.assertRaises(requests.ConnectionError):
+            api.ticker(product_code="BTC_JPY")
+        api.close()
+
+
+
+class TestJsonDecoder(unittest.TestCase):
+    def test_get_loads(self):
+        from bitflyerapi.codec import available_decoders, get_loads
+        found = available_decoders()
+        self.assertIn("json", found)
+        self.assertIs(get_loads(), next(iter(found.values())))
+        self.assertIs(get_loads("json"), json.loads)
+        self.assertIs(get_loads(len), len)
+        with self.assertRaises(ValueError):
+            get_loads("no-such-json")
+
+    def test_client_decodes_bytes_with_configured_loads(self):
+        server = _LocalServer(reply=lambda h: {"ltp": 15000000.5})
+        seen = []
+
+        def loads(body):
+            seen.append(type(body))
+            return json.loads(body)
+        try:
+            with _client(server, json_loads=loads) as api:
+                self.assertEqual(api.ticker(product_code="BTC_JPY"),
+                                 {"ltp": 15000000.5})
+        finally:
+            server.close()
+        self.assertEqual(seen, [bytes])  # strを経由しない
+
+
+def _verify_signature(handler, secret="s"):
+    """サーバー側でACCESS-SIGNを検算し、(署名が正しいか, パス) を返す。"""
+    import hashlib
+    import hmac
+    body = handler.body.decode() if handler.command == "POST" else ""
+    text = handler.headers["ACCESS-TIMESTAMP"] + handler.command + handler.path + body
+    expected = hmac.new(secret.encode(), text.encode(), hashlib.sha256).hexdigest()
+    return {"ok": hmac.compare_digest(expected, handler.headers["ACCESS-SIGN"]),
+            "path": handler.path}
+
+
+class TestSigning(unittest.TestCase):
+    def setUp(self):
+        self.server = _LocalServer(reply=_verify_signature)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_concurrent_private_calls_use_own_signatures(self):
+        from concurrent.futures import ThreadPoolExecutor
+        api = bitFlyerAPI(key="k", secret="s", pool_maxsize=8)
+        api.top = self.server.url
+
+        def call(i):
+            if i % 3 == 0:
+                return api.sendchildorder(product_code="BTC_JPY", side="BUY",
+                                          child_order_type="LIMIT", price=i, size=0.01)
+            return api.getchildorders(product_code="BTC_JPY",
+                                      child_order_acceptance_id="JRF%d" % i)
+        with ThreadPoolExecutor(max_workers=8) as ex:
+            results = list(ex.map(call, range(60)))
+        api.close()
+        self.assertTrue(all(r["ok"] for r in results))
+        for i, r in enumerate(results):
+            if i % 3:
+                self.assertTrue(r["path"].endswith("child_order_acceptance_id=JRF%d" % i))
+        self.assertFalse(hasattr(api, "header"))
+
+    def test_signs_exact_query_and_follows_secret_change(self):
+        api = bitFlyerAPI(key="k", secret="old")
+        api.top = self.server.url
+        self.assertFalse(api.getbalance()["ok"])  # サーバーは secret="s" で検算
+        api.secret = "s"
+        r = api.getchildorders(product_code="BTC_JPY", child_order_state="ACTIVE",
+                               count=5)
+        self.assertTrue(r["ok"])
+        self.assertEqual(r["path"], "/v1/me/getchildorders?product_code=BTC_JPY"
+                                    "&child_order_state=ACTIVE&count=5")
+        api.close()
+
+
+class TestMetrics(unittest.TestCase):
+    def test_collector_counts_latency_retries_and_statuses(self):
+        import sqlite3
+        from bitflyerapi.metrics import MetricsCollector
+        server = _LocalServer(reply=_scripted(_Raw(503), {"ltp": 1}))
+        metrics = MetricsCollector()
+        seen = []
+
+        class Tracer:
+            def before_request(self, event):
+                seen.append((event.path, event.attempt))
+        try:
+            with _client(server, backoff=0.001,
+                         observers=[metrics, Tracer()]) as api:
+                api.ticker(product_code="BTC_JPY")
+                api.ticker(product_code="BTC_JPY")
+                api.getboardstate(product_code="BTC_JPY")
+        finally:
+            server.close()
+        self.assertEqual(seen[:2], [("/v1/ticker", 1), ("/v1/ticker", 2)])
+        ticker = metrics.stats()["/v1/ticker"]
+        self.assertEqual((ticker["count"], ticker["retries"], ticker["errors"]), (3, 1, 1))
+        self.assertEqual(ticker["statuses"], {503: 1, 200: 2})
+        self.assertEqual(ticker["bytes"], 2 * len(b'{"ltp": 1}'))
+        self.assertEqual(sum(ticker["histogram"]), 3)
+        self.assertGreater(ticker["max_ms"], 0)
+        self.assertIn("/v1/getboardstate", metrics.summary())
+
+        conn = sqlite3.connect(":memory:")
+        self.assertEqual(metrics.dump_sqlite(conn), 2)
+        self.assertEqual(metrics.stats(), {})  # 書き出したら区切り直す
+        row = conn.execute("SELECT count, retries, statuses FROM api_metrics "
+                           "WHERE path = '/v1/ticker'").fetchone()
+        self.assertEqual(row, (3, 1, '{"503": 1, "200": 2}'))
+
+    def test_failing_observer_does_not_break_requests(self):
+        server = _LocalServer()
+
+        class Broken:
+            def after_request(self, event):
+                raise RuntimeError("boom")
+        try:
+            with _client(server) as api:
+                api.add_observer(Broken())
+                with self.assertLogs("bitflyerapi.bitflyerapi", "ERROR"):
+                    self.assertEqual(api.ticker(product_code="BTC_JPY"), {"ok": True})
+        finally:
+            server.close()
+
+
+class TestCassette(unittest.TestCase):
+    def test_record_then_replay_offline(self):
+        import tempfile
+        from bitflyerapi.transport import RecordingTransport, ReplayTransport
+        server = _LocalServer(reply=_scripted(
+            {"ltp": 1}, {"ltp": 2}, _Raw(400, b'{"status":-205}')))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "c.jsonl.gz")
+            try:
+                with _client(server, transport=RecordingTransport(path)) as api:
+                    api.ticker(product_code="BTC_JPY")
+                    api.ticker(product_code="BTC_JPY")
+                    api.board(product_code="BTC_JPY")
+            finally:
+                server.close()  # 以降はネットワークなし
+
+            replay = ReplayTransport(path)
+            self.assertEqual(len(replay), 3)
+            api = bitFlyerAPI(key="", secret="", transport=replay)
+            api.top = server.url
+            # 同じリクエストは記録順に、尽きたら最後の応答を返し続ける
+            self.assertEqual([api.ticker(product_code="BTC_JPY")["ltp"]
+                              for _ in range(3)], [1, 2, 2])
+            self.assertEqual(api.board(product_code="BTC_JPY"), {"status": -205})
+            # クエリ違いは同じパスの応答で代用(strict なら CassetteMiss)
+            self.assertEqual(api.board(product_code="ETH_JPY"), {"status": -205})
+            from bitflyerapi.transport import CassetteMiss
+            with self.assertRaises(CassetteMiss):
+                api.executions(product_code="BTC_JPY")
+
+    def test_async_client_replays(self):
+        import asyncio
+        import tempfile
+        from bitflyerapi.transport import RecordingTransport, ReplayTransport, Response
+
+        class Canned:
+            threads = []
+
+            def send(self, method, url, **kw):
+                self.threads.append(threading.current_thread())
+                return Response(200, b'{"ltp": 3}', {"Content-Type": "application/json"})
+
+        async def run(transport):
+            async with AsyncBitFlyerAPI(key="", secret="", transport=transport) as api:
+                return await api.ticker(product_code="BTC_JPY")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "c.jsonl.gz")
+            self.assertEqual(asyncio.run(run(RecordingTransport(path, Canned()))), {"ltp": 3})
+            self.assertEqual(asyncio.run(run(ReplayTransport(path))), {"ltp": 3})
+        # recording does real I/O, so it must not run on the event loop thread
+        self.assertNotIn(threading.main_thread(), Canned.threads)
+
+
+class TestResponseCache(unittest.TestCase):
+    def _serve(self, *replies):
+        server = _LocalServer(reply=_scripted(*replies))
+        self.addCleanup(server.close)
+        return server
+
+    def test_ttl_per_endpoint_and_params(self):
+        from bitflyerapi.cache import TTLCache
+        server = self._serve({"state": "RUNNING"}, {"state": "CLOSED"})
+        api = _client(server, cache=TTLCache())
+        self.addCleanup(api.close)
+        for _ in range(3):
+            self.assertEqual(api.getboardstate(product_code="BTC_JPY"),
+                             {"state": "RUNNING"})
+        api.getboardstate(product_code="ETH_JPY")  # パラメータ違いは別エントリ
+        api.ticker(product_code="BTC_JPY")
+        api.ticker(product_code="BTC_JPY")         # TTL対象外は毎回取得
+        self.assertEqual([p.split("?")[0] for p in server.httpd.paths],
+                         ["/v1/getboardstate"] * 2 + ["/v1/ticker"] * 2)
+
+    def test_stale_while_revalidate(self):
+        import time
+        from bitflyerapi.cache import TTLCache
+        server = self._serve([{"product_code": "BTC_JPY"}],
+                             [{"product_code": "ETH_JPY"}])
+        api = _client(server, cache=TTLCache(ttls={"getmarkets": 0.05}, stale=10))
+        self.addCleanup(api.close)
+        self.assertEqual(api.getmarkets()[0]["product_code"], "BTC_JPY")
+        time.sleep(0.06)
+        # 期限切れでも古い応答を即返し、裏で1回だけ取り直す
+        self.assertEqual(api.getmarkets()[0]["product_code"], "BTC_JPY")
+        self.assertEqual(api.getmarkets()[0]["product_code"], "BTC_JPY")
+        for _ in range(100):
+            if api.getmarkets()[0]["product_code"] == "ETH_JPY":
+                break
+            time.sleep(0.01)
+        self.assertEqual(api.getmarkets()[0]["product_code"], "ETH_JPY")
+        self.assertEqual(len(server.httpd.paths), 2)
+
+    def test_disk_cache_shared_between_clients(self):
+        import tempfile
+        from bitflyerapi.cache import TTLCache
+        server = self._serve({"health": "NORMAL"}, {"status": -1, "error_message": "x"})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.db")
+            with _client(server, cache=TTLCache(path=path)) as api:
+                api.gethealth()
+            with _client(server, cache=TTLCache(path=path)) as other:
+                self.assertEqual(other.gethealth(), {"health": "NORMAL"})
+            self.assertEqual(len(server.httpd.paths), 1)
+            # エラー応答はキャッシュしない
+            with _client(server, cache=TTLCache(path=path)) as api:
+                api.getboardstate()
+                api.getboardstate()
+            self.assertEqual(len(server.httpd.paths), 3)
+
+    def test_private_entries_keyed_by_api_key_hash(self):
+        import sqlite3
+        import tempfile
+        from bitflyerapi.cache import TTLCache
+        server = self._serve({"commission_rate": 0.001}, {"commission_rate": 0.002})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.db")
+            for key in ("secret-api-key-1", "secret-api-key-2"):
+                with bitFlyerAPI(key=key, secret="s",
+                                 cache=TTLCache(path=path)) as api:
+                    api.top = server.url
+                    api.gettradingcommission(product_code="BTC_JPY")
+            conn = sqlite3.connect(path)
+            keys = [row[0] for row in conn.execute("SELECT key FROM response_cache")]
+            conn.close()
+        self.assertEqual(len(server.httpd.paths), 2)  # キーごとに別エントリ
+        self.assertEqual(len(keys), 2)
+        self.assertFalse(any("secret-api-key" in k for k in keys))
+
+    def test_async_client_uses_cache(self):
+        import asyncio
+        from bitflyerapi.cache import TTLCache
+        server = self._serve({"state": "RUNNING"})
+        cache = TTLCache()
+
+        async def run():
+            async with AsyncBitFlyerAPI(key="", secret="", cache=cache) as api:
+                api.top = server.url
+                return [await api.getboardstate() for _ in range(3)]
+        self.assertEqual(asyncio.run(run()), [{"state": "RUNNING"}] * 3)
+        asyncio.run(run())  # 別クライアントでも同じキャッシュを共有
+        self.assertEqual(len(server.httpd.paths), 1)
+        self.assertEqual((cache.hits, cache.misses), (5, 1))
+
+    def test_async_disk_cache_runs_off_the_event_loop(self):
+        import asyncio
+        import tempfile
+        from bitflyerapi.cache import TTLCache
+        server = self._serve({"state": "RUNNING"})
+        threads = []
+
+        class Cache(TTLCache):
+            def _connect(self):
+                threads.append(threading.current_thread())
+                return super()._connect()
+
+        async def run(cache):
+            async with AsyncBitFlyerAPI(key="", secret="", cache=cache) as api:
+                api.top = server.url
+                return await api.getboardstate()
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = Cache(path=os.path.join(tmp, "cache.db"))
+            del threads[:]  # テーブル作成分
+            self.assertEqual(asyncio.run(run(cache)), {"state": "RUNNING"})
+        self.assertTrue(threads)  # 読み込み(ミス)と書き込み
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+class TestAsyncClient(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.server = _LocalServer(reply=lambda h: {"path": h.path})
+
+    def tearDown(self):
+        self.server.close()
+
+    async def test_gather_public_calls(self):
+        import asyncio
+        async with AsyncBitFlyerAPI(key="", secret="") as api:
+            api.top = self.server.url
+            ticker, board, state = await asyncio.gather(
+                api.ticker(product_code="BTC_JPY"),
+                api.board(product_code="ETH_JPY"),
+                api.getboardstate(product_code="BTC_JPY"))
+        self.assertEqual(ticker["path"], "/v1/ticker?product_code=BTC_JPY")
+        self.assertEqual(board["path"], "/v1/board?product_code=ETH_JPY")
+        self.assertTrue(state["path"].startswith("/v1/getboardstate"))
+
+    async def test_sqlite_limiter_runs_off_the_event_loop(self):
+        import tempfile
+        threads = []
+
+        class Bucket(SQLiteTokenBucket):
+            def reserve(self, tokens=1):
+                threads.append(threading.current_thread())
+                return super().reserve(tokens)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            bucket = Bucket(os.path.join(tmp, "rl.db"), "public", 100)
+            async with AsyncBitFlyerAPI(key="", secret="", public_limiter=bucket) as api:
+                api.top = self.server.url
+                await api.ticker(product_code="BTC_JPY")
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+    async def test_every_endpoint_is_coroutine_function(self):
+        import inspect
+        for name in ("markets", "ticker", "executions", "getbalance",
+                     "sendchildorder", "sendparentorder", "getchildorders"):
+            self.assertTrue(inspect.iscoroutinefunction(
+                getattr(AsyncBitFlyerAPI, name)), name)
+
+    async def test_async_iter_executions(self):
+        fake = _FakeExecutions(12)
+
+        async def executions(**params):
+            return fake(**params)
+        api = AsyncBitFlyerAPI(key="", secret="")
+        api.executions = executions
+        ids = [ex["id"] async for ex in api.iter_executions(
+            "BTC_JPY", after_id=3, page_size=4)]
+        self.assertEqual(ids, list(range(12, 3, -1)))
+
+    async def test_private_call_without_keys_raises(self):
+        api = AsyncBitFlyerAPI(key="", secret="")
+        with self.assertRaises(AuthException):
+            await api.getbalance()
+
+    async def test_retries_and_typed_errors(self):
+        self.server.httpd.reply = _scripted(_Raw(503), {"ltp": 1}, _Raw(200, b"<html>"))
+        async with AsyncBitFlyerAPI(key="", secret="", backoff=0.001) as api:
+            api.top = self.server.url
+            self.assertEqual(await api.ticker(product_code="BTC_JPY"), {"ltp": 1})
+            with self.assertRaises(APIException):
+                await api.ticker(product_code="BTC_JPY")
+        self.assertEqual(len(self.server.httpd.paths), 3)
+
+    async def test_observers(self):
+        from bitflyerapi.metrics import MetricsCollector
+        metrics = MetricsCollector()
+        async with AsyncBitFlyerAPI(key="", secret="", observers=[metrics]) as api:
+            api.top = self.server.url
+            await api.ticker(product_code="BTC_JPY")
+        self.assertEqual(metrics.stats()["/v1/ticker"]["statuses"], {200: 1})
+
+
+class _WSServer:
+    """JSON-RPCの購読要求に応じて channelMessage を返すローカルWSサーバー。
+
+    messages: 接続ごとに送るメッセージ列。close_after=True なら送信後に切断する。
+    """
+
+    def __init__(self, messages, close_after=False):
+        self.messages = messages
+        self.close_after = close_after
+        self.subscribes = []
+
+    async def handler(self, ws):
+        import asyncio
+        async for raw in ws:
+            req = json.loads(raw)
+            await ws.send(json.dumps({"jsonrpc": "2.0", "id": req["id"],
+                                      "result": True}))
+            if req["method"] != "subscribe":
+                continue
+            channel = req["params"]["channel"]
+            self.subscribes.append(channel)
+            for m in self.messages:
+                await ws.send(json.dumps({
+                    "jsonrpc": "2.0", "method": "channelMessage",
+                    "params": {"channel": channel, "message": m}}))
+            if self.close_after:
+                await asyncio.sleep(0.01)
+                await ws.close()
+                return
+
+    async def __aenter__(self):
+        from websockets.asyncio.server import serve
+        self._server = await serve(self.handler, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = "ws://127.0.0.1:%d" % port
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        await self._server.wait_closed()
+
+
+class TestRealtimeClient(unittest.IsolatedAsyncioTestCase):
+    async def test_callback_and_stream_receive_messages(self):
+        import asyncio
+        from bitflyerapi.realtime import (RealtimeClient, executions_channel,
+                                          ticker_channel)
+        async with _WSServer([{"ltp": 1}, {"ltp": 2}]) as server:
+            client = RealtimeClient(url=server.url)
+            got = []
+            client.subscribe(ticker_channel("BTC_JPY"), got.append)
+            stream = client.stream(executions_channel("BTC_JPY"))
+            task = asyncio.ensure_future(client.run())
+            received = [await stream.__anext__() for _ in range(2)]
+            client.stop()
+            await asyncio.wait_for(task, 2)
+        self.assertEqual(received, [{"ltp": 1}, {"ltp": 2}])
+        self.assertEqual(got, [{"ltp": 1}, {"ltp": 2}])
+
+    async def test_reconnect_resubscribes(self):
+        import asyncio
+        from bitflyerapi.realtime import RealtimeClient, board_channel
+        async with _WSServer([{"mid_price": 1}], close_after=True) as server:
+            client = RealtimeClient(url=server.url, reconnect_delay=0.01)
+            stream = client.stream(board_channel("BTC_JPY"))
+            task = asyncio.ensure_future(client.run())
+            for _ in range(3):
+                await asyncio.wait_for(stream.__anext__(), 2)
+            client.stop()
+            await asyncio.wait_for(task, 2)
+        self.assertGreaterEqual(client.connections, 3)
+        self.assertEqual(set(server.subscribes), {"lightning_board_BTC_JPY"})
+
+    async def test_failing_callback_does_not_stop_client(self):
+        import asyncio
+        from bitflyerapi.realtime import RealtimeClient, ticker_channel
+
+        def broken(message):
+            raise KeyError("best_bid")
+
+        async with _WSServer([{"ltp": 1}], close_after=True) as server:
+            client = RealtimeClient(url=server.url, reconnect_delay=0.01)
+            client.subscribe(ticker_channel("BTC_JPY"), broken)
+            stream = client.stream(ticker_channel("BTC_JPY"))
+            task = asyncio.ensure_future(client.run())
+            with self.assertLogs("bitflyerapi.realtime", "ERROR"):
+                for _ in range(2):
+                    await asyncio.wait_for(stream.__anext__(), 2)
+                await client._dispatch("not json")
+            client.stop()
+            await asyncio.wait_for(task, 2)
+        self.assertGreaterEqual(client.connections, 2)
+
+    async def test_failed_subscribe_reconnects(self):
+        import asyncio
+        from bitflyerapi.realtime import RealtimeClient, board_channel, ticker_channel
+        async with _WSServer([{"n": 1}]) as server:
+            client = RealtimeClient(url=server.url, reconnect_delay=0.01)
+            first = client.stream(board_channel("BTC_JPY"))
+            task = asyncio.ensure_future(client.run())
+            await asyncio.wait_for(first.__anext__(), 2)
+            call = client._call
+
+            async def broken_once(method, params):
+                client._call = call
+                raise ConnectionError("send failed")
+            client._call = broken_once
+            with self.assertLogs("bitflyerapi.realtime", "WARNING"):
+                second = client.stream(ticker_channel("BTC_JPY"))
+                self.assertEqual(await asyncio.wait_for(second.__anext__(), 2),
+                                 {"n": 1})
+            client.stop()
+            await asyncio.wait_for(task, 2)
+        self.assertEqual(client.connections, 2)
+        self.assertFalse(client._tasks)
+
+    async def test_backpressure_drop_oldest(self):
+        import asyncio
+        from bitflyerapi.realtime import RealtimeClient
+        async with _WSServer([{"n": i} for i in range(5)]) as server:
+            client = RealtimeClient(url=server.url)
+            stream = client.stream("lightning_ticker_BTC_JPY", maxsize=2,
+                                   drop_oldest=True)
+            task = asyncio.ensure_future(client.run())
+            while stream.dropped < 3:
+                await asyncio.sleep(0.01)
+            client.stop()
+            await asyncio.wait_for(task, 2)
+        self.assertEqual(await stream.__anext__(), {"n": 3})
+        self.assertEqual(await stream.__anext__(), {"n": 4})
+
+
+def _levels(*pairs):
+    return [{"price": p, "size": q} for p, q in pairs]
+
+
+class TestOrderBook(unittest.TestCase):
+    def _book(self):
+        from bitflyerapi.orderbook import OrderBook
+        return OrderBook.from_board({
+            "mid_price": 1000,
+            "bids": _levels((999, 1.0), (995, 2.0), (980, 5.0)),
+            "asks": _levels((1001, 0.5), (1004, 1.5), (1020, 4.0)),
+        })
+
+    def test_best_quotes_and_depth_band(self):
+        book = self._book()
+        self.assertEqual(book.best_bid(), (999.0, 1.0))
+        self.assertEqual(book.best_ask(), (1001.0, 0.5))
+        self.assertEqual(book.depth(0.5), (3.0, 2.0))  # ±5円
+        self.assertEqual(book.depth(5.0), (8.0, 6.0))
+
+    def test_diff_insert_update_delete(self):
+        book = self._book()
+        book.apply_diff({"mid_price": 1000.5,
+                         "bids": _levels((1000, 0.3), (995, 0)),
+                         "asks": _levels((1001, 2.0))})
+        self.assertEqual(book.best_bid(), (1000.0, 0.3))
+        self.assertEqual(book.best_ask(), (1001.0, 2.0))
+        self.assertNotIn(995.0, book.bids.sizes)
+        self.assertEqual(book.bids.prices, [980.0, 999.0, 1000.0])
+
+    def test_crossing_diff_evicts_stale_levels(self):
+        book = self._book()
+        book.apply_diff({"bids": _levels((1004, 1.0))})  # 売り板を食った買い
+        self.assertEqual(book.best_ask(), (1020.0, 4.0))
+        self.assertEqual(book.best_bid(), (1004.0, 1.0))
+
+    def test_diff_before_snapshot_ignored_and_snapshot_resyncs(self):
+        from bitflyerapi.orderbook import OrderBook
+        book = OrderBook()
+        book.apply_diff({"bids": _levels((100, 1.0))})
+        self.assertFalse(book.ready)
+        self.assertIsNone(book.best_bid())
+        book.apply_snapshot({"mid_price": 10, "bids": _levels((9, 1.0)),
+                             "asks": _levels((11, 1.0))})
+        book.apply_snapshot({"mid_price": 20, "bids": _levels((19, 2.0)),
+                             "asks": _levels((21, 1.0))})
+        self.assertEqual(book.bids.prices, [19.0])
+        self.assertEqual(book.mid(), 20.0)
+
+    def test_depth_weighted_mid_leans_to_thin_side(self):
+        book = self._book()
+        # 買い3.0 / 売り2.0 → 売り側(薄い側)に寄る
+        self.assertGreater(book.depth_weighted_mid(0.5), 1000.0)
+        from bitflyerapi.orderbook import OrderBook
+        self.assertEqual(OrderBook().depth_weighted_mid(0.5, mid=50.0), 50.0)
+
+
+class _FakeExecutions:
+    """id 1..n の約定を持つ executions のエミュレーション(新しい順で返す)。"""
+
+    def __init__(self, n, overlap=0):
+        self.items = [{"id": i, "exec_date": "2026-07-07T10:%02d:00.0" % (i % 60),
+                       "price": 100 + i, "size": 0.1, "side": "BUY"}
+                      for i in range(n, 0, -1)]
+        self.overlap = overlap  # ページ境界で重複を返す(dedupeの確認用)
+        self.calls = []
+
+    def __call__(self, count=100, before=None, after=None, **params):
+        self.calls.append({"count": count, "before": before, "after": after})
+        if before is not None:
+            before += self.overlap
+        rows = [ex for ex in self.items
+                if (before is None or ex["id"] < before)
+                and (after is None or ex["id"] > after)]
+        return rows[:count]
+
+
+class TestPagination(unittest.TestCase):
+    def _api(self, fake):
+        api = bitFlyerAPI(key="", secret="")
+        api.executions = fake
+        return api
+
+    def test_walks_all_pages_without_duplicates(self):
+        fake = _FakeExecutions(23, overlap=2)
+        ids = [ex["id"] for ex in self._api(fake).iter_executions(
+            "BTC_JPY", page_size=5)]
+        self.assertEqual(ids, list(range(23, 0, -1)))
+        self.assertEqual(fake.calls[1]["before"], 19)
+
+    def test_after_id_bound_and_lazy(self):
+        fake = _FakeExecutions(1000)
+        it = self._api(fake).iter_executions("BTC_JPY", after_id=990, page_size=500)
+        self.assertEqual([ex["id"] for ex in it], list(range(1000, 990, -1)))
+        self.assertEqual(len(fake.calls), 1)
+        self.assertEqual(fake.calls[0]["after"], 990)
+
+    def test_resume_from_cursor_and_time_bound(self):
+        fake = _FakeExecutions(30)
+        api = self._api(fake)
+        first = []
+        for ex in api.iter_executions("BTC_JPY", page_size=4):
+            first.append(ex["id"])
+            if len(first) == 6:
+                break
+        rest = [ex["id"] for ex in api.iter_executions(
+            "BTC_JPY", before_id=first[-1], page_size=4,
+            since="2026-07-07T10:20:00")]
+        self.assertEqual(first + rest, list(range(30, 19, -1)))
+
+    def test_time_bound_compares_instants(self):
+        from datetime import datetime, timedelta, timezone
+        fake = _FakeExecutions(0)
+        fake.items = [{"id": 4, "exec_date": "2026-07-07T10:20:01.5"},
+                      {"id": 3, "exec_date": "2026-07-07T10:20:00.1234567"},
+                      {"id": 2, "exec_date": "2026-07-07T10:20:00.1Z"},
+                      {"id": 1, "exec_date": "2026-07-07T10:19:59.99"}]
+        api = self._api(fake)
+        jst = timezone(timedelta(hours=9))
+        for since in ("2026-07-07T10:20:00.1",
+                      datetime(2026, 7, 7, 10, 20, 0, 100000),
+                      datetime(2026, 7, 7, 19, 20, 0, 100000, tzinfo=jst)):
+            ids = [ex["id"] for ex in api.iter_executions("BTC_JPY", since=since)]
+            self.assertEqual(ids, [4, 3, 2], since)
+
+
+
+class _RecordingBucket:
+    def __init__(self):
+        self.calls = 0
+
+    def acquire(self, tokens=1):
+        self.calls += tokens
+        return 0.0
+
+    def reserve(self, tokens=1):
+        return self.acquire(tokens)
+
+
+class TestRateLimit(unittest.TestCase):
+    def test_burst_then_paced(self):
+        bucket = TokenBucket(10, per=1.0, capacity=3)
+        waits = [bucket.reserve() for _ in range(5)]
+        self.assertEqual(waits[:3], [0.0, 0.0, 0.0])
+        # 4件目・5件目は0.1秒刻みで後ろに並ぶ(失敗させずに待たせる)
+        self.assertAlmostEqual(waits[3], 0.1, delta=0.02)
+        self.assertAlmostEqual(waits[4], 0.2, delta=0.02)
+
+    def test_sqlite_bucket_shared_between_instances(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "rate.db")
+            a = SQLiteTokenBucket(path, "public", 10, capacity=2)
+            b = SQLiteTokenBucket(path, "public", 10, capacity=2)
+            other = SQLiteTokenBucket(path, "private", 10, capacity=2)
+            self.assertEqual(a.reserve(), 0.0)
+            self.assertEqual(b.reserve(), 0.0)
+            self.assertGreater(a.reserve(), 0.0)  # b の消費が a にも見える
+            self.assertEqual(other.reserve(), 0.0)  # バケツ名ごとに独立
+
+    def test_client_picks_bucket_by_path(self):
+        server = _LocalServer()
+        public, private = _RecordingBucket(), _RecordingBucket()
+        try:
+            with _client(server, public_limiter=public,
+                         private_limiter=private) as api:
+                api.ticker(product_code="BTC_JPY")
+                api.board(product_code="BTC_JPY")
+                self.assertIs(api.limiter("/v1/me/getbalance"), private)
+        finally:
+            server.close()
+        self.assertEqual((public.calls, private.calls), (2, 0))
+
+    def test_rate_limit_option_shares_process_buckets(self):
+        a = bitFlyerAPI(key="", secret="", rate_limit=True)
+        b = bitFlyerAPI(key="", secret="", rate_limit=True)
+        self.assertIs(a.public_limiter, b.public_limiter)
+        self.assertIsNot(a.public_limiter, a.private_limiter)
+        self.assertIsNone(bitFlyerAPI(key="", secret="").limiter("/v1/ticker"))
+
+
+
+class TestRecords(unittest.TestCase):
+    def test_epoch_ms(self):
+        from datetime import datetime, timezone
+        from bitflyerapi.records import epoch_ms
+        expected = int(datetime(2026, 7, 7, 10, 1, 30, 120000,
+                                tzinfo=timezone.utc).timestamp() * 1000)
+        self.assertEqual(epoch_ms("2026-07-07T10:01:30.12"), expected)
+        self.assertEqual(epoch_ms("2026-07-07T10:01:30"), expected - 120)
+        self.assertEqual(epoch_ms("2026-07-07T10:01:30.1234567Z"), expected + 3)
+
+    def test_execution_converted_once(self):
+        from bitflyerapi import records
+        row = {"id": 7, "side": "SELL", "price": 15000000, "size": "0.01",
+               "exec_date": "2026-07-07T10:01:30.5"}
+        ex, = records.executions([row])
+        self.assertEqual((ex.id, ex.side, ex.price, ex.size), (7, "SELL", 15000000.0, 0.01))
+        self.assertEqual(records.minute_label(ex.exec_ms // 60000 * 60000),
+                         "2026-07-07T10:01")
+        self.assertIs(records.executions([ex])[0], ex)  # 変換済みはそのまま
+        self.assertFalse(hasattr(ex, "__dict__"))  # __slots__ で dict を持たない
+        self.assertEqual(records.executions([{"exec_date": row["exec_date"]}])[0].side, "")
+
+    def test_ticker_and_board_levels(self):
+        from bitflyerapi import records
+        t = records.Ticker.from_dict({"product_code": "BTC_JPY", "ltp": 1.5e7,
+                                      "best_bid": "14999000", "best_ask": 15001000,
+                                      "timestamp": "2026-07-07T10:00:00.25"})
+        self.assertEqual((t.ltp, t.best_bid, t.volume_by_product), (1.5e7, 14999000.0, 0.0))
+        self.assertEqual(t.timestamp_ms % 1000, 250)
+        with self.assertRaises(KeyError):  # エラー応答を0円のティッカーにしない
+            records.Ticker.from_dict({"status": -1, "error_message": "x"})
+        level, = records.board_levels([{"price": 100, "size": 2}])
+        self.assertEqual((level.price, level.size), (100.0, 2.0))
+
+
+
+class TestMockServer(unittest.TestCase):
+    def _mock(self, **kw):
+        from bitflyerapi.mockserver import MockBitFlyer
+        mock = MockBitFlyer(products=("BTC_JPY", "ETH_JPY"), tick_interval=None, **kw)
+        mock.start()
+        self.addCleanup(mock.stop)
+        return mock
+
+    def _api(self, mock, **kw):
+        api = bitFlyerAPI(key=mock.key, secret=mock.secret, top=mock.url,
+                          backoff=0.001, **kw)
+        self.addCleanup(api.close)
+        return api
+
+    def test_public_endpoints_and_pagination(self):
+        mock = self._mock()
+        api = self._api(mock)
+        ticker = api.ticker(product_code="ETH_JPY")
+        self.assertLess(ticker["best_bid"], ticker["best_ask"])
+        mock.advance(300)
+        ids = [ex["id"] for ex in api.iter_executions("BTC_JPY", page_size=100)]
+        self.assertEqual(len(ids), 500)
+        self.assertEqual(ids, sorted(set(ids), reverse=True))
+        self.assertEqual(len(api.board(product_code="BTC_JPY")["bids"]), 100)
+
+    def test_signed_private_endpoints(self):
+        mock = self._mock()
+        api = self._api(mock)
+        jpy = lambda: next(b["amount"] for b in api.getbalance()
+                           if b["currency_code"] == "JPY")
+        before = jpy()
+        api.sendchildorder(product_code="BTC_JPY", child_order_type="MARKET",
+                           side="BUY", size=0.01)
+        self.assertLess(jpy(), before)
+        resting = api.sendchildorder(product_code="BTC_JPY", child_order_type="LIMIT",
+                                     side="BUY", price=1000, size=0.01)
+        self.assertIsNone(api.cancelchildorder(product_code="BTC_JPY", **resting))
+        states = [o["child_order_state"] for o in api.getchildorders(product_code="BTC_JPY")]
+        self.assertEqual(states, ["CANCELED", "COMPLETED"])
+
+        forged = bitFlyerAPI(key=mock.key, secret="wrong", top=mock.url)
+        with self.assertRaises(AuthException):
+            forged.getbalance()
+        forged.close()
+
+    def test_parent_orders_trigger_as_market_moves(self):
+        mock = self._mock()
+        api = self._api(mock)
+        market = mock.markets["BTC_JPY"]
+        bid, ask = market.best()
+        oco = api.sendparentorder(order_method="OCO", parameters=[
+            {"product_code": "BTC_JPY", "condition_type": "LIMIT", "side": "SELL",
+             "price": ask * 1.1, "size": 0.1},
+            {"product_code": "BTC_JPY", "condition_type": "STOP", "side": "SELL",
+             "trigger_price": bid * 0.9, "size": 0.1}])
+        stop = api.sendparentorder(parameters=[
+            {"product_code": "BTC_JPY", "condition_type": "STOP", "side": "SELL",
+             "trigger_price": bid * 0.5, "size": 0.1}])
+        self.assertIsNone(api.cancelparentorder(product_code="BTC_JPY", **stop))
+        self.assertEqual(api.getparentorder(**oco)["order_method"], "OCO")
+
+        market.price *= 0.85
+        mock.advance(1)
+        orders = api.getparentorders(product_code="BTC_JPY")
+        self.assertEqual([o["parent_order_state"] for o in orders],
+                         ["CANCELED", "COMPLETED"])
+        self.assertLess(orders[1]["average_price"], bid * 0.9)
+        child = api.getchildorders(product_code="BTC_JPY")[0]
+        self.assertEqual(child["parent_order_id"], orders[1]["parent_order_id"])
+        self.assertEqual(mock.balances["BTC"], 0.9)
+
+    def test_fault_injection(self):
+        api = self._api(self._mock(error_rate=1.0), max_retries=2)
+        with self.assertRaises(ServerException):
+            api.ticker(product_code="BTC_JPY")
+
+        mock = self._mock(rate_limit=(3, 60))
+        api = self._api(mock, max_retries=0)
+        for _ in range(3):
+            api.ticker(product_code="BTC_JPY")
+        with self.assertRaises(RateLimitException) as cm:
+            api.ticker(product_code="BTC_JPY")
+        self.assertGreater(cm.exception.retry_after, 0)
+        self.assertEqual(mock.requests["/v1/ticker"], 4)
+
+    def test_realtime_feed(self):
+        import asyncio
+        from bitflyerapi.orderbook import OrderBook
+        from bitflyerapi.realtime import RealtimeClient, executions_channel
+        mock = self._mock()
+
+        async def run():
+            client = RealtimeClient(url=mock.ws_url)
+            book = OrderBook()
+            book.attach(client, "BTC_JPY")
+            stream = client.stream(executions_channel("BTC_JPY"))
+            task = asyncio.ensure_future(client.run())
+            while not book.ready:
+                await asyncio.sleep(0.01)
+            mock.advance(3)
+            batch = await asyncio.wait_for(stream.__anext__(), 5)
+            client.stop()
+            await task
+            return book, batch
+        book, batch = asyncio.run(run())
+        self.assertEqual(len(batch), 3)
+        self.assertTrue(book.best_bid()[0] < book.best_ask()[0])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)